@@ -0,0 +1,86 @@
+import os
+import sys
+import argparse
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from utility import *
+from Option import ParseOptions
+from Tuning import Calibrate, TuningProfile, MakeSyntheticImage, TUNING_BUCKETS
+from suite import StandIn
+
+"""
+Check calibration end to end with the stand-in family, no GPU is needed.
+The stand-in is slowed down except with one tile size and thread split, calibration must find them
+for every resolution bucket and save them to the profile, then a family reading the profile must pass them
+to the executable. The profile is written to a temporary file, the profile of the machine is not touched
+
+python bench/calibration.py [--penalty SECONDS] [--tile TILE] [--threads THREADS]
+"""
+
+
+class TunableStandIn(StandIn):
+    """Stand-in family with tile size and threads, runs slower with any settings but the fastest ones"""
+    tunable = True
+    fastest = {"tile": 200, "threads": "2:4:2"} # Settings calibration must find
+    penalty = 1.0 # Seconds slept by runs with other settings
+    profile_path: str | None = None # Profile read when no tuning is fixed
+
+    def __init__(self, options: dict):
+        super().__init__(options)
+        self.tuning_profile = TuningProfile(self.profile_path)
+        self.runs: list[dict | None] = [] # Settings of each run
+
+    def GetTuningArgs(self, input_path: str) -> list[str]:
+        # Like RealEsrganNcnnVulkan.GetTuningArgs, the largest input image decides the settings of a run
+        tuning = self.tuning
+        if tuning is None and self.tuning_profile.Calibrated(self.family_name, self.options["model"]):
+            files = [f"{input_path}/{file}" for file in GetDirList(input_path, "file")] if DirExist(input_path) else [input_path]
+            width, height = max((GetImageSize(file) for file in files), key=lambda size: size[0] * size[1])
+            tuning = self.tuning_profile.Get(self.family_name, self.options["model"], width, height)
+        self.runs.append(tuning)
+        self.latency = 0.0 if tuning == self.fastest else self.penalty
+        if tuning is None: return []
+        return ["-t", str(tuning["tile"]), "-j", tuning["threads"]]
+
+
+def Check(condition: bool, message: str):
+    if not condition:
+        print(f"FAILED: {message}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--penalty", type=float, default=1.0, help="seconds slept by the stand-in with settings other than the fastest")
+    parser.add_argument("--tile", type=int, default=200, help="tile size the stand-in is fastest with")
+    parser.add_argument("--threads", type=str, default="2:4:2", help="thread split the stand-in is fastest with")
+    args = parser.parse_args()
+    TunableStandIn.penalty = args.penalty
+    TunableStandIn.fastest = {"tile": args.tile, "threads": args.threads}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        TunableStandIn.profile_path = f"{temp_dir}/profile.json"
+        options = ParseOptions(["--calibrate", "-f", StandIn.family_name, "-m", "stand-in-x2"])
+        family = TunableStandIn(options)
+
+        def Report(bucket: int, tile: int, threads: str, seconds: float):
+            print(f"  size {bucket:>4}, tile {tile:>3}, threads {threads}: {seconds:.2f}s")
+        profile = Calibrate(family, images_per_run=2, Report=Report, profile_path=TunableStandIn.profile_path)
+
+        Check(family.tuning is None, "the fixed settings of calibration are left on the family")
+        Check(FileExist(TunableStandIn.profile_path), "the profile is not saved")
+        saved = TuningProfile(TunableStandIn.profile_path)
+        Check(saved.settings == profile.settings, "the saved profile differs from the calibrated one")
+        buckets = saved.settings.get(StandIn.family_name, {}).get("stand-in-x2", {})
+        Check(sorted(int(bucket) for bucket in buckets) == TUNING_BUCKETS, f"buckets {sorted(buckets)} are not {TUNING_BUCKETS}")
+        for bucket, setting in buckets.items():
+            Check(setting == TunableStandIn.fastest, f"size {bucket} is calibrated to {setting}, not {TunableStandIn.fastest}")
+
+        # A new family reads the profile and runs the executable with the calibrated settings
+        family = TunableStandIn(options)
+        image_path = f"{temp_dir}/image.png"
+        MakeSyntheticImage(image_path, 300, 400)
+        family.ProcessImage(image_path, f"{temp_dir}/output.png")
+        Check(family.runs == [TunableStandIn.fastest], f"the executable is run with {family.runs}, not the calibrated settings")
+        Check(GetImageSize(f"{temp_dir}/output.png") == (600, 800), "the stand-in output has the wrong size")
+    print(f"Calibration found tile {args.tile} and threads {args.threads} for all {len(TUNING_BUCKETS)} sizes")
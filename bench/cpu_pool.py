@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from PIL import Image
+from CpuPool import CpuPool
+from Workbench import Workbench
+
+"""
+Measure the speedup of CPU-bound stages (resizing and encoding) with worker processes
+against threads, for each number of workers up to the core count
+
+python bench/cpu_pool.py [-n IMAGES] [--size WIDTHxHEIGHT]
+"""
+
+
+def MakeImages(n: int, size: tuple[int, int]) -> list[Image.Image]:
+    return [Image.effect_noise(size, 64 + i).convert("RGB") for i in range(n)]
+
+
+def Work(img: Image.Image) -> bytes:
+    # Resize as the traditional family does, then scale back and encode as the post-scale stage does
+    img = img.resize((img.width * 2, img.height * 2), Image.Resampling.LANCZOS)
+    return Workbench.Encode(img, 0.5, 75, "JPEG")
+
+
+def RunThreads(images: list[Image.Image], workers: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(Work, images))
+    return time.perf_counter() - start
+
+
+def RunProcesses(images: list[Image.Image], workers: int) -> float:
+    pool = CpuPool(workers)
+    try:
+        pool.Map(Work, images[:workers], [()] * workers) # Start the worker processes
+        start = time.perf_counter()
+        pool.Map(Work, images, [()] * len(images))
+        return time.perf_counter() - start
+    finally:
+        pool.Close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--images", type=int, default=16)
+    parser.add_argument("--size", type=str, default="1000x1500")
+    args = parser.parse_args()
+    size = tuple(int(x) for x in args.size.split("x"))
+    images = MakeImages(args.images, size)
+
+    cores = os.cpu_count() or 1
+    base = RunThreads(images, 1)
+    print(f"{args.images} images of {size[0]}x{size[1]}, {cores} cores, 1 thread: {base:.2f}s")
+    print(f"{'workers':>8} {'threads':>10} {'speedup':>8} {'processes':>10} {'speedup':>8}")
+    workers = 1
+    while True:
+        thread_time = RunThreads(images, workers)
+        process_time = RunProcesses(images, workers)
+        print(f"{workers:>8} {thread_time:>9.2f}s {base / thread_time:>7.2f}x {process_time:>9.2f}s {base / process_time:>7.2f}x")
+        if workers >= cores: break
+        workers = min(workers * 2, cores)
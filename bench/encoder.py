@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from PIL import Image, ImageFilter
+from Workbench import Workbench
+from Encoder import ENCODER_PROFILES
+from pixel_art import MakePage
+
+"""
+Measure the encoding time and output size of each encoder profile, for each output format,
+on a synthetic line-art page and a smooth photographic image at model output size, or on given images
+
+python bench/encoder.py [--size WIDTHxHEIGHT] [-q QUALITY] [-r REPEAT] [IMAGE ...]
+"""
+
+
+def MakeImages(size: tuple[int, int]) -> list[tuple[str, Image.Image]]:
+    # Model outputs are smooth, line art is upscaled and photographs blurred to look like them
+    page = MakePage((size[0] // 2, size[1] // 2)).resize(size, Image.Resampling.LANCZOS)
+    photo = Image.effect_noise(size, 30).convert("RGB").filter(ImageFilter.GaussianBlur(2))
+    return [("line art", page), ("photo", photo)]
+
+
+def Measure(img: Image.Image, format: str, quality: int, profile: str, repeat: int) -> tuple[float, int]:
+    # The best of several runs, other processes on the machine only make a run slower
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = Workbench.Encode(img, 1.0, quality, format, profile)
+        seconds.append(time.perf_counter() - start)
+    return min(seconds), len(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("images", nargs="*", help="images to encode instead of the synthetic ones")
+    parser.add_argument("--size", type=str, default="2400x3600")
+    parser.add_argument("-q", "--quality", type=int, default=75)
+    parser.add_argument("-r", "--repeat", type=int, default=1)
+    args = parser.parse_args()
+    if len(args.images) > 0:
+        images = [(os.path.basename(path), Image.open(path).convert("RGB")) for path in args.images]
+    else:
+        images = MakeImages(tuple(int(x) for x in args.size.split("x")))
+
+    print(f"{'image':>12} {'format':>6} {'profile':>9} {'seconds':>8} {'KB':>8} {'size':>6}")
+    for name, img in images:
+        for format in ("JPEG", "PNG", "WEBP"):
+            results = {profile: Measure(img, format, args.quality, profile, args.repeat) for profile in ENCODER_PROFILES}
+            _, balanced_bytes = results["balanced"]
+            for profile, (seconds, size) in results.items():
+                print(f"{name:>12} {format:>6} {profile:>9} {seconds:>8.2f} {size / 1024:>8.0f} {size / balanced_bytes:>5.2f}x")
@@ -0,0 +1,68 @@
+import io
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import pymupdf
+from PIL import Image
+from utility import PdfExtractImages
+
+"""
+Measure the throughput of PDF image extraction in this process and with worker processes,
+for each number of workers up to the core count
+
+python bench/pdf_extract.py [-n PAGES] [--size WIDTHxHEIGHT]
+"""
+
+
+def MakePdf(pdf_path: str, pages: int, size: tuple[int, int]):
+    # A scanned book: one JPEG page image per page, every fourth page a PNG illustration,
+    # and a logo shared by all pages
+    doc = pymupdf.open()
+    logo = io.BytesIO()
+    Image.effect_noise((64, 64), 80).convert("RGB").save(logo, "PNG")
+    for i in range(pages):
+        page = doc.new_page(width=size[0] / 4, height=size[1] / 4)
+        img = Image.effect_noise(size, 40 + i % 20).convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, "PNG" if i % 4 == 3 else "JPEG", quality=85)
+        page.insert_image(page.rect, stream=buffer.getvalue())
+        page.insert_image(pymupdf.Rect(0, 0, 16, 16), stream=logo.getvalue())
+    doc.save(pdf_path)
+
+
+def Measure(pdf_path: str, output_dir: str, jobs: int) -> float:
+    shutil.rmtree(output_dir, ignore_errors=True)
+    start = time.perf_counter()
+    PdfExtractImages(pdf_path, output_dir, jobs)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--pages", type=int, default=200)
+    parser.add_argument("--size", type=str, default="1200x1800")
+    args = parser.parse_args()
+    size = tuple(int(x) for x in args.size.split("x"))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pdf_path = f"{temp_dir}/book.pdf"
+        output_dir = f"{temp_dir}/images"
+        MakePdf(pdf_path, args.pages, size)
+        pdf_size = os.path.getsize(pdf_path)
+
+        cores = os.cpu_count() or 1
+        base = Measure(pdf_path, output_dir, 0)
+        images = len(os.listdir(output_dir))
+        print(f"{args.pages} pages of {size[0]}x{size[1]}, {images} unique images, {pdf_size / 1e6:.1f} MB, {cores} cores")
+        print(f"{'workers':>8} {'seconds':>8} {'images/s':>9} {'MB/s':>7} {'speedup':>8}")
+        print(f"{'-':>8} {base:>8.2f} {images / base:>9.1f} {pdf_size / base / 1e6:>7.1f} {1:>7.2f}x")
+        workers = 1
+        while True:
+            seconds = Measure(pdf_path, output_dir, workers)
+            print(f"{workers:>8} {seconds:>8.2f} {images / seconds:>9.1f} {pdf_size / seconds / 1e6:>7.1f} {base / seconds:>7.2f}x")
+            if workers >= cores: break
+            workers = min(workers * 2, cores)
@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+import random
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from PIL import Image, ImageDraw
+import PixelArt
+
+"""
+Measure the pixel-art scalers of the traditional family on a synthetic line-art page,
+and check that 2x scaling stays within the time budget (one core)
+
+python bench/pixel_art.py [--size WIDTHxHEIGHT] [--budget SECONDS] [-r REPEAT]
+"""
+
+
+def MakePage(size: tuple[int, int]) -> Image.Image:
+    # Strokes of different widths and colors on paper, like a scanned illustration
+    random.seed(0)
+    page = Image.new("RGB", size, (250, 248, 240))
+    draw = ImageDraw.Draw(page)
+    for _ in range(size[0] * size[1] // 15000):
+        points = [(random.randrange(size[0]), random.randrange(size[1])) for _ in range(2)]
+        color = random.choice([(20, 20, 20), (200, 30, 30), (30, 60, 180)])
+        draw.line(points, fill=color, width=random.randint(1, 6))
+    return page
+
+
+def Measure(function, img: Image.Image, n: int, repeat: int) -> float:
+    # The best of several runs, other processes on the machine only make a run slower
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(img, n)
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=str, default="2000x3000")
+    parser.add_argument("--budget", type=float, default=1.0, help="time budget (seconds) of 2x scaling")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+    size = tuple(int(x) for x in args.size.split("x"))
+    page = MakePage(size)
+
+    over_budget = []
+    print(f"{'model':>8} {'seconds':>8} {'Mpixel/s':>9}")
+    for name, function in [("hq", PixelArt.Hqx), ("xbr", PixelArt.Xbr)]:
+        for n in (2, 3, 4):
+            seconds = Measure(function, page, n, args.repeat)
+            print(f"{f"{name}{n}x":>8} {seconds:>8.3f} {size[0] * size[1] / seconds / 1e6:>9.1f}")
+            if n == 2 and seconds > args.budget: over_budget.append(f"{name}{n}x")
+
+    if len(over_budget) > 0:
+        print(f"Over the budget of {args.budget}s: {", ".join(over_budget)}")
+        sys.exit(1)
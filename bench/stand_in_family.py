@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import argparse
+from PIL import Image
+
+"""
+A stand-in for the ncnn executables of model families, with the same command line,
+so that enana can be measured without a GPU. It sleeps for a configurable latency
+and scales images with Pillow instead of running a model
+
+python bench/stand_in_family.py -i INPUT -o OUTPUT [-s SCALE] [-n MODEL] [-f FORMAT] [-t TILE] [-j THREADS]
+                                [--latency SECONDS] [--mp-latency SECONDS] [--mode MODE]
+"""
+
+MODES = {
+    "nearest": Image.Resampling.NEAREST, # Cheapest output, measures enana rather than the stand-in
+    "lanczos": Image.Resampling.LANCZOS, # Smooth output that encodes like a real model output
+    "noise": None, # Output of the right size with incompressible content, the worst case of encoding and writing
+}
+FORMATS = {"jpg": "JPEG", "png": "PNG", "webp": "WEBP"}
+
+
+def ScaleImage(input_file: str, output_file: str, scale: int, mode: str, mp_latency: float):
+    with Image.open(input_file) as img:
+        size = (img.width * scale, img.height * scale)
+        time.sleep(mp_latency * img.width * img.height / 1e6)
+        if MODES[mode] is None:
+            output = Image.effect_noise(size, 64).convert(img.mode if img.mode in ("L", "RGB") else "RGB")
+        else:
+            output = img.convert("RGBA" if "A" in img.getbands() else "RGB").resize(size, MODES[mode])
+    format = FORMATS.get(os.path.splitext(output_file)[1][1:].lower(), "PNG")
+    if format == "JPEG" and output.mode == "RGBA": output = output.convert("RGB")
+    output.save(output_file, format, quality=95, compress_level=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", dest="input_path", required=True, help="input image file or directory")
+    parser.add_argument("-o", dest="output_path", required=True, help="output image file or directory")
+    parser.add_argument("-s", dest="scale", type=int, default=4)
+    parser.add_argument("-n", "-m", dest="model", default="stand-in-x4")
+    parser.add_argument("-f", dest="format", default="png", help="output format of directory mode")
+    parser.add_argument("-t", dest="tile", type=int, default=0, help="tile size, accepted like ncnn executables and ignored")
+    parser.add_argument("-j", dest="threads", default="1:2:2", help="load:proc:save threads, accepted like ncnn executables and ignored")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds slept once per run, like loading the model")
+    parser.add_argument("--mp-latency", type=float, default=0.0, help="seconds slept per input megapixel")
+    parser.add_argument("--mode", choices=list(MODES), default="nearest")
+    args = parser.parse_args()
+
+    time.sleep(args.latency)
+    try:
+        if os.path.isdir(args.input_path):
+            os.makedirs(args.output_path, exist_ok=True)
+            for name in sorted(os.listdir(args.input_path)):
+                output_file = f"{args.output_path}/{os.path.splitext(name)[0]}.{args.format}"
+                ScaleImage(f"{args.input_path}/{name}", output_file, args.scale, args.mode, args.mp_latency)
+        else:
+            ScaleImage(args.input_path, args.output_path, args.scale, args.mode, args.mp_latency)
+    except Exception as e:
+        print(f"stand-in family failed: {e}", file=sys.stderr)
+        sys.exit(1)
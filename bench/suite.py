@@ -0,0 +1,292 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import zipfile
+import argparse
+import platform
+import tempfile
+import subprocess
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import pymupdf
+from PIL import Image, ImageDraw
+from utility import *
+from Error import *
+from Family import Family
+from Option import ParseOptions
+from Progress import Progress
+from Event import StageFinished
+import WorkbenchList
+
+"""
+Measure enana end to end on synthetic books with a stand-in model family, no GPU is needed.
+Each scenario times the InitWorkbench, ProcessAllImage and GenerateTarget phases and the stages of the pipeline,
+micro-benchmarks time Progress, CopyFile, SearchFiles and PackZip. Results are written to a JSON file,
+and compared with the results of another version if given
+
+python bench/suite.py [-n IMAGES] [--size WIDTHxHEIGHT] [--duplicates RATE] [--books epub,pdf]
+                      [--latency SECONDS] [--mp-latency SECONDS] [--mode MODE] [--scale SCALE] [-j JOBS] [--cpu-jobs CPU_JOBS]
+                      [-r REPEAT] [--seed SEED] [-o RESULTS] [--compare OLD_RESULTS]
+"""
+
+STAND_IN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stand_in_family.py")
+
+
+class StandIn(Family):
+    """Stand-in family running bench/stand_in_family.py, its latency and output are set by the suite"""
+    family_name = "stand-in"
+    description = "Stand-in of ncnn executables for benchmarks."
+    supported_image_exts = [".jpg", ".jpeg", ".png", ".webp"]
+    latency = 0.0 # Seconds slept once per run
+    mp_latency = 0.0 # Seconds slept per input megapixel
+    mode = "nearest" # Output behaviour, see stand_in_family.py
+
+    def __init__(self, options: dict):
+        super().__init__(options)
+        self.CheckOptions()
+
+    def ProcessImage(self, input_file: str, output_file: str):
+        self.Run(input_file, output_file, self.output_format_map.get(GetFileExt(output_file).lower(), "png"))
+
+    def ProcessImages(self, io_files: list[tuple[str, str]], stage_dir: str):
+        self.ProcessImagesByDir(io_files, stage_dir, self.Run)
+
+    def Run(self, input_path: str, output_path: str, format: str):
+        tuning_args = self.GetTuningArgs(input_path)
+        cmd = [
+            sys.executable, STAND_IN,
+            "-i", input_path,
+            "-o", output_path,
+            "-s", str(self.model_scale),
+            "-n", self.options["model"],
+            "-f", format,
+            "--latency", str(self.latency),
+            "--mp-latency", str(self.mp_latency),
+            "--mode", self.mode,
+            *tuning_args,
+        ]
+        try:
+            subprocess.run(cmd, check=True, capture_output=True, text=True)
+        except subprocess.CalledProcessError as e:
+            raise ModelRuntimeError(f"Model '{self.options["model"]}' of family '{self.family_name}' FAILED:\n{e.stderr}") from e
+
+    def GetTuningArgs(self, input_path: str) -> list[str]:
+        # Tile size and threads arguments of a run, the stand-in is not tunable
+        return []
+
+    @classmethod
+    def GetDescription(cls) -> str:
+        return cls.description
+
+    @classmethod
+    def GetAllModels(cls) -> list[str]:
+        return ["stand-in-x2", "stand-in-x3", "stand-in-x4"]
+
+    @classmethod
+    def GetDefaultModel(cls) -> str:
+        return "stand-in-x4"
+
+
+def MakeImages(n: int, size: tuple[int, int], duplicates: float, seed: int) -> list[tuple[bytes, str]]:
+    # Line art pages as JPEG, every fourth image a PNG illustration,
+    # a share of `duplicates` images repeats an earlier image (ornaments, blank pages)
+    rng = random.Random(seed)
+    images = []
+    for i in range(n):
+        if i > 0 and rng.random() < duplicates:
+            images.append(images[rng.randrange(i)])
+            continue
+        page = Image.new("RGB", size, (250, 248, 240))
+        draw = ImageDraw.Draw(page)
+        for _ in range(size[0] * size[1] // 15000):
+            points = [(rng.randrange(size[0]), rng.randrange(size[1])) for _ in range(2)]
+            draw.line(points, fill=rng.choice([(20, 20, 20), (200, 30, 30), (30, 60, 180)]), width=rng.randint(1, 6))
+        buffer = io.BytesIO()
+        format = "PNG" if i % 4 == 3 else "JPEG"
+        page.save(buffer, format, quality=85)
+        images.append((buffer.getvalue(), ".png" if format == "PNG" else ".jpg"))
+    return images
+
+
+def MakeEpub(epub_path: str, images: list[tuple[bytes, str]]):
+    # One page per image, duplicates are separate files with the same content
+    with zipfile.ZipFile(epub_path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("mimetype", "application/epub+zip", zipfile.ZIP_STORED)
+        z.writestr("META-INF/container.xml",
+                   '<?xml version="1.0"?><container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                   '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles></container>')
+        manifest, spine = [], []
+        for i, (data, ext) in enumerate(images):
+            z.writestr(f"OEBPS/images/{i:04d}{ext}", data, zipfile.ZIP_STORED)
+            z.writestr(f"OEBPS/text/{i:04d}.xhtml",
+                       f'<?xml version="1.0"?><html xmlns="http://www.w3.org/1999/xhtml"><body><img src="../images/{i:04d}{ext}"/></body></html>')
+            media_type = "image/png" if ext == ".png" else "image/jpeg"
+            manifest.append(f'<item id="img{i}" href="images/{i:04d}{ext}" media-type="{media_type}"/>')
+            manifest.append(f'<item id="page{i}" href="text/{i:04d}.xhtml" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="page{i}"/>')
+        z.writestr("OEBPS/content.opf",
+                   f'<?xml version="1.0"?><package xmlns="http://www.idpf.org/2007/opf" version="2.0"><metadata/>'
+                   f'<manifest>{"".join(manifest)}</manifest><spine>{"".join(spine)}</spine></package>')
+
+
+def MakePdf(pdf_path: str, images: list[tuple[bytes, str]]):
+    # One page per image, PDF writers store an image used on several pages only once,
+    # so duplicates are inserted as separate streams to keep them duplicates
+    doc = pymupdf.open()
+    for data, _ in images:
+        with Image.open(io.BytesIO(data)) as img:
+            page = doc.new_page(width=img.width / 4, height=img.height / 4)
+        page.insert_image(page.rect, stream=data)
+    doc.save(pdf_path)
+    doc.close()
+
+
+def RunScenario(book_path: str, args) -> dict:
+    options = ParseOptions(["-i", book_path, "-o", f"{book_path}.out{GetFileExt(book_path)}", "-f", StandIn.family_name,
+                            "-j", str(args.jobs), "--cpu-jobs", str(args.cpu_jobs), "-s", args.scale, "--cache-size", "0",
+                            "-m", f"stand-in-x{min(max(Ceil(float(args.scale)), 2), 4)}"])
+    family = StandIn(options)
+    workbench = WorkbenchList.GetWorkbenchClass(options["input_path"])(options)
+    stages: dict[str, float] = {}
+    def OnEvent(event):
+        if isinstance(event, StageFinished):
+            stages[event.stage] = stages.get(event.stage, 0.0) + event.seconds
+
+    phases = {}
+    try:
+        start = time.perf_counter()
+        workbench.InitWorkbench(family.supported_image_exts)
+        phases["init"] = time.perf_counter() - start
+        workbench.Subscribe(OnEvent)
+        start = time.perf_counter()
+        workbench.ProcessAllImage(family)
+        phases["process"] = time.perf_counter() - start
+        start = time.perf_counter()
+        workbench.GenerateTarget()
+        phases["generate"] = time.perf_counter() - start
+    finally:
+        workbench.CleanupWorkbench()
+    return {
+        "phases": phases,
+        "stages": stages, # Summed over chunks, stages of different chunks overlap
+        "tasks": workbench.progress.GetTaskNum(),
+        "output_bytes": GetFileSize(options["output_path"]),
+    }
+
+
+def Measure(function, repeat: int) -> float:
+    # The best of several runs, other processes on the machine only make a run slower
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+def RunMicroBenchmarks(temp_dir: str, images: list[tuple[bytes, str]], repeat: int) -> dict[str, float]:
+    results = {}
+
+    # Claim, finish and save every task of a book of 10000 images, as the pipeline does
+    tasks = [f"OEBPS/images/{i:05d}.jpg" for i in range(10000)]
+    progress_path = f"{temp_dir}/progress.json"
+    def RunProgress():
+        for path in (progress_path, f"{progress_path}.journal"):
+            if FileExist(path): DeleteFile(path)
+        progress = Progress(tasks)
+        while (task := progress.GetOneTaskOfStatusAndUpdate("waiting", "processing")) is not None:
+            progress.Update(task, "done")
+            progress.Save(progress_path)
+    results["progress_10000_tasks"] = Measure(RunProgress, repeat)
+
+    # A directory tree of the images of a book among text files
+    tree_dir = f"{temp_dir}/tree"
+    for i, (data, ext) in enumerate(images):
+        MakeDir(f"{tree_dir}/{i % 10}")
+        with open(f"{tree_dir}/{i % 10}/{i:04d}{ext}", "wb") as f:
+            f.write(data)
+        with open(f"{tree_dir}/{i % 10}/{i:04d}.xhtml", "w") as f:
+            f.write("<html/>" * 100)
+
+    MakeDir(f"{temp_dir}/copy")
+    def RunCopyFile():
+        for i, (_, ext) in enumerate(images):
+            CopyFile(f"{tree_dir}/{i % 10}/{i:04d}{ext}", f"{temp_dir}/copy/{i:04d}{ext}")
+    results["copy_file"] = Measure(RunCopyFile, repeat)
+    results["search_files"] = Measure(lambda: SearchFiles(tree_dir, [".jpg", ".png"]), repeat)
+    results["pack_zip"] = Measure(lambda: PackZip(tree_dir, f"{temp_dir}/tree.zip"), repeat)
+    return results
+
+
+def Compare(results: dict, old_results: dict):
+    # Ratios above 1 are slowdowns
+    old_scenarios = {scenario["book"]: scenario for scenario in old_results["scenarios"]}
+    print(f"Compared with version {old_results["version"]} (new / old):")
+    for scenario in results["scenarios"]:
+        old = old_scenarios.get(scenario["book"])
+        if old is None: continue
+        for phase, seconds in scenario["phases"].items():
+            if phase in old["phases"]:
+                print(f"  {f"{scenario["book"]} {phase}":<20} {seconds / old["phases"][phase]:>7.2f}x")
+    for name, seconds in results["micro"].items():
+        if name in old_results["micro"]:
+            print(f"  {name:<20} {seconds / old_results["micro"][name]:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--images", type=int, default=40)
+    parser.add_argument("--size", type=str, default="1200x1800")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="share of images repeating an earlier image")
+    parser.add_argument("--books", type=str, default="epub,pdf")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds slept by the stand-in once per run")
+    parser.add_argument("--mp-latency", type=float, default=0.05, help="seconds slept by the stand-in per input megapixel")
+    parser.add_argument("--mode", type=str, default="lanczos", help="output behaviour of the stand-in: nearest, lanczos or noise")
+    parser.add_argument("--scale", type=str, default="2")
+    parser.add_argument("-j", "--jobs", type=int, default=2)
+    parser.add_argument("--cpu-jobs", type=int, default=0)
+    parser.add_argument("-r", "--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", type=str, default="bench-results.json")
+    parser.add_argument("--compare", type=str, help="results of another version to compare with")
+    args = parser.parse_args()
+    size = tuple(int(x) for x in args.size.split("x"))
+    StandIn.latency, StandIn.mp_latency, StandIn.mode = args.latency, args.mp_latency, args.mode
+
+    results = {
+        "version": VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cores": os.cpu_count(),
+        "config": vars(args),
+        "scenarios": [],
+        "micro": {},
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        images = MakeImages(args.images, size, args.duplicates, args.seed)
+        print(f"{args.images} images of {size[0]}x{size[1]}, {len(set(images))} unique, {os.cpu_count()} cores")
+        print(f"{'book':>6} {'init':>8} {'process':>8} {'generate':>9} {'images/s':>9}")
+        for book in args.books.split(","):
+            # Unique name, the workbench directory is named after the book
+            book_path = f"{temp_dir}/enana-suite-{os.getpid()}.{book}"
+            {"epub": MakeEpub, "pdf": MakePdf}[book](book_path, images)
+            runs = [RunScenario(book_path, args) for _ in range(args.repeat)]
+            best = min(runs, key=lambda run: sum(run["phases"].values()))
+            results["scenarios"].append({"book": book, "images": args.images, "input_bytes": GetFileSize(book_path), **best})
+            phases = best["phases"]
+            print(f"{book:>6} {phases["init"]:>8.2f} {phases["process"]:>8.2f} {phases["generate"]:>9.2f} "\
+                  f"{args.images / sum(phases.values()):>9.1f}")
+            stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in best["stages"].items())
+            print(f"{'':>6} stages: {stages}")
+
+        results["micro"] = RunMicroBenchmarks(temp_dir, images, max(args.repeat, 3))
+        for name, seconds in results["micro"].items():
+            print(f"{name:>22} {seconds:>8.3f}s")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            Compare(results, json.load(f))
@@ -18,7 +18,6 @@ args = [
     # "--lto=yes",
     "--windows-icon-from-ico=icon/icon.png",
     "--nofollow-import-to=matplotlib",
-    "--nofollow-import-to=numpy",
     "--nofollow-import-to=pandas",
     # "--nofollow-import-to=pymupdf",
     # "--nofollow-imports",
@@ -0,0 +1,202 @@
+import threading
+import concurrent.futures
+from Error import *
+from Family import Family
+from Workbench import Workbench, ChunkJob
+from Pipeline import Pipeline
+from Trace import Span
+
+"""
+Scheduling of the books of a batch through one shared pipeline.
+
+Chunk jobs of all books go through the same stage workers and CPU pools, one book after another,
+so the model stage is not drained down to one straggling chunk at the end of every book.
+While the images of a book are being processed, the next book is initialized on a prepare thread
+and the target of the previous book is generated on a pack thread
+"""
+
+
+class BatchBook:
+    """A book of a batch"""
+
+    def __init__(self, family: Family, workbench: Workbench):
+        self.family = family
+        self.workbench = workbench
+        self.status = "waiting" # "waiting", "preparing", "processing", "packing", "done" or "failed"
+        self.resumed = False # Whether processing continues from a checkpoint
+        self.remaining = 0 # Number of chunk jobs not past the last stage
+        self.error: BaseException | None = None # Error that failed the book
+        self.size_budget_result: tuple[int, int, dict[str, int]] | None = None # Result of Workbench.FitSizeBudget
+
+
+class BatchScheduler:
+    """Processes the books of a batch through one shared pipeline"""
+
+    def __init__(self, books: list[BatchBook], options: dict, Report = None):
+        """
+        Args:
+            books: Books in processing order
+            options: Options of the batch, giving the number of workers of each stage and of the CPU pools
+            Report: Function called as `Report(book)` when the status of a book changes, from worker threads
+        """
+        self.books = books
+        self.options = options
+        self.Report = Report
+        self.books_of: dict[int, BatchBook] = {id(book.workbench): book for book in books} # id(workbench) -> book
+        self.changed = threading.Condition() # Notified when the status of a book changes
+        self.prepare_pool: concurrent.futures.ThreadPoolExecutor | None = None
+        self.pack_pool: concurrent.futures.ThreadPoolExecutor | None = None
+        self.packs: list[concurrent.futures.Future] = []
+
+    def Run(self):
+        """
+        Process all books, returns when every book is done or failed.
+        Runtime errors of a book (FileCorruptedError, ModelRuntimeError) fail that book only,
+        other errors stop the batch and are re-raised
+        """
+        cpu_pool, encode_pool = Workbench.MakePools(self.options)
+        for book in self.books: book.workbench.UsePools(book.family, cpu_pool, encode_pool)
+        self.prepare_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="prepare")
+        self.pack_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="pack")
+        try:
+            stages = Workbench.GetPipelineStages(self.options)
+            stages = [(name, self.GuardStage(function, i + 1 == len(stages)), workers) for i, (name, function, workers) in enumerate(stages)]
+            pipeline = Pipeline(stages, OnError=lambda job, error: job.workbench.FailJob(job, error))
+            pipeline.Run(self.IterJobs())
+        finally:
+            self.prepare_pool.shutdown(cancel_futures=True)
+            self.pack_pool.shutdown()
+            for book in self.books: book.workbench.UsePools(book.family, None, None)
+            Workbench.ClosePools(cpu_pool, encode_pool)
+        self.CheckPacks()
+
+    def IterJobs(self):
+        """
+        Iterate the chunk jobs of all books in order, the next book is prepared while the jobs of a book are taken
+        """
+        if len(self.books) == 0: return
+        preparing = self.prepare_pool.submit(self.Prepare, self.books[0])
+        for i, book in enumerate(self.books):
+            jobs = preparing.result()
+            # The book is set processing before the next one is prepared, which waits for it if they share a workbench
+            if book.status != "failed": self.SetStatus(book, "processing")
+            if i + 1 < len(self.books): preparing = self.prepare_pool.submit(self.Prepare, self.books[i + 1])
+            self.CheckPacks()
+            if book.status == "failed": continue
+
+            if not book.workbench.SharesPipeline():
+                self.ProcessAlone(book)
+                continue
+            book.remaining = len(jobs)
+            if len(jobs) == 0: self.packs.append(self.pack_pool.submit(self.Pack, book))
+            yield from jobs
+
+    def Prepare(self, book: BatchBook) -> list[ChunkJob]:
+        """
+        Initialize the workbench of a book if needed, and get its chunk jobs,
+        an empty list if the book failed or does not share the pipeline
+        """
+        # Books of the same file name share a workbench directory, a book waits until the one before it is finished
+        with self.changed:
+            self.changed.wait_for(lambda: not any(
+                other.workbench.workbench_dir == book.workbench.workbench_dir and other.status in ("processing", "packing")
+                for other in self.books if other is not book
+            ))
+        self.SetStatus(book, "preparing")
+        file_name = book.workbench.file_name
+        try:
+            if self.options["restart"] or not book.workbench.WorkbenchInitialized():
+                with Span("InitWorkbench", "phase", book=file_name):
+                    book.workbench.InitWorkbench(book.family.supported_image_exts)
+            else:
+                book.resumed = True
+            if not book.workbench.SharesPipeline(): return []
+            return book.workbench.PrepareJobs(book.family)
+        except (FileCorruptedError, ModelRuntimeError) as e:
+            self.Fail(book, e)
+            return []
+
+    def ProcessAlone(self, book: BatchBook):
+        """
+        Process the images of a book that does not share the pipeline, with its own pipeline
+        """
+        try:
+            with Span("ProcessAllImage", "phase", book=book.workbench.file_name):
+                book.workbench.ProcessAllImage(book.family)
+        except (FileCorruptedError, ModelRuntimeError) as e:
+            self.Fail(book, e)
+            return
+        self.packs.append(self.pack_pool.submit(self.Pack, book))
+
+    def GuardStage(self, function, last: bool):
+        """
+        Wrap a stage function, so that runtime errors fail the book of the job instead of the batch.
+        Jobs of a failed book pass the following stages without being processed
+        Args:
+            function: Stage function
+            last: Whether it is the last stage, after which the book is packed when all its jobs passed
+        """
+        def Run(job: ChunkJob) -> ChunkJob:
+            book = self.books_of[id(job.workbench)]
+            if book.error is None:
+                try:
+                    job = function(job)
+                except (FileCorruptedError, ModelRuntimeError) as e:
+                    job.workbench.FailJob(job, e)
+                    if book.error is None: book.error = e
+            if last: self.FinishJob(book)
+            return job
+        return Run
+
+    def FinishJob(self, book: BatchBook):
+        """
+        Count a job of a book past the last stage, the book is packed (or cleaned up if failed) after its last job
+        """
+        with self.changed:
+            book.remaining -= 1
+            if book.remaining > 0: return
+        if book.error is not None:
+            self.Fail(book, book.error)
+        else:
+            self.packs.append(self.pack_pool.submit(self.Pack, book))
+
+    def Pack(self, book: BatchBook):
+        """
+        Fit the size budget if set, and generate the target of a book
+        """
+        self.SetStatus(book, "packing")
+        file_name = book.workbench.file_name
+        try:
+            if self.options.get("size_budget") is not None:
+                with Span("FitSizeBudget", "phase", book=file_name):
+                    book.size_budget_result = book.workbench.FitSizeBudget()
+            with Span("GenerateTarget", "phase", book=file_name):
+                book.workbench.GenerateTarget()
+        except (FileCorruptedError, ModelRuntimeError) as e:
+            self.Fail(book, e)
+            return
+        self.SetStatus(book, "done")
+
+    def Fail(self, book: BatchBook, error: BaseException):
+        """
+        Fail a book whose jobs are all finished, its workbench is cleaned up
+        """
+        book.error = error
+        book.workbench.CleanupWorkbench()
+        self.SetStatus(book, "failed")
+
+    def CheckPacks(self):
+        """
+        Re-raise the first error that is not a runtime error of a book, of finished packs
+        """
+        for future in list(self.packs):
+            if future.done() and future.exception() is not None: raise future.exception()
+
+    def SetStatus(self, book: BatchBook, status: str):
+        """
+        Set the status of a book and report it
+        """
+        with self.changed:
+            book.status = status
+            self.changed.notify_all()
+        if self.Report is not None: self.Report(book)
@@ -0,0 +1,138 @@
+import sys
+import json
+import time
+import multiprocessing
+import concurrent.futures
+from utility import *
+from Error import *
+import FamilyList
+from Workbench import Workbench
+from Encoder import DEFAULT_ENCODER_PROFILE
+
+
+BENCHMARK_SAMPLES = 8 # Default number of sample images
+
+
+class BenchmarkResult:
+    """Measurements of one family and model over the sample images"""
+
+    def __init__(self, family_name: str, model: str):
+        self.family_name = family_name
+        self.model = model
+        self.images = 0 # Number of images processed
+        self.megapixels = 0.0 # Megapixels of the input images
+        self.seconds = 0.0 # Wall time of the model over all images
+        self.peak_memory: int | None = None # Peak resident memory (bytes) of the model and its process, None if unknown
+        self.output_bytes: list[int] = [] # Size of each encoded output image
+
+    def GetMegapixelsPerSecond(self) -> float:
+        """
+        Get the input megapixels processed per second
+        """
+        return self.megapixels / self.seconds if self.seconds > 0 else 0.0
+
+    def GetBytesPerImage(self) -> float:
+        """
+        Get the average size of an encoded output image
+        """
+        return sum(self.output_bytes) / len(self.output_bytes) if len(self.output_bytes) > 0 else 0.0
+
+    def ToDict(self) -> dict:
+        return {
+            "family": self.family_name,
+            "model": self.model,
+            "images": self.images,
+            "megapixels": self.megapixels,
+            "seconds": self.seconds,
+            "megapixels_per_second": self.GetMegapixelsPerSecond(),
+            "peak_memory": self.peak_memory,
+            "output_bytes": self.output_bytes,
+            "bytes_per_image": self.GetBytesPerImage(),
+        }
+
+
+def GetPeakMemory() -> int | None:
+    """
+    Get the peak resident memory (bytes) of this process and of its largest finished child process,
+    None on platforms without the `resource` module
+    """
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    unit = 1 if sys.platform == "darwin" else 1024 # ru_maxrss is in bytes on macOS, in KB elsewhere
+    return unit * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def GetOutputName(options: dict) -> str:
+    """
+    Get the file name (without extension) of the outputs of a family and model
+    """
+    return f"{options["family"]}-{options["model"]}"
+
+
+def BenchmarkModel(options: dict, samples: list[tuple[str, str]], stage_dir: str) -> BenchmarkResult:
+    """
+    Process the sample images with one family and model, run in a fresh process so that its peak memory is its own
+    Args:
+        options: Options of the family, with model and scale already checked
+        samples: List of (sample image path, directory of the sample where the output is written)
+        stage_dir: Directory where temporary files can be placed
+    """
+    family = FamilyList.GetFamilyClass(options["family"])(options)
+    family.CheckOptions()
+    result = BenchmarkResult(options["family"], options["model"])
+    sizes = [GetImageSize(sample_path) for sample_path, _ in samples]
+    result.images = len(samples)
+    result.megapixels = sum(width * height for width, height in sizes) / 1e6
+
+    # All samples go to the model at once, as a chunk of the workbench does
+    start = time.perf_counter()
+    outputs = family.ProcessImageObjects([sample_path for sample_path, _ in samples], stage_dir)
+    result.seconds = time.perf_counter() - start
+    result.peak_memory = GetPeakMemory()
+
+    # Outputs are encoded as the workbench does, next to the original of their sample
+    for (sample_path, sample_dir), img in zip(samples, outputs):
+        ext = GetFileExt(sample_path)
+        data = Workbench.Encode(img, options["scale"] / family.model_scale, options["quality"], Workbench.GetImageFormat(sample_path),
+                                options.get("encoder", DEFAULT_ENCODER_PROFILE))
+        with open(f"{sample_dir}/{GetOutputName(options)}{ext}", "wb") as f:
+            f.write(data)
+        result.output_bytes.append(len(data))
+    return result
+
+
+def RunBenchmark(options_list: list[dict], sample_paths: list[str], output_dir: str, Report = None) -> list[BenchmarkResult]:
+    """
+    Run every family and model over the sample images, and save the results.
+    Each sample gets a directory in the output directory with its original and the output of every model side by side
+    Args:
+        options_list: Options of each family and model, with model and scale already checked
+        sample_paths: Sample image paths
+        output_dir: Output directory
+        Report: Function called after each model as `Report(result)`
+    """
+    samples = []
+    for sample_path in sample_paths:
+        sample_dir = f"{output_dir}/{GetFileNameWithoutExt(sample_path)}"
+        MakeDir(sample_dir)
+        CopyFile(sample_path, f"{sample_dir}/original{GetFileExt(sample_path)}")
+        samples.append((sample_path, sample_dir))
+
+    results = []
+    stage_dir = f"{ROOT}/workbench/.benchmark"
+    try:
+        for options in options_list:
+            # A spawned process does not inherit the memory of this one
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                result = executor.submit(BenchmarkModel, options, samples, stage_dir).result()
+            results.append(result)
+            if Report is not None: Report(result)
+    finally:
+        if DirExist(stage_dir): DeleteDir(stage_dir)
+
+    with open(f"{output_dir}/results.json", "w") as f:
+        json.dump([result.ToDict() for result in results], f, indent=4)
+    return results
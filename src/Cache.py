@@ -0,0 +1,131 @@
+import os
+import time
+import hashlib
+import threading
+from utility import *
+from Encoder import DEFAULT_ENCODER_PROFILE
+
+
+class ResultCache:
+    """
+    A persistent on-disk cache of processed images shared by all books and enana processes.
+    Entries are addressed by the content hash of the original image and the processing options.
+    Entries are published by atomic rename, and the least recently used entries are evicted
+    when the total size exceeds the size limit
+    """
+    stale_lock_seconds = 60 # An eviction lock older than this is considered left by a crashed process
+
+    def __init__(self, cache_dir: str, size_limit: int):
+        """
+        Args:
+            cache_dir: Cache directory
+            size_limit: Maximum total size of the cache in bytes
+        """
+        self.cache_dir = cache_dir
+        self.size_limit = size_limit
+        self.size: int | None = None # Estimated total size, None means not scanned yet
+        self.lock = threading.Lock()
+        MakeDir(self.cache_dir)
+
+    @classmethod
+    def MakeKey(cls, image_path: str, options: dict) -> str:
+        """
+        Make the cache key of an image processed with the given options
+        """
+        content_hash = HashFile(image_path)
+        settings = f"{options["family"]}|{options["model"]}|{options["pre_scale"]}|{options["scale"]}|{options["quality"]}|"\
+                   f"{options.get("encoder", DEFAULT_ENCODER_PROFILE)}"
+        # Tiled results differ slightly at the tile seams, keys without tiling stay those of earlier versions
+        if options.get("tile_threshold", 0) > 0: settings += f"|tile{options["tile_threshold"]}"
+        return hashlib.sha256(f"{content_hash}|{settings}".encode()).hexdigest()
+
+    def GetEntryPath(self, key: str) -> str:
+        """
+        Get the file path of a cache entry
+        """
+        return f"{self.cache_dir}/{key[:2]}/{key}"
+
+    def Get(self, key: str, output_path: str) -> bool:
+        """
+        Copy the cached image to `output_path`, returns whether the cache hits
+        """
+        entry_path = self.GetEntryPath(key)
+        try:
+            CopyFile(entry_path, output_path)
+            os.utime(entry_path) # Mark as recently used
+        except FileNotFoundError: # Not cached, or evicted by another process meanwhile
+            return False
+        except PermissionError: # Being evicted by another process on Windows
+            return False
+        return True
+
+    def Put(self, key: str, image_path: str):
+        """
+        Add a processed image to the cache
+        """
+        entry_path = self.GetEntryPath(key)
+        MakeDir(GetFileDir(entry_path))
+        # Write to a private temporary file first, other processes never see a partial entry
+        tmp_path = f"{entry_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        CopyFile(image_path, tmp_path)
+        os.replace(tmp_path, entry_path)
+
+        with self.lock:
+            if self.size is None: self.size = self.ScanSize()
+            self.size += os.path.getsize(entry_path)
+            over_limit = self.size > self.size_limit
+        if over_limit: self.Evict()
+
+    def ScanSize(self) -> int:
+        """
+        Get the total size of all cache entries
+        """
+        return sum(os.path.getsize(entry_path) for entry_path, _ in self.ListEntries())
+
+    def ListEntries(self) -> list[tuple[str, os.stat_result]]:
+        """
+        List all cache entries with their status
+        """
+        entries = []
+        for root, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith(".tmp") or filename == ".lock": continue
+                entry_path = os.path.join(root, filename)
+                try:
+                    entries.append((entry_path, os.stat(entry_path)))
+                except FileNotFoundError: # Evicted by another process meanwhile
+                    pass
+        return entries
+
+    def Evict(self):
+        """
+        Delete the least recently used entries until the cache shrinks to 90% of the size limit.
+        Only one process evicts at a time, the others skip eviction
+        """
+        lock_path = f"{self.cache_dir}/.lock"
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # Take over the lock if its owner has crashed
+            try:
+                if time.time() - os.path.getmtime(lock_path) > self.stale_lock_seconds: DeleteFile(lock_path)
+            except OSError:
+                pass
+            return
+
+        try:
+            entries = self.ListEntries()
+            size = sum(stat.st_size for _, stat in entries)
+            entries.sort(key=lambda entry: entry[1].st_mtime)
+            for entry_path, stat in entries:
+                if size <= self.size_limit * 0.9: break
+                try:
+                    DeleteFile(entry_path)
+                    size -= stat.st_size
+                except OSError: # Being read by another process on Windows
+                    pass
+            with self.lock:
+                self.size = size
+        finally:
+            os.close(fd)
+            DeleteFile(lock_path)
@@ -0,0 +1,110 @@
+import concurrent.futures
+import multiprocessing
+from multiprocessing import shared_memory
+from PIL import Image
+
+
+class SharedImage:
+    """
+    An image whose pixels are in shared memory, only this small descriptor is pickled between processes
+    """
+
+    def __init__(self, img: Image.Image):
+        data = img.tobytes()
+        self.shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        self.shm.buf[:len(data)] = data
+        self.name = self.shm.name
+        self.nbytes = len(data)
+        self.mode = img.mode
+        self.size = img.size
+        self.info = img.info # Small metadata such as DPI and transparency
+        self.palette = (img.palette.mode, img.palette.tobytes()) if img.mode == "P" else None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["shm"] = None
+        return state
+
+    def Load(self) -> Image.Image:
+        """
+        Make a private copy of the image, the shared memory can be released afterwards
+        """
+        shm = self.shm if self.shm is not None else shared_memory.SharedMemory(name=self.name)
+        try:
+            img = Image.frombytes(self.mode, self.size, bytes(shm.buf[:self.nbytes]))
+        finally:
+            if shm is not self.shm: shm.close()
+        if self.palette is not None: img.putpalette(self.palette[1], self.palette[0])
+        img.info.update(self.info)
+        return img
+
+    def Release(self):
+        """
+        Release the shared memory, called by the process that created it
+        """
+        self.shm.close()
+        self.shm.unlink()
+
+
+def RunOnSharedImage(function, shared: SharedImage, args: tuple):
+    """
+    Run `function(image, *args)` in a worker process, an image result is returned in shared memory
+    """
+    result = function(shared.Load(), *args)
+    if isinstance(result, Image.Image):
+        result = SharedImage(result)
+        result.shm.close() # The creator of the pool reads and unlinks it
+    return result
+
+
+class CpuPool:
+    """
+    A process pool for CPU-bound image work, which does not scale with threads because of the GIL.
+    Pixel data is passed through shared memory instead of being pickled
+    """
+
+    def __init__(self, workers: int):
+        """
+        Args:
+            workers: Number of worker processes
+        """
+        self.workers = workers
+        # Workers are started while the pipeline threads run, a forked worker could inherit a lock held by one of them
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def Map(self, function, images: list[Image.Image], args_list: list[tuple]) -> list:
+        """
+        Run `function(image, *args)` for each image and its args in worker processes
+        Args:
+            function: A picklable function, e.g. a module level function or classmethod
+            images: List of images
+            args_list: List of extra arguments of each image
+            return: List of results, image results are loaded back from shared memory
+        """
+        shared_images = [SharedImage(img) for img in images]
+        try:
+            futures = [
+                self.executor.submit(RunOnSharedImage, function, shared, args)
+                for shared, args in zip(shared_images, args_list)
+            ]
+            return [self.TakeResult(future.result()) for future in futures]
+        finally:
+            for shared in shared_images: shared.Release()
+
+    @classmethod
+    def TakeResult(cls, result):
+        """
+        Load an image result from shared memory and release it, other results are returned as is
+        """
+        if not isinstance(result, SharedImage): return result
+        result.shm = shared_memory.SharedMemory(name=result.name)
+        try:
+            return result.Load()
+        finally:
+            result.Release()
+
+    def Close(self):
+        """
+        Shut down the worker processes
+        """
+        self.executor.shutdown()
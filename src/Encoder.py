@@ -0,0 +1,117 @@
+import io
+
+"""
+Encoder profiles, trading the encoding time of processed images for their size.
+A profile never changes the pixels or the JPEG/WebP quality level, only how hard the encoder works
+"""
+
+ENCODER_PROFILES = {
+    "fast": {
+        "jpeg_optimize": False, # Optimized Huffman tables, a few percent smaller
+        "jpeg_progressive": False, # Progressive scans, a few percent smaller again but slower to encode and decode
+        "jpeg_subsampling": "4:2:0", # Chroma subsampling
+        "png_compress_level": 1, # zlib level
+        "png_compress_type": -1, # zlib strategy, -1 default, 1 filtered
+        "png_optimize": False, # Search for the smallest output, very slow on large photographic images
+        "webp_method": 0, # Effort of the WebP encoder, 0 (fast) to 6 (small)
+    },
+    "balanced": {
+        "jpeg_optimize": True,
+        "jpeg_progressive": False,
+        "jpeg_subsampling": "4:2:0",
+        "png_compress_level": 6,
+        "png_compress_type": 1,
+        "png_optimize": False,
+        "webp_method": 4,
+    },
+    "smallest": {
+        "jpeg_optimize": True,
+        "jpeg_progressive": True,
+        "jpeg_subsampling": "4:2:0",
+        "png_compress_level": 9,
+        "png_compress_type": -1,
+        "png_optimize": True,
+        "webp_method": 6,
+    },
+    "legacy": { # Settings of versions before encoder profiles, for output of the same size as before
+        "jpeg_optimize": True,
+        "jpeg_progressive": False,
+        "jpeg_subsampling": "4:2:0",
+        "png_compress_level": 7,
+        "png_compress_type": -1,
+        "png_optimize": True,
+        "webp_method": 4,
+    },
+}
+DEFAULT_ENCODER_PROFILE = "balanced"
+
+
+def GetEncoderArgs(format: str, quality_level: int, profile: str = DEFAULT_ENCODER_PROFILE) -> dict:
+    """
+    Get the arguments of `Image.save` for an image format and an encoder profile
+    Args:
+        format: Pillow format name, e.g. "JPEG"
+        quality_level: Quality level (0-100) of lossy formats
+        profile: Encoder profile name, see ENCODER_PROFILES
+    """
+    settings = ENCODER_PROFILES[profile]
+    match format:
+        case "JPEG":
+            return {
+                "quality": quality_level,
+                "optimize": settings["jpeg_optimize"],
+                "progressive": settings["jpeg_progressive"],
+                "subsampling": settings["jpeg_subsampling"],
+            }
+        case "PNG":
+            return {
+                "compress_level": settings["png_compress_level"],
+                "compress_type": settings["png_compress_type"],
+                "optimize": settings["png_optimize"],
+            }
+        case "WEBP": return {"quality": quality_level, "method": settings["webp_method"]}
+        case _: return {"quality": quality_level, "optimize": settings["jpeg_optimize"]}
+
+
+# Size budget mode, see Workbench.FitSizeBudget
+BUDGET_FORMATS = ["JPEG", "WEBP"] # Formats whose quality level can be lowered to fit a size budget
+BUDGET_MIN_QUALITY = 10 # Lowest quality level chosen to fit a size budget
+
+
+def GetEncodedSize(img, format: str, quality_level: int, profile: str = DEFAULT_ENCODER_PROFILE) -> int:
+    """
+    Get the size of an image encoded at a quality level
+    """
+    buffer = io.BytesIO()
+    img.save(buffer, format, **GetEncoderArgs(format, quality_level, profile))
+    return buffer.tell()
+
+
+def SearchQuality(img, format: str, max_quality: int, budget: float, profile: str = DEFAULT_ENCODER_PROFILE,
+                  sizes: dict[int, int] = None) -> int:
+    """
+    Binary search the highest quality level at which an image fits a byte budget
+    Args:
+        img: Image, already scaled
+        format: Pillow format name, one of BUDGET_FORMATS
+        max_quality: Highest quality level allowed
+        budget: Byte budget of the image
+        profile: Encoder profile name
+        sizes: Encoded sizes by quality level known from earlier searches, filled in by this search
+        return: The highest quality level not above max_quality whose size is within the budget,
+                BUDGET_MIN_QUALITY if even that is over the budget
+    """
+    if sizes is None: sizes = {}
+    def Size(quality: int) -> int:
+        if quality not in sizes: sizes[quality] = GetEncodedSize(img, format, quality, profile)
+        return sizes[quality]
+
+    low, high = min(BUDGET_MIN_QUALITY, max_quality), max_quality
+    if Size(high) <= budget: return high
+    # Size grows with the quality level, low is the best level known to fit (or the minimum), high is known not to fit
+    while high - low > 1:
+        middle = (low + high) // 2
+        if Size(middle) <= budget: low = middle
+        else: high = middle
+    Size(low) # The minimum may not have been encoded yet, callers read the size of the chosen level from sizes
+    return low
@@ -1,6 +1,12 @@
+import zipfile
+import posixpath
+import threading
+import urllib.parse
+from xml.etree import ElementTree
 from utility import *
 from Error import *
 from Workbench import Workbench
+from Trace import Span
 
 
 class EpubWorkbench(Workbench):
@@ -11,31 +17,109 @@ class EpubWorkbench(Workbench):
         super().__init__(options)
         self.original_dir = f"{self.workbench_dir}/original"
         self.processed_dir = f"{self.workbench_dir}/processed"
+        self.archive: zipfile.ZipFile | None = None # Source EPUB archive, opened when needed
+        self.archive_lock = threading.Lock()
+        self.preview_image: str | None = None # Image in the archive to preview, preview only
         self.CheckOptions()
 
     def InitWorkbench(self, image_exts: list[str]):
         """
+        Only the central directory of the source file is read here,
+        image bytes are read from the archive when their task is claimed
         Args:
             image_exts: List of image file extensions to be processed, e.g. ['.jpg', '.png']
         """
         if DirExist(self.workbench_dir): DeleteDir(self.workbench_dir) # Delete the working directory if it exists
         MakeDir(self.workbench_dir) # Create the working directory
 
-        # Copy source file to working directory
-        CopyFile(self.options["input_path"], f"{self.workbench_dir}/o.epub")
-        # Unpack source file
-        UnpackZip(f"{self.workbench_dir}/o.epub", self.original_dir)
-        if not self.options["preview"]:
-            CopyDir(self.original_dir, self.processed_dir)
-        # Get image list
-        images = SearchFiles(self.original_dir, image_exts, relative=True)
-        self.progress.LoadTasks(images)
-        if len(images) == 0:
-            raise FileCorruptedError(f"Input file '{self.options["input_path"]}' is corrupted or it has no images.")
+        images = self.ListImages(image_exts)
+        # Images with the same content are processed only once
+        self.LoadTasks(images)
+        # Trivial images are routed around the model
+        self.TriageTasks()
 
         # Save progress
+        self.WriteDuplicates()
+        self.WriteTriage()
         self.WriteProgress()
 
+    def InitPreview(self, image_exts: list[str]):
+        """
+        Find the preview image in the central directory and the package document,
+        images are neither read nor hashed
+        Args:
+            image_exts: List of image file extensions to be processed, e.g. ['.jpg', '.png']
+        """
+        if DirExist(self.workbench_dir): DeleteDir(self.workbench_dir)
+        MakeDir(self.workbench_dir)
+        images = self.ListImages(image_exts)
+        self.preview_image = self.GetCoverImage(images) or self.GetPreviewImage(images)
+
+    def ListImages(self, image_exts: list[str]) -> list[str]:
+        """
+        Get the images in the source file from its central directory
+        Args:
+            image_exts: List of image file extensions to be processed, e.g. ['.jpg', '.png']
+        """
+        try:
+            archive = self.OpenArchive()
+        except zipfile.BadZipFile as e:
+            raise FileCorruptedError(f"Input file '{self.options["input_path"]}' is corrupted or it has no images.") from e
+        # Images are extracted under the workbench by their entry names, entries that would land outside it
+        # are not processed and are copied to the target unchanged
+        images = [
+            info.filename for info in archive.infolist()
+            if not info.is_dir() and any(info.filename.endswith(ext) for ext in image_exts) and IsSafeArchivePath(info.filename)
+        ]
+        if len(images) == 0:
+            raise FileCorruptedError(f"Input file '{self.options["input_path"]}' is corrupted or it has no images.")
+        return images
+
+    def ExtractSampleImages(self, image_exts: list[str], sample_num: int, output_dir: str) -> list[str]:
+        """
+        Extract representative images from the archive, only headers of the other images are read
+        """
+        images = self.ListImages(image_exts)
+        samples = self.SampleBySize(images, [self.GetOriginalImageSize(image) for image in images], sample_num)
+        MakeDir(output_dir)
+        sample_paths = []
+        archive = self.OpenArchive()
+        for image in samples:
+            # Images in different directories may share a name
+            sample_path = f"{output_dir}/{len(sample_paths) + 1:02d}-{GetFileName(image)}"
+            with open(sample_path, "wb") as f:
+                f.write(archive.read(image))
+            sample_paths.append(sample_path)
+        self.CloseArchive()
+        return sample_paths
+
+    def GetCoverImage(self, images: list[str]) -> str | None:
+        """
+        Get the cover image declared in the package document, by the 'cover-image' property of EPUB 3
+        or the 'cover' metadata of EPUB 2. None if not declared or not among the images
+        Args:
+            images: Images in the archive
+        """
+        archive = self.OpenArchive()
+        container_ns = "{urn:oasis:names:tc:opendocument:xmlns:container}"
+        opf_ns = "{http://www.idpf.org/2007/opf}"
+        try:
+            container = ElementTree.fromstring(archive.read("META-INF/container.xml"))
+            package_path = container.find(f".//{container_ns}rootfile").get("full-path")
+            package = ElementTree.fromstring(archive.read(package_path))
+        except (KeyError, AttributeError, ElementTree.ParseError):
+            return None
+
+        items = {item.get("id"): item for item in package.iter(f"{opf_ns}item")}
+        cover = next((item for item in items.values() if "cover-image" in (item.get("properties") or "").split()), None)
+        if cover is None:
+            meta = next((meta for meta in package.iter(f"{opf_ns}meta") if meta.get("name") == "cover"), None)
+            if meta is not None: cover = items.get(meta.get("content"))
+        if cover is None or cover.get("href") is None: return None
+        # hrefs in the package document are relative to it
+        cover_path = posixpath.normpath(posixpath.join(posixpath.dirname(package_path), urllib.parse.unquote(cover.get("href"))))
+        return cover_path if cover_path in images else None
+
     def GenerateTarget(self):
         """
         Generate EPUB target file
@@ -44,28 +128,116 @@ class EpubWorkbench(Workbench):
         target_path = self.options["output_path"]
         tmp_target_path = f"{GetFileDir(target_path)}/${GetFileNameWithoutExt(target_path)}.tmp"
         MakeDir(GetFileDir(target_path))
-        PackZip(self.processed_dir, tmp_target_path)
+        self.WriteTarget(tmp_target_path)
         MoveFile(tmp_target_path, target_path, exist_ok=True)
         # Delete working directory
         self.CleanupWorkbench()
-    
-    def GetPreviewImage(self) -> str:
+
+    def WriteTarget(self, target_path: str):
+        """
+        Write the EPUB file with the processed images, the workbench is kept
+        """
+        # Processed images replace their entries in the source file,
+        # duplicates share the processed image of their task, skipped images are copied unchanged
+        replaced = {}
+        for task in self.GetProcessedTasks():
+            _, processed_path = self.GetImageIOPath(task)
+            for image in [task, *self.duplicates.get(task, [])]:
+                # Workbenches made by older versions use OS path separators in tasks
+                replaced[image.replace("\\", "/")] = processed_path
+        self.CloseArchive()
+
+        with Span("RepackZip", "file", bytes_read=GetFileSize(self.options["input_path"]), images=len(replaced)) as span:
+            RepackZip(self.options["input_path"], replaced, target_path)
+            span.Set(bytes_written=GetFileSize(target_path))
+
+    def CleanupWorkbench(self):
+        """
+        Close the source archive and clean up the workbench
+        """
+        self.CloseArchive()
+        super().CleanupWorkbench()
+
+    def OpenArchive(self) -> zipfile.ZipFile:
+        """
+        Get the source archive, open it if not opened yet
+        """
+        with self.archive_lock:
+            if self.archive is None: self.archive = zipfile.ZipFile(self.options["input_path"], "r")
+            return self.archive
+
+    def CloseArchive(self):
+        """
+        Close the source archive if opened
+        """
+        with self.archive_lock:
+            if self.archive is not None:
+                self.archive.close()
+                self.archive = None
+
+    def GetImageFingerprint(self, image: str) -> object:
+        """
+        Use CRC-32 and size recorded in the central directory as the fingerprint, no image bytes are read
+        """
+        info = self.OpenArchive().getinfo(image)
+        return (info.CRC, info.file_size)
+
+    def HashImage(self, image: str) -> str:
+        """
+        Get the content hash of an image in the archive
+        """
+        import hashlib
+        return hashlib.sha256(self.OpenArchive().read(image)).hexdigest()
+
+    def GetOriginalImageSize(self, task: str) -> tuple[int, int]:
+        """
+        Get the size of an image in the archive, only the image header is read
+        """
+        from PIL import Image
+        with self.OpenOriginalImageFile(task) as f, Image.open(f) as img:
+            return img.size
+
+    def OpenOriginalImageFile(self, task: str):
+        """
+        Open an image in the archive as a binary file, nothing is extracted
+        """
+        return self.OpenArchive().open(task.replace("\\", "/"))
+
+    def FetchOriginalImage(self, task: str):
+        """
+        Extract the original image of a claimed task from the archive
+        """
+        original_path, processed_path = self.GetImageIOPath(task)
+        MakeDir(GetFileDir(original_path))
+        MakeDir(GetFileDir(processed_path))
+        with open(original_path, "wb") as f:
+            f.write(self.OpenArchive().read(task.replace("\\", "/")))
+
+    def ReleaseOriginalImage(self, task: str):
+        """
+        Delete the extracted original image of a finished task
+        """
+        original_path, _ = self.GetImageIOPath(task)
+        if FileExist(original_path): DeleteFile(original_path)
+
+    def GetPreviewImage(self, images: list[str]) -> str:
         """
         Get the preview image path.
-        If there is a cover image, return it. Otherwise, return the first image.
+        If there is an image named cover, return it. Otherwise, return the first image.
         """
-        for image_relpath in self.progress.tasks.keys():
+        for image_relpath in images:
             if GetFileNameWithoutExt(image_relpath).lower() == "cover": return image_relpath
-        return list(self.progress.tasks.keys())[0] # Return the first image name if no cover image is found
+        return images[0] # Return the first image name if no cover image is found
 
     def GetPreviewImageIOPath(self) -> tuple[str, str]:
         """
         Get the preview image input and output path.
         """
         # Get the preview image name
-        preview_image_relpath = self.GetPreviewImage()
+        preview_image_relpath = self.preview_image
         preview_image_ext = GetFileExt(preview_image_relpath)
-        # Process image
+        # Extract image
+        self.FetchOriginalImage(preview_image_relpath)
         original_path  = f"{self.original_dir}/{preview_image_relpath}"
         processed_path = f"{self.workbench_dir}/preview{preview_image_ext}"
         return original_path, processed_path
@@ -77,4 +249,3 @@ class EpubWorkbench(Workbench):
         original_path = f"{self.original_dir}/{task}"
         processed_path = f"{self.processed_dir}/{task}"
         return original_path, processed_path
-
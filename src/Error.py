@@ -44,6 +44,16 @@ class JobsValueInvalidError(OptionsError, ValueError):
     def __init__(self, *args) -> None:
         super().__init__(*args)
 
+class ChunkValueInvalidError(OptionsError, ValueError):
+    """Raised when the chunk size value is invalid."""
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+
+class CacheSizeValueInvalidError(OptionsError, ValueError):
+    """Raised when the cache size value is invalid."""
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+
 class ImageQualityValueInvalidError(OptionsError, ValueError):
     """Raised when the image quality level value is invalid."""
     def __init__(self, *args) -> None:
@@ -54,6 +64,41 @@ class NoAvailableModelError(OptionsError):
     def __init__(self, *args) -> None:
         super().__init__(*args)
 
+class FamilyNotTunableError(OptionsError):
+    """Raised when calibrating a family that cannot be tuned."""
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+
+class TargetValueInvalidError(OptionsError, ValueError):
+    """Raised when the target size is invalid."""
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+
+class TileThresholdValueInvalidError(OptionsError, ValueError):
+    """Raised when the tile threshold value is invalid."""
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+
+class StreamWindowValueInvalidError(OptionsError, ValueError):
+    """Raised when the stream window value is invalid."""
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+
+class SamplesValueInvalidError(OptionsError, ValueError):
+    """Raised when the number of benchmark samples is invalid."""
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+
+class SizeBudgetValueInvalidError(OptionsError, ValueError):
+    """Raised when the size budget is invalid."""
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+
+class TriageRulesInvalidError(OptionsError, ValueError):
+    """Raised when the triage rules file cannot be loaded or has invalid rules."""
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+
 
 # Errors during processing (after workbench initialization)
 class FileCorruptedError(RuntimeError):
@@ -0,0 +1,50 @@
+import time
+
+
+class ProgressEvent:
+    """Base class of events emitted by workbenches while processing images"""
+
+    def __init__(self, done: int, total: int):
+        self.time = time.time() # When the event happened (seconds since epoch)
+        self.done = done # Number of done tasks when the event happened
+        self.total = total # Number of all tasks
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{key}={value!r}" for key, value in vars(self).items())
+        return f"{type(self).__name__}({fields})"
+
+
+class TaskClaimed(ProgressEvent):
+    """A task is claimed by a worker"""
+
+    def __init__(self, task: str, done: int, total: int):
+        super().__init__(done, total)
+        self.task = task
+
+
+class StageFinished(ProgressEvent):
+    """A processing stage of a chunk of tasks is finished"""
+
+    def __init__(self, tasks: list[str], stage: str, seconds: float, done: int, total: int):
+        super().__init__(done, total)
+        self.tasks = tasks
+        self.stage = stage # "read", "pre-scale", "model", "post-scale" or "write"
+        self.seconds = seconds # Time spent on the stage
+
+
+class TaskDone(ProgressEvent):
+    """A task is done"""
+
+    def __init__(self, task: str, seconds: float, done: int, total: int):
+        super().__init__(done, total)
+        self.task = task
+        self.seconds = seconds # Time from claimed to done
+
+
+class TaskFailed(ProgressEvent):
+    """A task failed, the error is raised by the workbench afterwards"""
+
+    def __init__(self, task: str, error: BaseException, done: int, total: int):
+        super().__init__(done, total)
+        self.task = task
+        self.error = error
@@ -1,7 +1,10 @@
 import abc
+import tempfile
+import threading
 import subprocess
 from utility import *
 from Error import *
+from Trace import Span, RunProcess
 
 
 class Family(abc.ABC):
@@ -9,10 +12,17 @@ class Family(abc.ABC):
     family_name = None # Family name, used to locate models in the local file system
     description = None # Family description
     supported_image_exts = None # Supported image file extensions, e.g. [".jpg", ".png"]
+    tunable = False # Whether tile size and threads can be tuned, see Tuning.py
+    output_format_map = {".jpg": "jpg", ".jpeg": "jpg", ".png": "png", ".webp": "webp"} # Image extension -> `-f` format of ncnn executables
+    max_model_scale = 4 # Largest `-s` of models without a scaling factor in their name, None if unbounded
 
     def __init__(self, options: dict):
         self.options = options
         self.model_scale: int | float = None # Model scaling factor
+        self.tuning: dict | None = None # Fixed tile size and threads for tunable families, overrides the tuning profile
+        self.cpu_pool = None # Process pool for CPU-bound work, set by the workbench while processing
+        self.scale_variants: dict[tuple[str, int], "Family"] = {} # (model, model scale) -> family, see GetScaleVariant
+        self.scale_variants_lock = threading.Lock()
     
     def CheckOptions(self):
         """
@@ -54,6 +64,150 @@ class Family(abc.ABC):
         """
         pass
 
+    def ProcessImages(self, io_files: list[tuple[str, str]], stage_dir: str):
+        """
+        Process a chunk of images.
+        The default implementation processes images one by one, families whose
+        executable accepts a directory should override this to start only one process
+        Args:
+            io_files: List of (input image file path, output image file path)
+            stage_dir: Directory where temporary files of the chunk can be placed
+        """
+        for input_file, output_file in io_files:
+            self.ProcessImage(input_file, output_file)
+
+    def ProcessImageObjects(self, sources: list, stage_dir: str) -> list:
+        """
+        Process decoded images, this is the API used by workbenches.
+        The default implementation gives the executable exactly one lossless handoff file per image:
+        the source file itself if given, otherwise a PNG file. Families working in memory should override this
+        Args:
+            sources: List of images, each is either a decoded PIL image or the path of an unchanged image file
+            stage_dir: Directory where temporary files of the chunk can be placed
+            return: List of processed PIL images
+        """
+        MakeDir(stage_dir)
+        with tempfile.TemporaryDirectory(dir=stage_dir) as chunk_dir:
+            io_files = []
+            for i, source in enumerate(sources):
+                if isinstance(source, str):
+                    input_file = source
+                else:
+                    input_file = f"{chunk_dir}/{i}-in.png"
+                    self.GetHandoffImage(source).save(input_file, compress_level=1)
+                io_files.append((input_file, f"{chunk_dir}/{i}-out.png"))
+            self.ProcessImages(io_files, chunk_dir)
+            return [LoadImage(output_file) for _, output_file in io_files]
+
+    @classmethod
+    def GetHandoffImage(cls, img):
+        """
+        Get an image in a mode executables read from a PNG handoff file, RGB or RGBA if it has transparency.
+        Decoded sources keep the mode of their file, e.g. CMYK for some JPEG files, which PNG cannot store
+        """
+        if img.mode in ("RGB", "RGBA", "L"): return img
+        if "A" in img.mode or "transparency" in img.info: return img.convert("RGBA")
+        return img.convert("RGB")
+
+    def ProcessImagesByDir(self, io_files: list[tuple[str, str]], stage_dir: str, Run):
+        """
+        Process a chunk of images with an executable in directory-in/directory-out form.
+        Images are staged into a temporary input directory, then `Run(input_dir, output_dir, format)`
+        is called once for each output format in the chunk, finally outputs are moved to their destination
+        Args:
+            io_files: List of (input image file path, output image file path)
+            stage_dir: Directory where the temporary input and output directories are placed
+            Run: Function that runs the executable over a directory
+        """
+        MakeDir(stage_dir)
+        with tempfile.TemporaryDirectory(dir=stage_dir) as chunk_dir:
+            # Group images by output format, the executable writes one format per run
+            groups: dict[str, list[int]] = {}
+            for i, (_, output_file) in enumerate(io_files):
+                format = self.output_format_map.get(GetFileExt(output_file).lower(), "png")
+                groups.setdefault(format, []).append(i)
+
+            for format, indices in groups.items():
+                input_dir = f"{chunk_dir}/{format}-in"
+                output_dir = f"{chunk_dir}/{format}-out"
+                MakeDir(input_dir)
+                MakeDir(output_dir)
+                # Stage input images with names that cannot collide
+                for i in indices:
+                    input_file = io_files[i][0]
+                    LinkOrCopyFile(input_file, f"{input_dir}/{i}{GetFileExt(input_file)}")
+                Run(input_dir, output_dir, format)
+                # Move outputs to their destination
+                for i in indices:
+                    staged_output = f"{output_dir}/{i}.{format}"
+                    if not FileExist(staged_output):
+                        raise ModelRuntimeError(f"Model '{self.options["model"]}' of family '{self.family_name}' "\
+                                                f"FAILED: no output for image '{io_files[i][0]}'.")
+                    MoveFile(staged_output, io_files[i][1], exist_ok=True)
+
+    def RunModel(self, cmd: list[str]):
+        """
+        Run the model executable, throw ModelRuntimeError if it fails
+        Args:
+            cmd: Command line of the executable
+        """
+        try:
+            with Span("model process", "model", family=self.family_name, model=self.options["model"]) as span:
+                RunProcess(cmd, span, shell=True)
+        except subprocess.CalledProcessError as e:
+            info = f"Model '{self.options["model"]}' of family '{self.options["family"]}' FAILED:\n" \
+                   f"stdout: {e.stdout}\n" \
+                   f"stderr: {e.stderr}"
+            raise ModelRuntimeError(info) from e
+
+    def GetScaleVariant(self, scale: float) -> "Family":
+        """
+        Get the family running the cheapest variant of the model that reaches a scaling factor.
+        Variants are models whose names differ only in the scaling factor, e.g. 'x2' and 'x4',
+        the one with the smallest model scale not less than the scaling factor is chosen, or the largest one if none reaches it.
+        Models without a scaling factor in the name run at the scaling factor rounded up, at most `max_model_scale`,
+        the rest of the scaling factor is left to post-scaling
+        Args:
+            scale: Scaling factor to reach
+        """
+        model = self.options["model"]
+        model_scale = self.ParseScaleFromModelName(model)
+        if model_scale is None:
+            variant_model, variant_scale = model, max(Ceil(scale), 2)
+            if self.max_model_scale is not None: variant_scale = min(variant_scale, self.max_model_scale)
+        else:
+            base_name = self.RemoveScaleFromModelName(model)
+            variants = {
+                self.ParseScaleFromModelName(name): name for name in self.GetAllModels()
+                if self.ParseScaleFromModelName(name) is not None and self.RemoveScaleFromModelName(name) == base_name
+            }
+            reaching_scales = [variant_scale for variant_scale in variants if variant_scale >= scale]
+            variant_scale = min(reaching_scales) if len(reaching_scales) > 0 else max(variants)
+            variant_model = variants[variant_scale]
+
+        with self.scale_variants_lock:
+            key = (variant_model, variant_scale)
+            if key not in self.scale_variants:
+                options = self.options.copy()
+                options["model"], options["scale"] = variant_model, variant_scale
+                variant = type(self)(options)
+                variant.tuning = self.tuning
+                self.scale_variants[key] = variant
+            variant = self.scale_variants[key]
+        variant.cpu_pool = self.cpu_pool
+        return variant
+
+    @classmethod
+    def RemoveScaleFromModelName(cls, model_name: str) -> str:
+        """
+        Remove the scaling factor parsed by `ParseScaleFromModelName` from the model name
+        """
+        model_name = model_name.lower()
+        model_scale = cls.ParseScaleFromModelName(model_name)
+        if model_scale is None: return model_name
+        if f"x{model_scale}" in model_name: return model_name.replace(f"x{model_scale}", "", 1)
+        return model_name.replace(f"{model_scale}x", "", 1)
+
     @classmethod
     def ParseScaleFromModelName(cls, model_name: str) -> int | None:
         """
@@ -149,17 +303,48 @@ def MakeCommonFamilyClass(family_name_: str, description_: str = None):
                 "-s", str(self.model_scale),
                 "-m", self.options["model"],
             ]
+            self.RunModelEitherWay(cmd1, cmd2)
 
+        def ProcessImages(self, io_files: list[tuple[str, str]], stage_dir: str):
+            """
+            Process a chunk of images with one process of the executable
+            Args:
+                io_files: List of (input image file path, output image file path)
+                stage_dir: Directory where temporary files of the chunk can be placed
+            """
+            if len(io_files) == 1:
+                self.ProcessImage(*io_files[0])
+                return
+
+            def Run(input_dir: str, output_dir: str, format: str):
+                cmd1 = [
+                    f"{ROOT}/family/{self.family_name}/{self.family_name}",
+                    "-i", input_dir,
+                    "-o", output_dir,
+                    "-s", str(self.model_scale),
+                    "-n", self.options["model"],
+                    "-f", format,
+                ]
+                cmd2 = [
+                    f"{ROOT}/family/{self.family_name}/{self.family_name}",
+                    "-i", input_dir,
+                    "-o", output_dir,
+                    "-s", str(self.model_scale),
+                    "-m", self.options["model"],
+                    "-f", format,
+                ]
+                self.RunModelEitherWay(cmd1, cmd2)
+
+            self.ProcessImagesByDir(io_files, stage_dir, Run)
+
+        def RunModelEitherWay(self, cmd1: list[str], cmd2: list[str]):
+            """
+            Run `cmd1`, if it fails, run `cmd2`
+            """
             try:
-                subprocess.run(cmd1, check=True, shell=True, capture_output=True, text=True)
-            except subprocess.CalledProcessError as e:
-                try:
-                    subprocess.run(cmd2, check=True, shell=True, capture_output=True, text=True)
-                except subprocess.CalledProcessError as e:
-                    info = f"Model '{self.options["model"]}' of family '{self.options["family"]}' FAILED:\n" \
-                           f"stdout: {e.stdout}\n" \
-                           f"stderr: {e.stderr}"
-                    raise ModelRuntimeError(info) from e
+                self.RunModel(cmd1)
+            except ModelRuntimeError:
+                self.RunModel(cmd2)
 
         @classmethod
         def GetDescription(cls) -> str:
@@ -1,10 +1,13 @@
 import argparse
 from utility import *
 from Error import *
+from Triage import LoadTriageRules
+from Benchmark import BENCHMARK_SAMPLES
+from Encoder import ENCODER_PROFILES, DEFAULT_ENCODER_PROFILE
 
 
 def ParseOptions(args: list[str]):
-    usage = f"{USAGE_PROG} -h | -v | -lf | -lm [-f FAMILY] | -i INPUT_PATH [-o OUTPUT_PATH] [-b] [-p] [-ps PRE_SCALE] [-s SCALE] [-f FAMILY] [-m MODEL] [-q QUALITY] [-j JOBS] [-r]"
+    usage = f"{USAGE_PROG} -h | -v | -lf | -lm [-f FAMILY] | --calibrate [-f FAMILY] [-m MODEL] | --benchmark -i INPUT_PATH [-o OUTPUT_DIR] [-f FAMILIES] [-m MODELS] [-s SCALE] [-q QUALITY] [--encoder ENCODER] [--samples SAMPLES] | -i INPUT_PATH [-o OUTPUT_PATH] [-b] [-p] [-ps PRE_SCALE] [-s SCALE | -t TARGET] [-f FAMILY] [-m MODEL] [-q QUALITY] [--encoder ENCODER] [--size-budget SIZE_BUDGET] [-j JOBS] [--stage-jobs STAGE_JOBS] [--cpu-jobs CPU_JOBS] [-c CHUNK] [--cache-size CACHE_SIZE] [--cache-dir CACHE_DIR] [--tile-threshold TILE_THRESHOLD] [--stream-window STREAM_WINDOW] [--trace TRACE_PATH] [--triage] [--triage-rules TRIAGE_RULES] [-r]"
     parser = argparse.ArgumentParser(prog=APP_NAME, usage=usage)
 
     parser.add_argument("-v", "--version", action="store_true",
@@ -16,6 +19,18 @@ def ParseOptions(args: list[str]):
     parser.add_argument("-lm", "--list-model", action="store_true",
                        dest="list_model",
                        help="to list all available models in a specific family (use with -f)")
+    parser.add_argument("--calibrate", action="store_true",
+                       dest="calibrate",
+                       help="to find the fastest tile size and threads of a family and model (use with -f and -m) on this machine, "\
+                            "the result is saved to the machine profile and used by later runs")
+    parser.add_argument("--benchmark", action="store_true",
+                       dest="benchmark",
+                       help="to compare models on sample images of a file (use with -i), -f and -m take comma separated lists, "\
+                            "each family runs the listed models it has (or its default model). Reports wall time, megapixels per second, "\
+                            "peak memory and output bytes per image, and writes the outputs side by side to the output directory (-o)")
+    parser.add_argument("--samples", action="store", type=int, default=BENCHMARK_SAMPLES,
+                       dest="samples",
+                       help=f"number of representative images sampled by --benchmark, default={BENCHMARK_SAMPLES}")
     parser.add_argument("-i", "--input", action="store", type=str,
                        dest="input_path",
                        help="input file path (required)")
@@ -34,6 +49,11 @@ def ParseOptions(args: list[str]):
     parser.add_argument("-s", "--scale", action="store", type=float,
                        dest="scale",
                        help="scaling factor (floating number), range and default value depends on the selected model")
+    parser.add_argument("-t", "--target", action="store", type=str,
+                       dest="target",
+                       help="target size WIDTHxHEIGHT of images (e.g. 1600x2560), instead of one scaling factor, each image is scaled "\
+                            "to fit the target with the cheapest variant of the model (e.g. x2 rather than x4), "\
+                            "images that already fit are kept unchanged")
     parser.add_argument("-f", "--family", action="store", type=str, default="realesrgan-ncnn-vulkan",
                        dest="family",
                        help="family name of super-resolution models, default=realesrgan-ncnn-vulkan")
@@ -43,9 +63,65 @@ def ParseOptions(args: list[str]):
     parser.add_argument("-q", "--quality", action="store", type=int, default=75,
                        dest="quality",
                        help="JPEG image compression quality level (0-100), default=75")
+    parser.add_argument("--encoder", action="store", type=str, choices=list(ENCODER_PROFILES), default=DEFAULT_ENCODER_PROFILE,
+                       dest="encoder",
+                       help="encoder profile of processed images, 'fast' encodes several times faster with larger PNG and WebP files, "\
+                            "'smallest' spends much longer (optimized PNG and progressive JPEG) for the smallest files, "\
+                            "'legacy' keeps the settings of versions before profiles (PNG at zlib level 7, optimized), "\
+                            "whose PNG files are a little smaller than with 'balanced' and much slower to encode, "\
+                            f"the pixels and the quality level are the same, default={DEFAULT_ENCODER_PROFILE}")
+    parser.add_argument("--size-budget", action="store", type=float,
+                       dest="size_budget",
+                       help="size limit (MB) of the output file, after processing the quality level of JPEG and WebP images is lowered "\
+                            "(from -q at most) until the file fits, images with more pixels get a larger share. "\
+                            "Only images are encoded again, the model does not run again (lossless copies of the images are kept in the workbench for it)")
     parser.add_argument("-j", "--jobs", action="store", type=int, default=2,
                        dest="jobs",
                        help="number of parallel jobs, default=2")
+    parser.add_argument("--stage-jobs", action="store", type=str, default="1:1:2:1",
+                       dest="stage_jobs",
+                       help="number of parallel jobs of the read:pre-scale:post-scale:write stages (the model stage uses -j), default=1:1:2:1")
+    parser.add_argument("--cpu-jobs", action="store", type=int, default=0,
+                       dest="cpu_jobs",
+                       help="number of worker processes for CPU-bound work (PDF image extraction, pre-scale, post-scale, encoding and the traditional family), "\
+                            "0 to run it in threads of this process, default=0")
+    parser.add_argument("-c", "--chunk", action="store", type=int, default=8,
+                       dest="chunk",
+                       help="maximum number of images processed by one model process, default=8")
+    parser.add_argument("--cache-size", action="store", type=int, default=0,
+                       dest="cache_size",
+                       help="size limit (MB) of the result cache shared by all books, least recently used results are evicted beyond it, 0 to disable the cache, default=0")
+    parser.add_argument("--cache-dir", action="store", type=str, default=f"{ROOT}/cache",
+                       dest="cache_dir",
+                       help="directory of the result cache, default is the 'cache' directory beside 'family'")
+    parser.add_argument("--tile-threshold", action="store", type=float, default=0,
+                       dest="tile_threshold",
+                       help="size (megapixels) above which images are processed by the model in overlapping tiles, "\
+                            "the model output and the result of an oversized image such as a scanned page are then not held in memory "\
+                            "(the source image still is), seams are blended so results differ slightly from untiled ones, "\
+                            "0 to disable tiling, default=0")
+    parser.add_argument("--stream-window", action="store", type=int, default=0,
+                       dest="stream_window",
+                       help="for PDF files, number of pages whose images are extracted, processed and written back at a time, "\
+                            "so that disk use is bounded by the window and an interruption loses at most one window, "\
+                            "0 to process all images at once, default=0")
+    parser.add_argument("--trace", action="store", type=str,
+                       dest="trace",
+                       help="to record the time, thread, image size and bytes read and written of every workbench phase, "\
+                            "pipeline stage and image, and the CPU time and peak memory of model processes, "\
+                            "saved as Chrome trace-event JSON to this path (open it in chrome://tracing or ui.perfetto.dev) "\
+                            "and summed up by stage after processing. With -b, one trace records the whole batch "\
+                            "(with -b -p, one trace per file, '?' and '*' are replaced as in -o)")
+    parser.add_argument("--triage", action="store_true",
+                       dest="triage",
+                       help="to route trivial images around the model with the default triage rules: images with a longer side "\
+                            "of at most 32 are kept unchanged, of at most 64 or of nearly flat luminance are scaled with LANCZOS. "\
+                            "The flat check decodes the images that pass the size rules (JPEG at reduced size). "\
+                            "Without triage, all images are processed by the model")
+    parser.add_argument("--triage-rules", action="store", type=str,
+                       dest="triage_rules",
+                       help="JSON file of triage rules (tiny_side, large_side, small_side, flat_stddev), implies --triage, "\
+                            "rules not in the file keep their default values")
     parser.add_argument("-r", "--restart", action="store_true",
                        dest="restart",
                        help="to force reprocessing all images, otherwise continue from interruption of the last time")
@@ -62,7 +138,15 @@ def ParseOptions(args: list[str]):
     if options.print_version:
         parser._print_message(f"{APP_NAME} version {VERSION}")
         parser.exit(0)
-    if options.list_family or options.list_model:
+    if options.list_family or options.list_model or options.calibrate:
+        return vars(options)
+    if options.benchmark:
+        if options.input_path is None:
+            parser.error("the following arguments are required with --benchmark: -i/--input")
+        if options.samples <= 0:
+            raise SamplesValueInvalidError(f"Number of samples must be greater than 0, but got {options.samples}.")
+        if not 0 <= options.quality <= 100:
+            raise ImageQualityValueInvalidError(f"Image quality level must be in range [0, 100], but got {options.quality}.")
         return vars(options)
     
     # Standard mode
@@ -75,8 +159,35 @@ def ParseOptions(args: list[str]):
         raise ImageQualityValueInvalidError(f"Image quality level must be in range [0, 100], but got {options.quality}.")
     if options.pre_scale <= 0:
         raise PreScaleValueInvalidError(f"Pre-scaling factor must be greater than 0, but got {options.pre_scale}.")
+    if options.target is not None:
+        if options.scale is not None:
+            raise TargetValueInvalidError("Scaling factor and target size cannot be given together.")
+        target = options.target.lower().split("x")
+        if len(target) != 2 or not all(side.isdigit() and int(side) > 0 for side in target):
+            raise TargetValueInvalidError(f"Target size must be WIDTHxHEIGHT with integers greater than 0, but got '{options.target}'.")
+        options.target = (int(target[0]), int(target[1]))
     if options.jobs <= 0:
         raise JobsValueInvalidError(f"Number of parallel jobs must be greater than 0, but got {options.jobs}.")
+    stage_jobs = options.stage_jobs.split(":")
+    if len(stage_jobs) != 4 or not all(jobs.isdigit() and int(jobs) > 0 for jobs in stage_jobs):
+        raise JobsValueInvalidError(f"Stage jobs must be 4 integers greater than 0 separated by ':', but got '{options.stage_jobs}'.")
+    options.stage_jobs = [int(jobs) for jobs in stage_jobs]
+    if options.cpu_jobs < 0:
+        raise JobsValueInvalidError(f"Number of CPU worker processes must not be negative, but got {options.cpu_jobs}.")
+    if options.chunk <= 0:
+        raise ChunkValueInvalidError(f"Chunk size must be greater than 0, but got {options.chunk}.")
+    if options.cache_size < 0:
+        raise CacheSizeValueInvalidError(f"Cache size must not be negative, but got {options.cache_size}.")
+    if options.tile_threshold < 0:
+        raise TileThresholdValueInvalidError(f"Tile threshold must not be negative, but got {options.tile_threshold}.")
+    if options.stream_window < 0:
+        raise StreamWindowValueInvalidError(f"Stream window must not be negative, but got {options.stream_window}.")
+    if options.size_budget is not None:
+        if options.size_budget <= 0:
+            raise SizeBudgetValueInvalidError(f"Size budget must be greater than 0, but got {options.size_budget}.")
+        if options.stream_window > 0:
+            raise SizeBudgetValueInvalidError("Size budget cannot be used with a stream window, images of committed windows are not kept.")
+    options.triage_rules = LoadTriageRules(options.triage_rules) if options.triage or options.triage_rules is not None else None
 
     # # If no output path is provided, use the directory of input path,
     # # output filename will be input filename with suffix "_enana"
@@ -1,6 +1,12 @@
+import json
 from utility import *
 from Error import *
+from Family import Family
+from Event import ProgressEvent
 from Workbench import Workbench
+from Trace import Span
+
+STREAM_CATALOG_KEY = "EnanaCommittedWindows" # Catalog key of the target PDF recording the number of committed windows
 
 
 class PDFWorkbench(Workbench):
@@ -11,6 +17,12 @@ class PDFWorkbench(Workbench):
         super().__init__(options)
         self.original_dir = f"{self.workbench_dir}/original"
         self.processed_dir = f"{self.workbench_dir}/processed"
+        # Streaming mode processes a window of pages at a time, the preview always uses the whole document
+        self.stream_window = 0 if options["preview"] else options.get("stream_window", 0) # Pages per window, 0 to disable
+        self.target_pdf_path = f"{self.workbench_dir}/t.pdf" # Target built in place by incremental saves, streaming mode only
+        self.windows: list[list[int]] = [] # xrefs first referred to by each window, streaming mode only
+        self.window = 0 # Window whose images are in the workbench, streaming mode only
+        self.preview_image_path: str | None = None # Extracted preview image, preview only
         self.CheckOptions()
 
     def InitWorkbench(self, image_exts: list[str]):
@@ -20,22 +32,206 @@ class PDFWorkbench(Workbench):
         """
         if DirExist(self.workbench_dir): DeleteDir(self.workbench_dir) # Delete the working directory if it exists
         MakeDir(self.workbench_dir) # Create the working directory
+        if self.stream_window > 0:
+            self.InitStream(image_exts)
+            return
 
         # Copy source file to working directory
         CopyFile(self.options["input_path"], f"{self.workbench_dir}/o.pdf")
         MakeDir(self.original_dir)
         MakeDir(self.processed_dir)
         # Extract images from PDF
-        PdfExtractImages(f"{self.workbench_dir}/o.pdf", self.original_dir)
+        with Span("PdfExtractImages", "file", bytes_read=GetFileSize(f"{self.workbench_dir}/o.pdf")):
+            PdfExtractImages(f"{self.workbench_dir}/o.pdf", self.original_dir, self.options.get("cpu_jobs", 0))
 
         # Get image list
         images = SearchFiles(self.original_dir, image_exts, relative=True)
-        self.progress.LoadTasks(images)
         if len(images) == 0:
             raise FileCorruptedError(f"Input file '{self.options["input_path"]}' is corrupted or it has no images.")
+        # Images with the same content are processed only once
+        self.LoadTasks(images)
+        # Trivial images are routed around the model
+        self.TriageTasks()
 
         # Save progress
+        self.WriteDuplicates()
+        self.WriteTriage()
+        self.WriteProgress()
+
+    def InitPreview(self, image_exts: list[str]):
+        """
+        Extract only the first image of the source file for the preview
+        Args:
+            image_exts: List of image file extensions to be processed, e.g. ['.jpg', '.png']
+        """
+        if DirExist(self.workbench_dir): DeleteDir(self.workbench_dir)
+        MakeDir(self.original_dir)
+        xref = PdfGetFirstImage(self.options["input_path"])
+        if xref is None:
+            raise FileCorruptedError(f"Input file '{self.options["input_path"]}' is corrupted or it has no images.")
+        self.preview_image_path = PdfExtractXrefs(self.options["input_path"], self.original_dir, [xref])[0]
+
+    def ExtractSampleImages(self, image_exts: list[str], sample_num: int, output_dir: str) -> list[str]:
+        """
+        Extract representative images from the source file, sizes of the other images are read from their dictionaries
+        """
+        xrefs = PdfListImages(self.options["input_path"])
+        if len(xrefs) == 0:
+            raise FileCorruptedError(f"Input file '{self.options["input_path"]}' is corrupted or it has no images.")
+        sizes = PdfGetImageSizes(self.options["input_path"], xrefs)
+        MakeDir(output_dir)
+        sample_paths = []
+        for i, extracted_path in enumerate(PdfExtractXrefs(self.options["input_path"], output_dir, self.SampleBySize(xrefs, sizes, sample_num))):
+            sample_path = f"{output_dir}/{i + 1:02d}-xref{GetFileName(extracted_path)}"
+            MoveFile(extracted_path, sample_path)
+            sample_paths.append(sample_path)
+        return sample_paths
+
+    def InitStream(self, image_exts: list[str]):
+        """
+        Initialize the workbench of streaming mode, only the images of the first window are extracted
+        Args:
+            image_exts: List of image file extensions to be processed, e.g. ['.jpg', '.png']
+        """
+        # The target starts as a clean copy of the source, so that it can be saved incrementally
+        with Span("PdfCompact", "file", bytes_read=GetFileSize(self.options["input_path"])) as span:
+            PdfCompact(self.options["input_path"], self.target_pdf_path)
+            span.Set(bytes_written=GetFileSize(self.target_pdf_path))
+        page_num = PdfGetPageNum(self.target_pdf_path)
+        seen = set()
+        self.windows = []
+        for start in range(0, page_num, self.stream_window):
+            xrefs = PdfListImages(self.target_pdf_path, range(start, min(start + self.stream_window, page_num)))
+            self.windows.append([xref for xref in xrefs if xref not in seen])
+            seen.update(xrefs)
+        if len(seen) == 0:
+            raise FileCorruptedError(f"Input file '{self.options["input_path"]}' is corrupted or it has no images.")
+        with open(f"{self.workbench_dir}/windows.json", "w") as f:
+            json.dump(self.windows, f)
+        self.InitWindow(0, image_exts)
+
+    def InitWindow(self, window: int, image_exts: list[str]):
+        """
+        Extract the images of a window from the target, and load them as tasks
+        Args:
+            window: Index of the window
+            image_exts: List of image file extensions to be processed, e.g. ['.jpg', '.png']
+        """
+        for dir_path in (self.original_dir, self.processed_dir):
+            if DirExist(dir_path): DeleteDir(dir_path)
+            MakeDir(dir_path)
+        # Images of committed windows are already replaced in the target, the others are still original
+        with Span("PdfExtractImages", "file", window=window, images=len(self.windows[window])):
+            page_range = range(window * self.stream_window, (window + 1) * self.stream_window)
+            PdfExtractImages(self.target_pdf_path, self.original_dir, self.options.get("cpu_jobs", 0), page_range, self.windows[window])
+        self.window = window
+        self.LoadTasks(SearchFiles(self.original_dir, image_exts, relative=True))
+        self.TriageTasks()
+
+        self.WriteDuplicates()
+        self.WriteTriage()
         self.WriteProgress()
+        # Written last, a crash while initializing a window leaves the previous window as the current one
+        with open(f"{self.workbench_dir}/stream.json", "w") as f:
+            json.dump({"window": window, "pages": self.stream_window}, f)
+
+    def WorkbenchInitialized(self) -> bool:
+        """
+        Check if the workbench exists and was made in the same mode (streaming or not)
+        """
+        if self.stream_window > 0: return FileExist(f"{self.workbench_dir}/stream.json")
+        return super().WorkbenchInitialized() and not FileExist(f"{self.workbench_dir}/stream.json")
+
+    def ReadStream(self, image_exts: list[str]):
+        """
+        Read the state of streaming mode, a window committed to the target before a crash is not processed again
+        Args:
+            image_exts: List of image file extensions to be processed, e.g. ['.jpg', '.png']
+        """
+        with open(f"{self.workbench_dir}/windows.json", "r") as f:
+            self.windows = json.load(f)
+        with open(f"{self.workbench_dir}/stream.json", "r") as f:
+            stream = json.load(f)
+        self.window = stream["window"]
+        self.stream_window = stream.get("pages", self.stream_window) # Windows keep the pages they were made with
+        committed = int(PdfGetCatalogKey(self.target_pdf_path, STREAM_CATALOG_KEY) or 0)
+        if committed > self.window and committed < len(self.windows):
+            self.InitWindow(committed, image_exts)
+        self.window = max(self.window, committed)
+
+    def ProcessAllImage(self, family: Family):
+        """
+        Process all images that are not done, in streaming mode window by window,
+        each window is committed to the target before the images of the next window are extracted
+        """
+        if self.stream_window == 0:
+            super().ProcessAllImage(family)
+            return
+        self.ReadStream(family.supported_image_exts)
+        while self.window < len(self.windows):
+            super().ProcessAllImage(family)
+            self.CommitWindow()
+            if self.window + 1 < len(self.windows):
+                self.InitWindow(self.window + 1, family.supported_image_exts)
+            else:
+                self.window += 1
+
+    def SharesPipeline(self) -> bool:
+        """
+        Check if the chunk jobs can go through a pipeline shared with other books,
+        in streaming mode the images are extracted and committed window by window, so they cannot
+        """
+        return self.stream_window == 0
+
+    def CommitWindow(self):
+        """
+        Replace the images of the current window in the target by an incremental save,
+        the number of committed windows is saved together with them as the checkpoint
+        """
+        images = self.GetReplacedImages()
+        with Span("PdfUpdateImages", "file", window=self.window, images=len(images)) as span:
+            size = GetFileSize(self.target_pdf_path)
+            PdfUpdateImages(self.target_pdf_path, images, {STREAM_CATALOG_KEY: str(self.window + 1)})
+            span.Set(bytes_written=GetFileSize(self.target_pdf_path) - size)
+        for dir_path in (self.original_dir, self.processed_dir): ClearDir(dir_path)
+
+    def GetReplacedImages(self) -> dict[int, str]:
+        """
+        Get the processed image of each xref to replace,
+        duplicate xrefs are replaced with the processed image of their task, skipped xrefs are kept
+        """
+        images = {}
+        for image_relpath in self.GetProcessedTasks():
+            processed_path = f"{self.processed_dir}/{image_relpath}"
+            images[int(GetFileNameWithoutExt(image_relpath))] = processed_path
+            for duplicate in self.duplicates.get(image_relpath, []):
+                images[int(GetFileNameWithoutExt(duplicate))] = processed_path
+        return images
+
+    def GetProgressStatistics(self):
+        """
+        Get the number of completed images and total image count, in streaming mode of the whole document
+        """
+        done_count, total_count = super().GetProgressStatistics()
+        if self.stream_window == 0 or len(self.windows) == 0: return (done_count, total_count)
+        return self.GetStreamProgress(done_count)
+
+    def GetStreamProgress(self, done_count: int) -> tuple[int, int]:
+        """
+        Add the images of committed windows to the number of done tasks of the current window,
+        the total is the number of images of all windows
+        """
+        committed_count = sum(len(xrefs) for xrefs in self.windows[:self.window])
+        total_count = sum(len(xrefs) for xrefs in self.windows)
+        return (min(committed_count + done_count, total_count), total_count)
+
+    def Emit(self, event: ProgressEvent):
+        """
+        Emit a progress event, in streaming mode counted over the whole document
+        """
+        if self.stream_window > 0 and len(self.windows) > 0:
+            event.done, event.total = self.GetStreamProgress(event.done)
+        super().Emit(event)
 
     def GenerateTarget(self):
         """
@@ -44,33 +240,31 @@ class PDFWorkbench(Workbench):
         # Compress files to output directory
         target_path = self.options["output_path"]
         MakeDir(GetFileDir(target_path))
-
-        images = {
-            int(GetFileNameWithoutExt(image_relpath)): f"{self.processed_dir}/{image_relpath}"
-            for image_relpath in self.progress.tasks.keys()
-        }
-        PdfReplaceImages(f"{self.workbench_dir}/o.pdf", images, target_path)
-
+        self.WriteTarget(target_path)
         # Delete working directory
         self.CleanupWorkbench()
-    
-    def GetPreviewImageXrefAndExt(self) -> str:
+
+    def WriteTarget(self, target_path: str):
         """
-        Get xref and extension name of the preview image
+        Write the PDF file with the processed images, the workbench is kept
         """
-        xref, info = PdfGetFirstImage(f"{self.workbench_dir}/o.pdf")
-        ext = info["ext"]
-        return xref, ext
+        # In streaming mode all images are already in the target, it is only compacted
+        if self.stream_window > 0:
+            with Span("PdfCompact", "file", bytes_read=GetFileSize(self.target_pdf_path)) as span:
+                PdfCompact(self.target_pdf_path, target_path, {STREAM_CATALOG_KEY: "null"})
+                span.Set(bytes_written=GetFileSize(target_path))
+            return
 
+        with Span("PdfReplaceImages", "file", bytes_read=GetFileSize(f"{self.workbench_dir}/o.pdf")) as span:
+            PdfReplaceImages(f"{self.workbench_dir}/o.pdf", self.GetReplacedImages(), target_path)
+            span.Set(bytes_written=GetFileSize(target_path))
+    
     def GetPreviewImageIOPath(self) -> tuple[str, str]:
         """
         Get the preview image input and output path.
         """
-        # Get the preview image name
-        preview_image_xref, preview_image_ext = self.GetPreviewImageXrefAndExt()
-        # Process image
-        original_path  = f"{self.original_dir}/{preview_image_xref}.{preview_image_ext}"
-        processed_path = f"{self.workbench_dir}/preview.{preview_image_ext}"
+        original_path = self.preview_image_path
+        processed_path = f"{self.workbench_dir}/preview{GetFileExt(original_path)}"
         return original_path, processed_path
 
     def GetImageIOPath(self, task: str) -> tuple[str, str]:
@@ -0,0 +1,88 @@
+import queue
+import threading
+
+
+class Pipeline:
+    """
+    A pipeline of stages connected by bounded queues.
+    Each stage has its own worker threads, a stage whose output queue is full waits
+    for the next stage (backpressure), so a slow stage never piles up unbounded work
+    """
+    end = object() # Marks the end of input of a stage
+
+    def __init__(self, stages: list[tuple[str, object, int]], queue_size: int = 2, OnError = None):
+        """
+        Args:
+            stages: List of (stage name, function, number of workers), the function is called as `function(item)`
+                    and returns the item passed to the next stage
+            queue_size: Maximum number of items waiting in front of each stage
+            OnError: Function called as `OnError(item, error)` when a stage fails on an item
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.OnError = OnError
+
+    def Run(self, items):
+        """
+        Run all items through the pipeline, returns when all items pass the last stage.
+        Items may be a generator, it is advanced only when the first stage has room for another item.
+        If a stage or the generator raises an exception, the pipeline stops and the first exception is re-raised
+        """
+        stop = threading.Event()
+        errors: list[BaseException] = []
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages] # Input queue of each stage
+        remaining_workers = [workers for _, _, workers in self.stages]
+        lock = threading.Lock()
+
+        def Put(i: int, item) -> bool:
+            # Wait for space in the queue, give up if the pipeline stops
+            while not stop.is_set():
+                try:
+                    queues[i].put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def Get(i: int):
+            while not stop.is_set():
+                try:
+                    return queues[i].get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return self.end
+
+        def Feed():
+            try:
+                for item in items:
+                    if not Put(0, item): return
+            except BaseException as e:
+                with lock: errors.append(e)
+                stop.set()
+                return
+            for _ in range(self.stages[0][2]): Put(0, self.end)
+
+        def Work(i: int):
+            _, function, _ = self.stages[i]
+            while (item := Get(i)) is not self.end:
+                try:
+                    item = function(item)
+                except BaseException as e:
+                    with lock: errors.append(e)
+                    stop.set()
+                    if self.OnError is not None: self.OnError(item, e)
+                    break
+                if i + 1 < len(self.stages) and not Put(i + 1, item): break
+            # The last worker of a stage tells the workers of the next stage to finish
+            with lock:
+                remaining_workers[i] -= 1
+                last = remaining_workers[i] == 0
+            if last and i + 1 < len(self.stages):
+                for _ in range(self.stages[i + 1][2]): Put(i + 1, self.end)
+
+        threads = [threading.Thread(target=Feed, name="feed", daemon=True)]
+        for i, (name, _, workers) in enumerate(self.stages):
+            threads.extend(threading.Thread(target=Work, args=(i,), name=f"{name}-{j}", daemon=True) for j in range(workers))
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        if len(errors) > 0: raise errors[0]
@@ -0,0 +1,248 @@
+import numpy as np
+from PIL import Image
+
+"""
+Edge-aware pixel-art scalers approximating hqnx and xBR, implemented with NumPy array operations.
+
+They are not the reference algorithms: the hqx rules are a condensed form of its lookup tables
+(same YUV thresholds, but one blend rule per corner instead of a case per neighborhood pattern),
+and the xBR edge weights are a plus shaped filter over diagonal distances instead of the exact
+sums of pixel distances of xBR lv1. Results look alike but are not pixel identical to the references.
+
+Both scalers decide, for each corner of each source pixel, how much the corner is pulled
+toward its neighbors, as a "corner delta" (4 times the change of the corner color).
+The sub-pixels of the scaled pixel are then composed from the corner deltas,
+weighted by the distance of each sub-pixel to each corner.
+Images are processed in strips of rows, so memory of intermediate arrays is bounded
+"""
+
+# A color differs from another if any YUV component differs more than this, the same as hqx
+Y_THRESHOLD, U_THRESHOLD, V_THRESHOLD = 48, 7, 6
+# Two colors are equal for xBR if their distance (see `Distance`) is less than this
+XBR_EQ_THRESHOLD = 32
+STRIP_ROWS = 32 # Number of source rows processed at a time
+CORNERS = [(-1, -1), (-1, 1), (1, -1), (1, 1)] # (row, column) direction of each corner
+
+
+def ToYuv(rgb: np.ndarray) -> np.ndarray:
+    """
+    Convert RGB pixels to YUV
+    Args:
+        rgb: Array of shape (3 or more, height, width), only the first 3 channels are used
+        return: int16 array of shape (3, height, width)
+    """
+    r, g, b = (rgb[i].astype(np.int32) for i in range(3))
+    y = (77 * r + 150 * g + 29 * b) >> 8
+    u = (-43 * r - 85 * g + 128 * b) >> 8
+    v = (128 * r - 107 * g - 21 * b) >> 8
+    return np.stack([y, u, v]).astype(np.int16)
+
+
+def Differ(yuv1: np.ndarray, yuv2: np.ndarray) -> np.ndarray:
+    """
+    Whether colors differ by the hqx thresholds
+    """
+    delta = np.abs(yuv1 - yuv2)
+    return (delta[0] > Y_THRESHOLD) | (delta[1] > U_THRESHOLD) | (delta[2] > V_THRESHOLD)
+
+
+def Distance(yuv1: np.ndarray, yuv2: np.ndarray) -> np.ndarray:
+    """
+    Color distance used by xBR, luma weighs more than chroma
+    """
+    delta = np.abs(yuv1 - yuv2)
+    return 4 * delta[0] + delta[1] + delta[2]
+
+
+def PairFields(yuv: np.ndarray, Measure) -> dict:
+    """
+    Measure each pixel against its right, lower, lower right and lower left neighbor
+    Args:
+        yuv: YUV array of shape (3, height, width)
+        Measure: `Differ` or `Distance`
+        return: Direction -> field of measures, indexed by the top left pixel of each pair
+    """
+    return {
+        (0, 1): Measure(yuv[:, :, :-1], yuv[:, :, 1:]),
+        (1, 0): Measure(yuv[:, :-1, :], yuv[:, 1:, :]),
+        (1, 1): Measure(yuv[:, :-1, :-1], yuv[:, 1:, 1:]),
+        (1, -1): Measure(yuv[:, :-1, 1:], yuv[:, 1:, :-1]),
+    }
+
+
+def GetPair(fields: dict, p1: tuple[int, int], p2: tuple[int, int], pad: int, h: int, w: int) -> np.ndarray:
+    """
+    Get the measures between the pixels at offsets p1 and p2 from each pixel, p1 and p2 must be adjacent
+    """
+    if p1 > p2: p1, p2 = p2, p1
+    direction = (p2[0] - p1[0], p2[1] - p1[1])
+    r, c = min(p1[0], p2[0]), min(p1[1], p2[1])
+    return fields[direction][pad+r:pad+r+h, pad+c:pad+c+w]
+
+
+def HqxCornerDeltas(pixels: np.ndarray, yuv: np.ndarray, h: int, w: int) -> dict:
+    """
+    Corner deltas by a condensed approximation of the hqx rules, pixels and yuv are padded by 1
+    """
+    def At(p: tuple[int, int]) -> np.ndarray:
+        return pixels[:, 1+p[0]:1+p[0]+h, 1+p[1]:1+p[1]+w]
+
+    fields = PairFields(yuv, Differ)
+    center = At((0, 0))
+    # Difference of each side neighbor from the center
+    sides = {p: At(p) - center for p in [(0, -1), (0, 1), (-1, 0), (1, 0)]}
+
+    deltas = {}
+    for sy, sx in CORNERS:
+        E, A, B, C = (0, 0), (0, sx), (sy, 0), (sy, sx) # Center, horizontal side, vertical side, diagonal
+        a, b, c = (GetPair(fields, E, p, 1, h, w) for p in (A, B, C))
+        ab = GetPair(fields, A, B, 1, h, w)
+        # Both sides are like the center, or an edge cuts the corner (both sides and the diagonal differ
+        # from the center in the same way): blend the corner with both sides.
+        # Only one side differs: blend with the other side. Otherwise a line goes through the corner: keep it
+        both = (~a & ~b) | (a & b & c & ~ab)
+        delta = sides[A] * (both | (b & ~a))
+        delta += sides[B] * (both | (a & ~b))
+        deltas[(sy, sx)] = delta
+    return deltas
+
+
+def XbrCornerDeltas(pixels: np.ndarray, yuv: np.ndarray, h: int, w: int) -> dict:
+    """
+    Corner deltas by an approximation of the xBR lv1 rules, pixels and yuv are padded by 2
+    """
+    def At(p: tuple[int, int]) -> np.ndarray:
+        return pixels[:, 2+p[0]:2+p[0]+h, 2+p[1]:2+p[1]+w]
+
+    def Dist(p1: tuple[int, int], p2: tuple[int, int]) -> np.ndarray:
+        return GetPair(fields, p1, p2, 2, h, w)
+
+    def Eq(p1: tuple[int, int], p2: tuple[int, int]) -> np.ndarray:
+        return GetPair(eq_fields, p1, p2, 2, h, w)
+
+    def Ne(p1: tuple[int, int], p2: tuple[int, int]) -> np.ndarray:
+        return GetPair(ne_fields, p1, p2, 2, h, w)
+
+    fields = PairFields(yuv, Distance)
+    eq_fields = {direction: field < XBR_EQ_THRESHOLD for direction, field in fields.items()}
+    ne_fields = {direction: ~field for direction, field in eq_fields.items()}
+    # Approximated xBR edge weight of a diagonal: the distance of the pair crossing the corner (4 times)
+    # plus the distances of the 4 parallel pairs around it, that is a plus shaped filter over the diagonal distances,
+    # indexed by the pair crossing the corner (with 1 less padding). xBR itself sums distances of specific pixel pairs
+    weights = {
+        direction: 4 * field[1:-1, 1:-1] + field[:-2, 1:-1] + field[2:, 1:-1] + field[1:-1, :-2] + field[1:-1, 2:]
+        for direction, field in fields.items() if direction[1] != 0 and direction[0] != 0
+    }
+    center = At((0, 0))
+    sides = {p: At(p) - center for p in [(0, -1), (0, 1), (-1, 0), (1, 0)]}
+
+    deltas = {}
+    for sy, sx in CORNERS:
+        # Neighbors named as in the xBR description for the lower right corner, mirrored for other corners
+        #        B  C
+        #     D  E  F  F4
+        #     G  H  I  I4
+        #        H5 I5
+        E, B, C, D, F, H, I = (0, 0), (-sy, 0), (-sy, sx), (0, -sx), (0, sx), (sy, 0), (sy, sx)
+        G, I4, I5 = (sy, -sx), (sy, 2*sx), (2*sy, sx)
+        # Weights of an edge along the F-H diagonal and across it
+        along = GetPair(weights, H, F, 1, h, w)
+        across = GetPair(weights, E, I, 1, h, w)
+        edge = (along < across) & (
+            (Ne(F, B) & Ne(H, D)) | (Eq(E, I) & Ne(F, I4) & Ne(H, I5)) | Eq(E, G) | Eq(E, C)
+        )
+        # Blend the corner half way to the closer of F and H.
+        # Selecting by multiplying with masks is much faster than np.where broadcasting over channels
+        closer_f = Dist(E, F) <= Dist(E, H)
+        delta = sides[F] * (edge & closer_f)
+        delta += sides[H] * (edge & ~closer_f)
+        delta <<= 1
+        deltas[(sy, sx)] = delta
+    return deltas
+
+
+def GetSubPixelWeights(n: int) -> list[list[dict]]:
+    """
+    Weights (in sixths) of the corner deltas of each sub-pixel of a pixel scaled n times.
+    A corner sub-pixel takes the whole delta of its corner, the weight falls to 0 at the anti-diagonal
+    """
+    s = [(2 * i + 1 - n) / (n - 1) for i in range(n)] # Sub-pixel position, -1 to 1
+    return [
+        [
+            {corner: weight for corner in CORNERS
+             if (weight := min(6, max(0, round(3 * (s[i] * corner[0] + s[j] * corner[1]))))) > 0}
+            for j in range(n)
+        ]
+        for i in range(n)
+    ]
+
+
+def Compose(center: np.ndarray, deltas: dict, n: int) -> np.ndarray:
+    """
+    Compose the scaled pixels from the centers and corner deltas
+    Args:
+        center: int16 array of shape (channels, h, w)
+        deltas: Corner -> int16 array of shape (channels, h, w)
+        n: Scaling factor
+        return: uint8 array of shape (channels, h * n, w * n)
+    """
+    channels, h, w = center.shape
+    out = np.empty((channels, h, n, w, n), np.uint8)
+    for i, row in enumerate(GetSubPixelWeights(n)):
+        for j, weights in enumerate(row):
+            # Blends are convex, so values never leave the range of uint8
+            if len(weights) == 0:
+                out[:, :, i, :, j] = center
+                continue
+            if len(weights) == 1 and 6 in weights.values(): # Corner sub-pixel, the common case
+                value = deltas[next(iter(weights))] + 2
+                value >>= 2
+            else:
+                value = sum(weight * deltas[corner] for corner, weight in weights.items()) + 12
+                value //= 24
+            value += center
+            out[:, :, i, :, j] = value
+    return out.reshape(channels, h * n, w * n)
+
+
+def ScaleImage(img: Image.Image, n: int, CornerDeltas, pad: int) -> Image.Image:
+    """
+    Scale an image n times strip by strip
+    Args:
+        img: Image
+        n: Scaling factor
+        CornerDeltas: Function called as `CornerDeltas(pixels, yuv, h, w)`
+        pad: Number of neighbor pixels needed around each pixel
+    """
+    original_mode = img.mode
+    if img.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in img.mode or "transparency" in img.info
+        img = img.convert("RGBA" if has_alpha else "RGB")
+    # Channels are kept in separate planes, so that masks broadcast over whole rows
+    pixels = np.stack([np.pad(np.asarray(band), pad, mode="edge") for band in img.split()])
+    height, width = img.height, img.width
+
+    out = np.empty((pixels.shape[0], height * n, width * n), np.uint8)
+    for y0 in range(0, height, STRIP_ROWS):
+        h = min(STRIP_ROWS, height - y0)
+        strip = pixels[:, y0:y0+h+2*pad].astype(np.int16)
+        deltas = CornerDeltas(strip, ToYuv(strip), h, width)
+        out[:, y0*n:(y0+h)*n] = Compose(strip[:, pad:pad+h, pad:pad+width], deltas, n)
+
+    result = Image.merge(img.mode, [Image.fromarray(band) for band in out])
+    if original_mode in ("L", "1"): result = result.convert("L")
+    return result
+
+
+def Hqx(img: Image.Image, n: int) -> Image.Image:
+    """
+    Scale an image n times (2, 3 or 4) with an approximation of hqnx
+    """
+    return ScaleImage(img, n, HqxCornerDeltas, 1)
+
+
+def Xbr(img: Image.Image, n: int) -> Image.Image:
+    """
+    Scale an image n times (2, 3 or 4) with an approximation of xBR
+    """
+    return ScaleImage(img, n, XbrCornerDeltas, 2)
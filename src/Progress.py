@@ -1,20 +1,86 @@
+import os
 import json
 import threading
+import collections
 
 
 class Progress:
-    """a class to manage progress"""
+    """
+    a class to manage progress.
+    Tasks of each status are kept in a queue, so that claiming a task takes constant time.
+    Changes are saved to an append-only journal beside the progress file,
+    the journal is compacted into the progress file when it grows long
+    """
 
-    def __init__(self, tasks: list[str] = []):
-        self.tasks = {task: "waiting" for task in tasks}
+    def __init__(self, tasks: list[str] = [], compact_threshold: int = 1000, fsync_interval: int = 16):
+        """
+        Args:
+            tasks: Initial tasks, all waiting
+            compact_threshold: Compact the journal when it has more records than this and the number of tasks
+            fsync_interval: Force the journal to disk every this many saves, 0 to leave it to the OS
+        """
         self.lock = threading.Lock()
+        self.compact_threshold = compact_threshold
+        self.fsync_interval = fsync_interval
+        self.save_count = 0 # Number of saves since the last fsync
+        self.journal_size: int | None = None # Number of records in the journal, None means the progress file is out of date
+        self.pending: list[tuple[str, str]] = [] # Changes not saved to the journal yet
+        self.subscribers: list = [] # Callbacks of status changes
+        self.SetTasks({task: "waiting" for task in tasks})
+
+    def SetTasks(self, tasks: dict[str, str]):
+        """
+        Replace all tasks and rebuild queues and counters, the caller must hold the lock (or be the constructor)
+        """
+        self.tasks = tasks
+        self.queues: dict[str, collections.deque] = collections.defaultdict(collections.deque) # status -> tasks
+        self.counts: collections.Counter = collections.Counter() # status -> number of tasks
+        for task, status in self.tasks.items():
+            self.queues[status].append(task)
+            self.counts[status] += 1
+        self.journal_size = None
+        self.pending = []
+
+    def SetStatus(self, task: str, status: str):
+        """
+        Set the status of a task, the caller must hold the lock
+        """
+        old_status = self.tasks.get(task)
+        if old_status == status: return
+        if old_status is not None: self.counts[old_status] -= 1
+        self.tasks[task] = status
+        self.counts[status] += 1
+        # The task stays in the queue of its old status, it is skipped when popped
+        self.queues[status].append(task)
+        self.pending.append((task, status))
+
+    def Subscribe(self, callback):
+        """
+        Subscribe to status changes made by `Update` and `GetOneTaskOfStatusAndUpdate`.
+        Callbacks are called without holding the lock, so they never block other threads from claiming tasks
+        Args:
+            callback: Function called as `callback(task, status, done_count, total_count)`
+        """
+        self.subscribers.append(callback)
+
+    def Unsubscribe(self, callback):
+        """
+        Unsubscribe from status changes
+        """
+        self.subscribers.remove(callback)
+
+    def Notify(self, task: str, status: str, done_count: int, total_count: int):
+        """
+        Call all subscribers with a status change
+        """
+        for callback in list(self.subscribers): callback(task, status, done_count, total_count)
 
     def LoadTasks(self, tasks: list[str]):
         """
         Load tasks from a list
         """
         with self.lock:
-            self.tasks = {task: "waiting" for task in tasks}
+            self.SetTasks({task: "waiting" for task in tasks})
 
     def GetTaskNum(self) -> int:
         """
@@ -22,28 +88,55 @@ class Progress:
         """
         with self.lock:
             return len(self.tasks)
-        
+
     def GetTaskNumOfStatus(self, status: str) -> int:
         """
         Get the number of tasks with the given status
         """
         with self.lock:
-            return sum(1 for task in self.tasks.values() if task == status)
+            return self.counts[status]
+
+    def GetTasksOfStatus(self, status: str) -> list[str]:
+        """
+        Get all tasks with the given status
+        """
+        with self.lock:
+            # The queue of a status holds all its tasks, tasks that changed status since queued are skipped
+            return [task for task in dict.fromkeys(self.queues[status]) if self.tasks[task] == status]
+
+    def OrderQueue(self, status: str, tasks: list[str]):
+        """
+        Put tasks first in the queue of their status, so that `GetOneTaskOfStatusAndUpdate` claims them in the given order
+        """
+        with self.lock:
+            listed = {task: None for task in tasks if self.tasks.get(task) == status}
+            rest = [task for task in dict.fromkeys(self.queues[status]) if self.tasks[task] == status and task not in listed]
+            self.queues[status] = collections.deque([*listed, *rest])
+
+    def PruneQueues(self):
+        """
+        Drop tasks that changed status since queued from the queues, the caller must hold the lock
+        """
+        for status, queue in self.queues.items():
+            # The first entry of a task is the one a claim would reach first
+            self.queues[status] = collections.deque(task for task in dict.fromkeys(queue) if self.tasks[task] == status)
 
     def RefreshUndoneTask(self):
         """
         Set all undone tasks to waiting
         """
         with self.lock:
-            for task, status in self.tasks.items():
-                if status != "done": self.tasks[task] = "waiting"
+            for task, status in list(self.tasks.items()):
+                if status != "done": self.SetStatus(task, "waiting")
 
     def Update(self, task: str, status: str):
         """
         Update the status of a task
         """
         with self.lock:
-            self.tasks[task] = status
+            self.SetStatus(task, status)
+            done_count, total_count = self.counts["done"], len(self.tasks)
+        self.Notify(task, status, done_count, total_count)
 
     def GetOneTaskOfStatusAndUpdate(self, status_get: str, status_update: str) -> str | None:
         """
@@ -51,25 +144,80 @@ class Progress:
         If no task with the given status, return None
         """
         with self.lock:
-            for task, status in self.tasks.items():
-                if status == status_get:
-                    self.tasks[task] = status_update
-                    return task
-        return None
-    
+            queue = self.queues[status_get]
+            while len(queue) > 0:
+                task = queue.popleft()
+                if self.tasks[task] == status_get: # Skip tasks whose status has changed since queued
+                    self.SetStatus(task, status_update)
+                    done_count, total_count = self.counts["done"], len(self.tasks)
+                    break
+            else:
+                return None
+        self.Notify(task, status_update, done_count, total_count)
+        return task
+
     def Load(self, file_path: str):
         """
-        Load progress from a file
+        Load progress from a file, then replay its journal if any
         """
         with self.lock:
             with open(file_path, "r") as f:
-                self.tasks = json.load(f)
+                tasks = json.load(f)
+            journal_size = 0
+            if os.path.isfile(f"{file_path}.journal"):
+                with open(f"{file_path}.journal", "r") as f:
+                    for line in f:
+                        try:
+                            task, status = json.loads(line)
+                        except json.JSONDecodeError: # The last record may be cut by a crash
+                            journal_size = None
+                            break
+                        tasks[task] = status
+                        journal_size += 1
+                        if not line.endswith("\n"): # Cut right before its line break
+                            journal_size = None
+                            break
+            self.SetTasks(tasks)
+            # Records must not be appended onto a cut record, the next save compacts the journal instead
+            self.journal_size = journal_size
 
     def Dump(self, file_path: str):
         """
-        Dump progress to a file
+        Dump progress to a file, and clear its journal
+        """
+        with self.lock:
+            self.DumpUnlocked(file_path)
+
+    def DumpUnlocked(self, file_path: str):
+        """
+        Dump progress to a file, and clear its journal, the caller must hold the lock
+        """
+        # Write a new file and then replace, the progress file is never partially written
+        with open(f"{file_path}.tmp", "w") as f:
+            json.dump(self.tasks, f, indent=4)
+        os.replace(f"{file_path}.tmp", file_path)
+        if os.path.isfile(f"{file_path}.journal"): os.remove(f"{file_path}.journal")
+        self.journal_size = 0
+        self.pending = []
+        self.PruneQueues()
+
+    def Save(self, file_path: str):
+        """
+        Save changes since the last save to the journal of a progress file,
+        the whole progress is dumped instead if the file is out of date or the journal is long
         """
         with self.lock:
-            with open(file_path, "w") as f:
-                json.dump(self.tasks, f, indent=4)
-        
\ No newline at end of file
+            if self.journal_size is None or self.journal_size + len(self.pending) > max(self.compact_threshold, len(self.tasks)):
+                self.DumpUnlocked(file_path)
+                return
+            if len(self.pending) == 0: return
+
+            with open(f"{file_path}.journal", "a") as f:
+                f.write("".join(json.dumps(record) + "\n" for record in self.pending))
+                self.save_count += 1
+                if self.fsync_interval > 0 and self.save_count >= self.fsync_interval:
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self.save_count = 0
+            self.journal_size += len(self.pending)
+            self.pending = []
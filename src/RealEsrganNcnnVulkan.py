@@ -1,7 +1,7 @@
-import subprocess
 from utility import *
 from Error import *
 from Family import Family
+from Tuning import TuningProfile
 
 
 class RealEsrganNcnnVulkan(Family):
@@ -9,10 +9,12 @@ class RealEsrganNcnnVulkan(Family):
     family_name = "realesrgan-ncnn-vulkan"
     description = "Real-ESRGAN-ncnn-vulkan is a Real-time Image Super-Resolution Model based on Efficient Residual Block." # family description information
     supported_image_exts = [".jpg", ".jpeg", ".png", ".webp"]
+    tunable = True
 
     def __init__(self, options: dict):
         super().__init__(options)
         self.CheckOptions()
+        self.tuning_profile = TuningProfile()
 
     def ProcessImage(self, input_file: str, output_file: str):
         """
@@ -27,14 +29,48 @@ class RealEsrganNcnnVulkan(Family):
             "-o", output_file,
             "-s", str(self.model_scale),
             "-n", self.options["model"],
+            *self.GetTuningArgs([input_file]),
         ]
-        try:
-            subprocess.run(cmd, check=True, shell=True, capture_output=True, text=True)
-        except subprocess.CalledProcessError as e:
-            info = f"Model '{self.options["model"]}' of family '{self.options["family"]}' FAILED:\n" \
-                   f"stdout: {e.stdout}\n" \
-                   f"stderr: {e.stderr}"
-            raise ModelRuntimeError(info) from e
+        self.RunModel(cmd)
+
+    def ProcessImages(self, io_files: list[tuple[str, str]], stage_dir: str):
+        """
+        Process a chunk of images with one process of the executable,
+        so that the model is loaded only once for the whole chunk
+        Args:
+            io_files: List of (input image file path, output image file path)
+            stage_dir: Directory where temporary files of the chunk can be placed
+        """
+        if len(io_files) == 1:
+            self.ProcessImage(*io_files[0])
+            return
+
+        def Run(input_dir: str, output_dir: str, format: str):
+            cmd = [
+                f"{ROOT}/family/{self.family_name}/{self.family_name}",
+                "-i", input_dir,
+                "-o", output_dir,
+                "-s", str(self.model_scale),
+                "-n", self.options["model"],
+                "-f", format,
+                *self.GetTuningArgs([f"{input_dir}/{file}" for file in GetDirList(input_dir, "file")]),
+            ]
+            self.RunModel(cmd)
+
+        self.ProcessImagesByDir(io_files, stage_dir, Run)
+
+    def GetTuningArgs(self, image_files: list[str]) -> list[str]:
+        """
+        Get the tile size and threads arguments for the given input images.
+        Chunks hold images of similar size, so the largest image decides the settings.
+        If the machine is not calibrated, return no arguments so that defaults of the executable are used
+        """
+        tuning = self.tuning
+        if tuning is None and self.tuning_profile.Calibrated(self.family_name, self.options["model"]):
+            width, height = max((GetImageSize(image_file) for image_file in image_files), key=lambda size: size[0] * size[1])
+            tuning = self.tuning_profile.Get(self.family_name, self.options["model"], width, height)
+        if tuning is None: return []
+        return ["-t", str(tuning["tile"]), "-j", tuning["threads"]]
 
     @classmethod
     def GetAllModels(cls) -> list[str]:
@@ -0,0 +1,210 @@
+import os
+import mmap
+import tempfile
+from PIL import Image, ImageChops
+
+"""
+Processing of oversized images in overlapping tiles.
+
+A source image is split into a grid of tiles overlapping their neighbors, a few tiles at a time
+go through the model, then each output tile is scaled straight to its place in the result
+and blended into the tiles already placed with a linear ramp across the overlap, which hides the seams.
+Only a batch of tiles is held at model scale, never the whole model output of the image,
+and the result is kept in a memory-mapped file (see `TiledResult`), encoders read it from there.
+The source image itself is still decoded whole, Pillow decodes images whole, so the memory of a tiled image
+grows with its source (1/ratio^2 of the result) while the model output and the result add a fixed amount
+"""
+
+TILE_SIDE = 1024 # Side length (source pixels) of tiles
+TILE_OVERLAP = 32 # Overlap (source pixels) of adjacent tiles
+TILE_BATCH = 4 # Number of tiles processed by the model at a time
+
+
+def GetTileStarts(length: int, tile_side: int, overlap: int) -> list[int]:
+    """
+    Get the start positions of tiles along one side, the last tile ends at the end of the side
+    """
+    if length <= tile_side: return [0]
+    step = tile_side - overlap
+    starts = list(range(0, length - tile_side, step))
+    starts.append(length - tile_side)
+    return starts
+
+
+def GetTiles(size: tuple[int, int], tile_side: int = TILE_SIDE, overlap: int = TILE_OVERLAP) -> list[tuple[tuple, int, int]]:
+    """
+    Split an image into overlapping tiles in raster order
+    Args:
+        size: (width, height) of the image
+        tile_side: Side length of tiles
+        overlap: Overlap of adjacent tiles, less than half of tile_side
+        return: List of (tile box (left, upper, right, lower), right of the tile on the left, lower of the tile above),
+                the right or lower is 0 if there is no such tile
+    """
+    width, height = size
+    xs, ys = GetTileStarts(width, tile_side, overlap), GetTileStarts(height, tile_side, overlap)
+    return [
+        (
+            (x, y, min(x + tile_side, width), min(y + tile_side, height)),
+            min(xs[i-1] + tile_side, width) if i > 0 else 0,
+            min(ys[j-1] + tile_side, height) if j > 0 else 0,
+        )
+        for j, y in enumerate(ys)
+        for i, x in enumerate(xs)
+    ]
+
+
+def ScaleBox(box: tuple[int, int, int, int], ratio: float) -> tuple[int, int, int, int]:
+    """
+    Scale a box, adjacent boxes stay adjacent after rounding
+    """
+    return tuple(round(v * ratio) for v in box)
+
+
+def MakeFeatherMask(size: tuple[int, int], left: int, top: int) -> Image.Image:
+    """
+    Make the blending mask of a tile, opacity rises from 0 to 255 across the left and top overlaps
+    Args:
+        size: (width, height) of the tile
+        left: Width of the overlap with the tile on the left, 0 if none
+        top: Height of the overlap with the tile above, 0 if none
+    """
+    width, height = size
+    mask = Image.new("L", size, 255)
+    if left > 0:
+        ramp = Image.linear_gradient("L").rotate(90).resize((left, height))
+        mask.paste(ramp, (0, 0))
+    if top > 0:
+        ramp = Image.linear_gradient("L").resize((width, top))
+        vertical = Image.new("L", size, 255)
+        vertical.paste(ramp, (0, 0))
+        mask = ImageChops.multiply(mask, vertical)
+    return mask
+
+
+def ProcessTiled(img: Image.Image, Process, ratio: float, temp_dir: str,
+                 tile_side: int = TILE_SIDE, overlap: int = TILE_OVERLAP, batch: int = TILE_BATCH) -> "TiledResult":
+    """
+    Process an image tile by tile and stitch the results into a memory-mapped file
+    Args:
+        img: Source image
+        Process: Function called as `Process(tiles)` with a list of tile images, returns the list of processed tiles
+        ratio: Size of the result relative to the source, the processed tiles are scaled to it
+        temp_dir: Directory of the file of the result
+        tile_side: Side length of tiles
+        overlap: Overlap of adjacent tiles
+        batch: Number of tiles processed at a time
+        return: Result of size `img.size * ratio`, to be closed by the caller
+    """
+    tiles = GetTiles(img.size, tile_side, overlap)
+    result = None
+    try:
+        for i in range(0, len(tiles), batch):
+            batch_tiles = tiles[i:i+batch]
+            outputs = Process([img.crop(box) for box, _, _ in batch_tiles])
+            for (box, previous_right, previous_lower), output in zip(batch_tiles, outputs):
+                left, upper, right, lower = ScaleBox(box, ratio)
+                output = output.resize((right - left, lower - upper), Image.Resampling.LANCZOS)
+                if result is None:
+                    has_alpha = "A" in output.mode or "transparency" in output.info
+                    mode = "RGBA" if has_alpha else "L" if output.mode in ("L", "1") else "RGB"
+                    result = TiledResult(mode, ScaleBox((0, 0) + img.size, ratio)[2:], temp_dir)
+                # Tiles are placed in raster order, so only the left and top overlaps are already covered
+                left_overlap = max(round(previous_right * ratio) - left, 0)
+                top_overlap = max(round(previous_lower * ratio) - upper, 0)
+                if left_overlap == 0 and top_overlap == 0:
+                    result.Paste(output, (left, upper))
+                else:
+                    result.Paste(output, (left, upper), MakeFeatherMask(output.size, left_overlap, top_overlap))
+            del outputs
+    except BaseException:
+        if result is not None: result.Close()
+        raise
+    return result
+
+
+class TiledResult:
+    """
+    The result of a tiled image, its pixels are kept in a memory-mapped file instead of in memory,
+    so that the memory of a tiled image does not grow with the size of its result.
+    It is encoded like an image, with `size`, `mode`, `save` and `convert`, Pillow encoders read the rows
+    of the image mapped on the file (see `View`)
+    """
+    store_modes = {"L": "L", "RGB": "RGBX", "RGBA": "RGBA"} # Mode of the image -> mode of the stored pixels
+
+    def __init__(self, mode: str, size: tuple[int, int], temp_dir: str):
+        """
+        Args:
+            mode: Mode of the image, "L", "RGB" or "RGBA"
+            size: (width, height) of the image
+            temp_dir: Directory of the file of the pixels
+        """
+        self.mode = mode
+        self.size = size
+        self.store_mode = self.store_modes[mode]
+        self.pixel_size = len(self.store_mode) # Bytes per pixel
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(suffix=".pixels", dir=temp_dir)
+        self.file = os.fdopen(fd, "w+b")
+        self.file.truncate(max(size[0] * size[1] * self.pixel_size, 1))
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    def View(self) -> Image.Image:
+        """
+        Get a read-only image of the stored pixels in the mode of the image, sharing the memory map
+        """
+        if self.store_mode == self.mode:
+            return Image.frombuffer(self.store_mode, self.size, self.map, "raw", self.store_mode, 0, 1)
+        # Pillow keeps RGB pixels in 4 bytes like RGBX, but `frombuffer` maps only modes whose raw mode is the mode,
+        # so RGB is mapped through the core of Pillow. If that is not available, the image is converted in memory
+        try:
+            view = Image.new(self.mode, (0, 0))._new(Image.core.map_buffer(self.map, self.size, "raw", 0, (self.mode, 0, 1)))
+            view.readonly = 1
+            return view
+        except (AttributeError, TypeError, ValueError):
+            return Image.frombuffer(self.store_mode, self.size, self.map, "raw", self.store_mode, 0, 1).convert(self.mode)
+
+    def Paste(self, tile: Image.Image, position: tuple[int, int], mask: Image.Image = None):
+        """
+        Paste a tile, blended into the pixels already there by the mask if given
+        """
+        left, upper = position
+        if tile.mode != self.store_mode: tile = tile.convert(self.store_mode)
+        if mask is not None:
+            region = Image.frombuffer(self.store_mode, self.size, self.map, "raw", self.store_mode, 0, 1) \
+                          .crop((left, upper, left + tile.width, upper + tile.height))
+            region.paste(tile, (0, 0), mask)
+            tile = region
+        data = tile.tobytes()
+        row_size, stride = tile.width * self.pixel_size, self.width * self.pixel_size
+        for y in range(tile.height):
+            offset = (upper + y) * stride + left * self.pixel_size
+            self.map[offset:offset + row_size] = data[y * row_size:(y + 1) * row_size]
+
+    def save(self, fp, format: str, **args):
+        """
+        Encode the image like `Image.save`, the encoder reads the mapped pixels row by row
+        """
+        self.View().save(fp, format, **args)
+
+    def convert(self, mode: str) -> Image.Image:
+        """
+        Convert to an image in memory, only for encoders that cannot read the mode of the image
+        """
+        return self.View().convert(mode)
+
+    def Close(self):
+        """
+        Release the memory map and delete the file
+        """
+        self.map.close()
+        self.file.close()
+        os.remove(self.path)
@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import subprocess
+
+"""
+Tracing of workbench phases, pipeline stages and model processes.
+
+While a trace is started, `Span` records the time, thread and arguments (image size, bytes read and written)
+of a piece of work, otherwise it does nothing. Traces are saved as Chrome trace-event JSON,
+which can be opened in chrome://tracing or https://ui.perfetto.dev.
+Spans are recorded in this process only, work done in worker processes shows as the span waiting for it
+"""
+
+
+class Tracer:
+    """Collects the spans of a trace"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter() # Time 0 of the trace
+        self.spans: list[dict] = [] # Finished spans, as Chrome trace events
+        self.thread_names: dict[int, str] = {} # Thread id -> thread name
+
+    def Add(self, name: str, category: str, start: float, end: float, args: dict):
+        """
+        Record a finished span
+        Args:
+            name: Span name
+            category: Span category, "phase", "stage", "image", "model" or "file"
+            start: Start time (time.perf_counter)
+            end: End time (time.perf_counter)
+            args: Arguments shown with the span
+        """
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args,
+        }
+        with self.lock:
+            self.spans.append(event)
+            self.thread_names[thread.ident] = thread.name
+
+    def Save(self, trace_path: str):
+        """
+        Save the trace as Chrome trace-event JSON
+        """
+        with self.lock:
+            metadata = [
+                {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                for tid, name in self.thread_names.items()
+            ]
+            events = metadata + self.spans
+        with open(trace_path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def GetSummary(self) -> dict[tuple[str, str], dict]:
+        """
+        Sum up spans of the same category and name
+        Args:
+            return: (category, name) -> {"count", "seconds", "max_seconds", "bytes_read", "bytes_written",
+                                          "cpu_seconds", "max_rss"}, in the order spans were first recorded
+        """
+        summary = {}
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span["ts"])
+        for span in spans:
+            item = summary.setdefault((span["cat"], span["name"]), {
+                "count": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes_read": 0, "bytes_written": 0,
+                "cpu_seconds": 0.0, "max_rss": 0,
+            })
+            seconds = span["dur"] / 1e6
+            args = span["args"]
+            item["count"] += 1
+            item["seconds"] += seconds
+            item["max_seconds"] = max(item["max_seconds"], seconds)
+            item["bytes_read"] += args.get("bytes_read", 0)
+            item["bytes_written"] += args.get("bytes_written", 0)
+            item["cpu_seconds"] += args.get("cpu_user", 0.0) + args.get("cpu_system", 0.0)
+            item["max_rss"] = max(item["max_rss"], args.get("max_rss", 0))
+        return summary
+
+
+class Span:
+    """
+    A span of work, used as a context manager. Arguments known only at the end are added with `Set`.
+    Spans cost nothing but their creation while no trace is started
+    """
+
+    def __init__(self, name: str, category: str = "stage", **args):
+        self.tracer = TRACER
+        self.enabled = self.tracer is not None # Whether the span is recorded, expensive arguments are computed only if so
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0.0
+
+    def Set(self, **args):
+        """
+        Add arguments to the span
+        """
+        if self.enabled: self.args.update(args)
+
+    def __enter__(self) -> "Span":
+        if self.enabled: self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.enabled: return
+        if exc_type is not None: self.args["error"] = exc_type.__name__
+        self.tracer.Add(self.name, self.category, self.start, time.perf_counter(), self.args)
+
+
+TRACER: Tracer | None = None # Tracer of the running trace, None if no trace is started
+
+
+def StartTrace() -> Tracer:
+    """
+    Start recording spans of this process
+    """
+    global TRACER
+    TRACER = Tracer()
+    return TRACER
+
+
+def StopTrace() -> Tracer | None:
+    """
+    Stop recording spans, returns the tracer of the stopped trace
+    """
+    global TRACER
+    tracer, TRACER = TRACER, None
+    return tracer
+
+
+def AddSpan(name: str, category: str, start: float, end: float, **args):
+    """
+    Record a finished span if a trace is started, see `Tracer.Add`
+    """
+    if TRACER is not None: TRACER.Add(name, category, start, end, args)
+
+
+def RunProcess(cmd: list[str], span: Span, **kwargs) -> subprocess.CompletedProcess:
+    """
+    Run a command like `subprocess.run(cmd, check=True, capture_output=True, text=True, **kwargs)`.
+    If the span is recorded, the CPU time and peak resident memory of the process (and the processes it waited for)
+    are added to it, on platforms where they are available
+    """
+    if not span.enabled or not hasattr(os, "wait4"): # Windows
+        return subprocess.run(cmd, check=True, capture_output=True, text=True, **kwargs)
+
+    # The process is reaped by wait4 to get its resource usage, its output goes to temporary files
+    # rather than pipes, so it cannot block on a full pipe while nothing reads it
+    with tempfile.TemporaryFile("w+") as stdout, tempfile.TemporaryFile("w+") as stderr:
+        process = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, text=True, **kwargs)
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stdout.seek(0)
+        stderr.seek(0)
+        result = subprocess.CompletedProcess(process.args, process.returncode, stdout.read(), stderr.read())
+    unit = 1 if sys.platform == "darwin" else 1024 # ru_maxrss is in bytes on macOS, in KB elsewhere
+    span.Set(cpu_user=rusage.ru_utime, cpu_system=rusage.ru_stime, max_rss=rusage.ru_maxrss * unit)
+    result.check_returncode()
+    return result
@@ -1,54 +1,118 @@
-import subprocess
 from utility import *
 from Error import *
 from Family import Family
 from PIL import Image
+import PixelArt
 
 
 class Traditional(Family):
     """traditonal image scaling algorithm family"""
     family_name = "traditional"
-    description = "Traditional image scaling algorithms including nearest, bilinear, bicubic, lanczos and hqnx." # family description information
+    description = "Traditional image scaling algorithms including nearest, bilinear, bicubic, lanczos, and approximations of hqnx and xBR." # family description information
     supported_image_exts = [".jpg", ".jpeg", ".png", ".webp"]
+    max_model_scale = None # Pillow filters scale by any factor
     resample_map = {
         "nearest": Image.Resampling.NEAREST,
         "bilinear": Image.Resampling.BILINEAR,
         "bicubic": Image.Resampling.BICUBIC,
         "lanczos": Image.Resampling.LANCZOS,
     }
+    pixel_art_map = { # Edge-aware scalers for line art and pixel art, model -> (scaler name, scaling factor)
+        "hq2x": ("Hqx", 2),
+        "hq3x": ("Hqx", 3),
+        "hq4x": ("Hqx", 4),
+        "xbr2x": ("Xbr", 2),
+        "xbr3x": ("Xbr", 3),
+        "xbr4x": ("Xbr", 4),
+    }
 
     def __init__(self, options: dict):
         super().__init__(options)
         self.CheckOptions()
-        self.model_scale = self.options["scale"]
+        # Pillow filters scale to the scaling factor directly, pixel-art scalers scale by their own factor
+        if self.options["model"].lower() in self.resample_map: self.model_scale = self.options["scale"]
 
     def ProcessImage(self, input_file: str, output_file: str):
         """
-        Process image with Pillow-based interpolation
+        Process image file with Pillow-based interpolation
+        """
+        img = self.ProcessImageObjects([input_file], None)[0]
+        try:
+            img.save(output_file)
+        except Exception as e:
+            info = f"Model '{self.options["model"]}' of family '{self.family_name}' FAILED:\n{e}"
+            raise ModelRuntimeError(info) from e
+
+    def ProcessImageObjects(self, sources: list, stage_dir: str) -> list:
+        """
+        Process images in memory with Pillow-based interpolation, no file is written
+        Args:
+            sources: List of images, each is either a decoded PIL image or the path of an image file
+            stage_dir: Not used
+            return: List of processed PIL images
+        """
+        try:
+            images = [LoadImage(source) if isinstance(source, str) else source for source in sources]
+        except Exception as e:
+            info = f"Model '{self.options["model"]}' of family '{self.family_name}' FAILED:\n{e}"
+            raise ModelRuntimeError(info) from e
+        if self.cpu_pool is None: return [self.Resize(img) for img in images]
+        # Resize in worker processes of the workbench
+        try:
+            scalers = [self.GetScaler(img) for img in images]
+            return self.cpu_pool.Map(scalers[0][0], images, [args for _, args in scalers])
+        except Exception as e:
+            info = f"Model '{self.options["model"]}' of family '{self.family_name}' FAILED:\n{e}"
+            raise ModelRuntimeError(info) from e
+
+    def Resize(self, img: Image.Image) -> Image.Image:
+        """
+        Resize a PIL image with the algorithm of the model
         """
-        model = self.options["model"].lower()
-        if model not in self.resample_map:
-            raise ModelRuntimeError(f"Model '{model}' of family '{self.family_name}' is not supported.")
         try:
-            with Image.open(input_file) as img:
-                new_size = (
-                    int(round(img.width * self.options["scale"])),
-                    int(round(img.height * self.options["scale"]))
-                )
-                if new_size[0] <= 0 or new_size[1] <= 0:
-                    raise ScaleValueInvalidError(f"Invalid target size {new_size} for scale {self.options['scale']}.")
-                out = img.resize(new_size, resample=self.resample_map[model])
-                out.save(output_file)
+            function, args = self.GetScaler(img)
+            return function(img, *args)
         except Exception as e:
-            info = f"Model '{model}' of family '{self.family_name}' FAILED:\n{e}"
+            info = f"Model '{self.options["model"]}' of family '{self.family_name}' FAILED:\n{e}"
             raise ModelRuntimeError(info) from e
 
+    def GetScaler(self, img: Image.Image) -> tuple:
+        """
+        Get the scaling function of the model and its arguments for an image, called as `function(img, *args)`
+        """
+        model = self.options["model"].lower()
+        if model in self.pixel_art_map:
+            scaler, n = self.pixel_art_map[model]
+            return getattr(PixelArt, scaler), (n,)
+        return Image.Image.resize, (self.GetTargetSize(img), self.GetResample())
+
+    def GetResample(self) -> Image.Resampling:
+        """
+        Get the Pillow resampling filter of the model
+        """
+        model = self.options["model"].lower()
+        if model not in self.resample_map:
+            raise ModelRuntimeError(f"Model '{model}' of family '{self.family_name}' is not supported.")
+        return self.resample_map[model]
+
+    def GetTargetSize(self, img: Image.Image) -> tuple[int, int]:
+        """
+        Get the size of an image resized by the scaling factor
+        """
+        new_size = (
+            int(round(img.width * self.options["scale"])),
+            int(round(img.height * self.options["scale"]))
+        )
+        if new_size[0] <= 0 or new_size[1] <= 0:
+            raise ScaleValueInvalidError(f"Invalid target size {new_size} for scale {self.options['scale']}.")
+        return new_size
+
     @classmethod
     def GetAllModels(cls) -> list[str]:
         """
         Get all supported interpolation algorithm names
         """
-        return list(cls.resample_map.keys())
+        return list(cls.resample_map.keys()) + list(cls.pixel_art_map.keys())
 
     @classmethod
     def GetDescription(cls) -> str:
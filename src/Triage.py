@@ -0,0 +1,69 @@
+import json
+from PIL import Image, ImageStat
+from Error import *
+
+# Routes of images
+ROUTE_SKIP = "skip" # Copied through unchanged
+ROUTE_TRADITIONAL = "traditional" # Scaled with LANCZOS, no model
+ROUTE_MODEL = "model" # Processed with the super-resolution model
+
+# Default triage rules, a rule set to 0 is disabled. Triage itself is off unless asked for (--triage or --triage-rules)
+DEFAULT_TRIAGE_RULES = {
+    "tiny_side": 32, # Images whose longer side is at most this are skipped (gaiji glyphs, spacers)
+    "large_side": 0, # Images whose longer side is at least this are skipped, they have enough resolution (off by default,
+                     # a large image may still be scaled up on purpose)
+    "small_side": 64, # Images whose longer side is at most this are scaled traditionally (icons, ornaments)
+    "flat_stddev": 2.0, # Images whose luminance standard deviation is at most this are scaled traditionally (solid colors)
+}
+STATS_SIDE = 64 # Statistics are taken on a thumbnail of about this size
+
+
+def LoadTriageRules(rules_path: str | None) -> dict:
+    """
+    Load triage rules from a JSON file, rules not in the file keep their default values
+    Args:
+        rules_path: JSON file path, None to use the default rules
+    """
+    rules = DEFAULT_TRIAGE_RULES.copy()
+    if rules_path is None: return rules
+    try:
+        with open(rules_path, "r") as f:
+            custom_rules = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise TriageRulesInvalidError(f"Cannot load triage rules from '{rules_path}': {e}") from e
+    if not isinstance(custom_rules, dict):
+        raise TriageRulesInvalidError(f"Triage rules in '{rules_path}' must be a JSON object.")
+    for name, value in custom_rules.items():
+        if name not in DEFAULT_TRIAGE_RULES:
+            raise TriageRulesInvalidError(f"Unknown triage rule '{name}', available rules are: {", ".join(DEFAULT_TRIAGE_RULES)}.")
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise TriageRulesInvalidError(f"Triage rule '{name}' must be a number not less than 0, but got {value!r}.")
+        rules[name] = value
+    return rules
+
+
+def TriageImage(img: Image.Image, rules: dict) -> tuple[str, str]:
+    """
+    Decide the route of an image, the size rules need only the image header,
+    the image is decoded (at reduced size if possible) only for the statistics rules
+    Args:
+        img: Lazily opened image
+        rules: Triage rules
+        return: (route, reason)
+    """
+    width, height = img.size
+    side = max(width, height)
+    if rules["tiny_side"] > 0 and side <= rules["tiny_side"]:
+        return ROUTE_SKIP, "tiny image"
+    if rules["large_side"] > 0 and side >= rules["large_side"]:
+        return ROUTE_SKIP, "large image"
+    if rules["small_side"] > 0 and side <= rules["small_side"]:
+        return ROUTE_TRADITIONAL, "small image"
+
+    if rules["flat_stddev"] > 0:
+        img.draft("L", (STATS_SIDE, STATS_SIDE)) # JPEG images are decoded at reduced size
+        thumb = img.convert("L")
+        thumb.thumbnail((STATS_SIDE, STATS_SIDE), Image.Resampling.BOX)
+        if ImageStat.Stat(thumb).stddev[0] <= rules["flat_stddev"]:
+            return ROUTE_TRADITIONAL, "flat image"
+    return ROUTE_MODEL, "detailed image"
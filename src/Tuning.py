@@ -0,0 +1,126 @@
+import json
+import time
+import platform
+from utility import *
+from Family import Family
+
+
+TUNING_BUCKETS = [256, 512, 1024, 2048] # Resolution buckets, by the longer side of the model input image
+TUNING_TILE_GRID = [0, 100, 200, 400] # Tile sizes to try, 0 means auto
+TUNING_THREAD_GRID = ["1:2:2", "2:2:2", "2:4:2", "4:4:4"] # load:proc:save thread splits to try
+
+
+class TuningProfile:
+    """
+    A per-machine profile that stores the fastest tile size and thread split
+    of each family and model, for each resolution bucket
+    """
+
+    def __init__(self, profile_path: str = None):
+        self.profile_path = f"{ROOT}/profile/{platform.node()}.json" if profile_path is None else profile_path
+        # {family name: {model name: {bucket: {"tile": tile size, "threads": thread split}}}}
+        self.settings: dict[str, dict[str, dict[str, dict]]] = {}
+        if FileExist(self.profile_path): self.Load()
+
+    def Load(self):
+        """
+        Load the profile from its file
+        """
+        with open(self.profile_path, "r") as f:
+            self.settings = json.load(f)
+
+    def Save(self):
+        """
+        Save the profile to its file
+        """
+        MakeDir(GetFileDir(self.profile_path))
+        with open(self.profile_path, "w") as f:
+            json.dump(self.settings, f, indent=4)
+
+    def Calibrated(self, family_name: str, model: str) -> bool:
+        """
+        Check if the family and model are calibrated
+        """
+        return bool(self.settings.get(family_name, {}).get(model))
+
+    def Get(self, family_name: str, model: str, width: int, height: int) -> dict | None:
+        """
+        Get the settings for an image of the given size, the nearest calibrated bucket is used.
+        If the family and model are not calibrated, return None
+        """
+        buckets = self.settings.get(family_name, {}).get(model)
+        if not buckets: return None
+        bucket = self.GetBucket(width, height)
+        nearest = min(buckets.keys(), key=lambda b: abs(int(b) - bucket))
+        return buckets[nearest]
+
+    def Set(self, family_name: str, model: str, bucket: int, tile: int, threads: str):
+        """
+        Set the settings of a bucket
+        """
+        buckets = self.settings.setdefault(family_name, {}).setdefault(model, {})
+        buckets[str(bucket)] = {"tile": tile, "threads": threads}
+
+    @classmethod
+    def GetBucket(cls, width: int, height: int) -> int:
+        """
+        Get the resolution bucket of an image size
+        """
+        long_side = max(width, height)
+        for bucket in TUNING_BUCKETS:
+            if long_side <= bucket: return bucket
+        return TUNING_BUCKETS[-1]
+
+
+def MakeSyntheticImage(image_path: str, width: int, height: int):
+    """
+    Make a synthetic image with noise, which is not compressible and has no flat areas
+    """
+    from PIL import Image
+    channels = [Image.effect_noise((width, height), 64) for _ in range(3)]
+    Image.merge("RGB", channels).save(image_path)
+
+
+def Calibrate(family: Family, images_per_run: int = 4, Report = None, profile_path: str = None) -> TuningProfile:
+    """
+    Run the family on synthetic images across the grid of tile sizes and thread splits,
+    save the fastest settings of each resolution bucket to the per-machine profile
+    Args:
+        family: Family to calibrate, its `tunable` must be True
+        images_per_run: Number of images processed by each run
+        Report: Function called after each run as `Report(bucket, tile, threads, seconds)`
+        profile_path: Path of the profile file, default is the per-machine profile, see `TuningProfile`
+        return: The updated profile
+    """
+    profile = TuningProfile(profile_path)
+    calibration_dir = f"{ROOT}/workbench/.calibration"
+    if DirExist(calibration_dir): DeleteDir(calibration_dir)
+
+    try:
+        for bucket in TUNING_BUCKETS:
+            # Portrait images whose longer side is the bucket bound, like most book illustrations
+            input_dir = f"{calibration_dir}/{bucket}/input"
+            output_dir = f"{calibration_dir}/{bucket}/output"
+            MakeDir(input_dir)
+            MakeDir(output_dir)
+            io_files = []
+            for i in range(images_per_run):
+                MakeSyntheticImage(f"{input_dir}/{i}.png", bucket * 3 // 4, bucket)
+                io_files.append((f"{input_dir}/{i}.png", f"{output_dir}/{i}.png"))
+
+            best = None
+            for tile in TUNING_TILE_GRID:
+                for threads in TUNING_THREAD_GRID:
+                    family.tuning = {"tile": tile, "threads": threads}
+                    start = time.perf_counter()
+                    family.ProcessImages(io_files, f"{calibration_dir}/stage")
+                    seconds = time.perf_counter() - start
+                    if Report is not None: Report(bucket, tile, threads, seconds)
+                    if best is None or seconds < best[0]: best = (seconds, tile, threads)
+            profile.Set(family.family_name, family.options["model"], bucket, best[1], best[2])
+    finally:
+        family.tuning = None
+        if DirExist(calibration_dir): DeleteDir(calibration_dir)
+
+    profile.Save()
+    return profile
@@ -1,4 +1,3 @@
-import time
 import threading
 from rich.progress import Progress, TextColumn, BarColumn, SpinnerColumn, TimeElapsedColumn
 from rich.console import Console
@@ -6,6 +5,12 @@ from rich.live import Live
 from rich.spinner import Spinner
 from Family import Family
 from Workbench import Workbench
+from Event import ProgressEvent, TaskDone
+from Tuning import Calibrate, TUNING_BUCKETS, TUNING_TILE_GRID, TUNING_THREAD_GRID
+from Benchmark import RunBenchmark, BenchmarkResult
+from Triage import ROUTE_SKIP, ROUTE_TRADITIONAL, ROUTE_MODEL
+from Trace import Tracer
+from Batch import BatchBook, BatchScheduler
 
 
 class CmdUserInterface:
@@ -29,6 +34,31 @@ class CmdUserInterface:
             # Modify the final text, remove spinner icon
             live.update("[bold green]  Pre-processing finished![/bold green]\n")
 
+    def InitPreview(self):
+        # Display initialization prompt, add spinner icon
+        spinner = Spinner('dots', text="[bold blue]Finding the preview image...[/bold blue]")
+        with Live(spinner, refresh_per_second=10, console=self.console) as live:
+            self.workbench.InitPreview(self.family.supported_image_exts)
+            # Modify the final text, remove spinner icon
+            live.update("[bold green]  Preview image found![/bold green]\n")
+
+    def ReportTriage(self):
+        # Print how many images are routed around the model and why
+        statistics = self.workbench.GetTriageStatistics()
+        if ROUTE_SKIP not in statistics and ROUTE_TRADITIONAL not in statistics: return
+        descriptions = {
+            ROUTE_MODEL: "processed with the model",
+            ROUTE_TRADITIONAL: "scaled traditionally",
+            ROUTE_SKIP: "copied unchanged",
+        }
+        self.Print("[bold blue][Info][/bold blue] Image triage:")
+        for route in [ROUTE_MODEL, ROUTE_TRADITIONAL, ROUTE_SKIP]:
+            if route not in statistics: continue
+            reasons = statistics[route]
+            details = ", ".join(f"{reason}: {count}" for reason, count in reasons.items() if reason != "")
+            self.Print(f"  - [green]{sum(reasons.values())}[/green] {descriptions[route]}" + (f" [yellow]({details})[/yellow]" if details else ""))
+        self.Print()
+
     def ProcessAllImage(self):
         # Use rich.progress to create progress bar, add spinner icon (using default color)
         with Progress(
@@ -56,24 +86,22 @@ class CmdUserInterface:
                     exception_occurred.set()
                     exception = e
             
-            # monitor thread function
-            def Monitor():
-                nonlocal exception_occurred, exception
-                while True:
-                    done_count, total_count = self.workbench.GetProgressStatistics()
-                    progress_bar.update(task, completed=done_count, total=total_count)
-                    # check if exception occurred or all images are processed
-                    if exception_occurred.is_set() or done_count == total_count: break
-                    time.sleep(0.5)
-            
-            # create and start threads
+            # update the progress bar when a task is done, no polling
+            done_count, total_count = self.workbench.GetProgressStatistics()
+            progress_bar.update(task, completed=done_count, total=total_count)
+            def OnEvent(event: ProgressEvent):
+                if isinstance(event, TaskDone):
+                    progress_bar.update(task, completed=event.done, total=event.total)
+            self.workbench.Subscribe(OnEvent)
+
+            # create and start thread
             process_thread = threading.Thread(target=Process, daemon=True)
-            monitor_thread = threading.Thread(target=Monitor, daemon=True)
             process_thread.start()
-            monitor_thread.start()
-            # wait for threads to finish
+            # wait for thread to finish
             process_thread.join()
-            monitor_thread.join()
+            self.workbench.Unsubscribe(OnEvent)
+            done_count, total_count = self.workbench.GetProgressStatistics()
+            progress_bar.update(task, completed=done_count, total=total_count)
             
             # update progress bar based on whether an exception occurred
             if exception_occurred.is_set():
@@ -90,6 +118,97 @@ class CmdUserInterface:
             # Modify the final text, remove spinner icon
             live.update("[bold green]  Generating target file finished![/bold green]\n")
 
+    def FitSizeBudget(self):
+        # Display fitting prompt, add spinner icon
+        spinner = Spinner('dots', text="[bold blue]Fitting images into the size budget...[/bold blue]")
+        with Live(spinner, refresh_per_second=10, console=self.console) as live:
+            size_before, size_after, qualities = self.workbench.FitSizeBudget()
+            # Modify the final text, remove spinner icon
+            live.update("[bold green]  Fitting into the size budget finished![/bold green]\n")
+        self.ReportSizeBudget(self.workbench.options["size_budget"], size_before, size_after, qualities)
+
+    def ReportSizeBudget(self, budget: float, size_before: int, size_after: int, qualities: dict[str, int]):
+        # Print the output size before and after fitting, and the quality levels chosen
+        if len(qualities) == 0:
+            self.Print(f"[bold blue][Info][/bold blue] Output size {size_before / 1e6:.1f} MB is within the budget of {budget} MB", end="\n\n")
+            return
+        levels = sorted(qualities.values())
+        self.Print(f"[bold blue][Info][/bold blue] Output size {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB (budget {budget} MB), "\
+                   f"quality of {len(levels)} images: {levels[0]} to {levels[-1]}, median {levels[len(levels) // 2]}")
+        if size_after > budget * 1e6:
+            self.Print("[bold yellow][Warning][/bold yellow] The budget cannot be reached even at the lowest quality level", end="\n\n")
+        else:
+            self.Print()
+
+    def ProcessBatch(self, books: list[BatchBook], options: dict):
+        # Use rich.progress to create one progress bar per book, books are processed through one shared pipeline
+        descriptions = {
+            "waiting": "[yellow]Waiting[/yellow]",
+            "preparing": "[bold blue]Pre-processing the file...[/bold blue]",
+            "processing": "[bold blue]Images processing...[/bold blue]",
+            "packing": "[bold blue]Generating target file...[/bold blue]",
+            "done": "[bold green]Finished![/bold green]",
+            "failed": "[bold red]Failed, for an error occurred[/bold red]",
+        }
+        with Progress(
+            SpinnerColumn(style="none"),
+            TextColumn("{task.description}"),
+            BarColumn(),
+            TextColumn("{task.completed}/{task.total}"),
+            TextColumn("{task.percentage:>3.0f}%"),
+            TimeElapsedColumn(),
+        ) as progress_bar:
+            rows = {id(book): progress_bar.add_task(f"[magenta]{book.workbench.file_name}[/magenta] {descriptions['waiting']}", total=1)
+                    for book in books}
+
+            # exception flag and exception information
+            exception_occurred = threading.Event()
+            exception = None
+
+            # update the progress bar of a book when its status changes or one of its tasks is done, no polling
+            def Report(book: BatchBook):
+                row = rows[id(book)]
+                progress_bar.update(row, description=f"[magenta]{book.workbench.file_name}[/magenta] {descriptions[book.status]}")
+                if book.status in ("processing", "done"):
+                    done_count, total_count = book.workbench.GetProgressStatistics()
+                    progress_bar.update(row, completed=done_count, total=total_count)
+            callbacks = {}
+            for book in books:
+                def OnEvent(event: ProgressEvent, row=rows[id(book)]):
+                    if isinstance(event, TaskDone):
+                        progress_bar.update(row, completed=event.done, total=event.total)
+                callbacks[id(book)] = OnEvent
+                book.workbench.Subscribe(OnEvent)
+
+            # process thread function
+            def Process():
+                nonlocal exception_occurred, exception
+                try:
+                    BatchScheduler(books, options, Report=Report).Run()
+                except Exception as e:
+                    # set the exception flag and store the exception information
+                    exception_occurred.set()
+                    exception = e
+
+            # create and start thread, wait for thread to finish
+            process_thread = threading.Thread(target=Process, daemon=True)
+            process_thread.start()
+            process_thread.join()
+            for book in books: book.workbench.Unsubscribe(callbacks[id(book)])
+            if exception_occurred.is_set(): raise exception
+        self.Print()
+
+        # Print what happened to each book
+        for book in books:
+            if book.resumed:
+                self.Print(f"[bold blue][Info][/bold blue] [magenta]'{book.workbench.options['input_path']}'[/magenta]: "\
+                           "checkpoint found, continued progress from last time (if you want to restart, use -r option)")
+            if book.error is not None:
+                self.Print(f"[bold red]Runtime error:[/bold red] [magenta]'{book.workbench.options['input_path']}'[/magenta]: {book.error}")
+            if book.size_budget_result is not None:
+                self.Print(f"[magenta]'{book.workbench.options['input_path']}'[/magenta]:")
+                self.ReportSizeBudget(options["size_budget"], *book.size_budget_result)
+
     def GeneratePreviewImage(self):
         # Use rich to display preview image prompt, add spinner icon
         spinner = Spinner('dots', text="[bold blue]Generating preview image...[/bold blue]")
@@ -98,3 +217,76 @@ class CmdUserInterface:
             # Modify the final text, remove spinner icon
             live.update("[bold green]  Generating preview image finished![/bold green]\n")
 
+
+    def Calibrate(self):
+        # Use rich.progress to create progress bar of all calibration runs
+        with Progress(
+            SpinnerColumn(style="none"),
+            TextColumn("{task.description}"),
+            BarColumn(),
+            TextColumn("{task.completed}/{task.total}"),
+            TimeElapsedColumn(),
+        ) as progress_bar:
+            total = len(TUNING_BUCKETS) * len(TUNING_TILE_GRID) * len(TUNING_THREAD_GRID)
+            task = progress_bar.add_task("[bold blue]Calibrating...[/bold blue]", total=total)
+
+            def Report(bucket: int, tile: int, threads: str, seconds: float):
+                progress_bar.update(task, advance=1,
+                                    description=f"[bold blue]Calibrating...[/bold blue] (size {bucket}, tile {tile}, threads {threads}: {seconds:.2f}s)")
+
+            profile = Calibrate(self.family, Report=Report)
+            progress_bar.update(task, description="[bold green]Calibration finished![/bold green]\n")
+
+        # Print the chosen settings of each bucket
+        family_name, model = self.family.family_name, self.family.options["model"]
+        self.Print(f"[bold blue]Fastest settings of model '{model}' of family '{family_name}':[/bold blue]")
+        for bucket, setting in profile.settings[family_name][model].items():
+            self.Print(f"  - size <= [green]{bucket}[/green]: tile [green]{setting['tile']}[/green], threads [green]{setting['threads']}[/green]")
+        self.Print(f"[bold blue]Saved to[/bold blue] [cyan]'{profile.profile_path}'[/cyan]")
+
+    def Benchmark(self, options_list: list[dict], image_exts: list[str], sample_num: int, output_dir: str):
+        # Extract sample images, then run every model over them with a progress bar
+        with Progress(
+            SpinnerColumn(style="none"),
+            TextColumn("{task.description}"),
+            BarColumn(),
+            TextColumn("{task.completed}/{task.total}"),
+            TimeElapsedColumn(),
+        ) as progress_bar:
+            task = progress_bar.add_task("[bold blue]Sampling images...[/bold blue]", total=len(options_list))
+            try:
+                sample_paths = self.workbench.ExtractSampleImages(image_exts, sample_num, f"{self.workbench.workbench_dir}/samples")
+
+                def Report(result: BenchmarkResult):
+                    progress_bar.update(task, advance=1,
+                                        description=f"[bold blue]Benchmarking...[/bold blue] ({result.family_name} {result.model}: {result.seconds:.2f}s)")
+
+                progress_bar.update(task, description="[bold blue]Benchmarking...[/bold blue]")
+                results = RunBenchmark(options_list, sample_paths, output_dir, Report=Report)
+            finally:
+                self.workbench.CleanupWorkbench()
+            progress_bar.update(task, description="[bold green]Benchmark finished![/bold green]\n")
+
+        # Print the measurements of each model
+        megapixels = results[0].megapixels if len(results) > 0 else 0.0
+        self.Print(f"[bold blue]{len(sample_paths)} sample images, {megapixels:.2f} megapixels:[/bold blue]")
+        self.Print(f"  {'family':<22} {'model':<26} {'seconds':>8} {'MP/s':>7} {'peak MB':>8} {'KB/image':>9}")
+        for result in results:
+            peak = f"{result.peak_memory / 2**20:.0f}" if result.peak_memory is not None else "-"
+            self.Print(f"  [green]{result.family_name:<22}[/green] [green]{result.model:<26}[/green] "\
+                       f"{result.seconds:>8.2f} {result.GetMegapixelsPerSecond():>7.2f} {peak:>8} {result.GetBytesPerImage() / 1024:>9.1f}")
+        self.Print(f"[bold blue]Outputs saved to[/bold blue] [cyan]'{output_dir}'[/cyan]")
+
+    def ReportTrace(self, tracer: Tracer, trace_path: str):
+        # Print the time and resources of each kind of span, spans on different threads overlap so their seconds add up beyond wall time
+        summary = tracer.GetSummary()
+        self.Print("[bold blue]Trace summary:[/bold blue]")
+        self.Print(f"  {'span':<20} {'count':>6} {'seconds':>8} {'max s':>7} {'MB in':>7} {'MB out':>7} {'CPU s':>7} {'peak MB':>7}")
+        for category in ["phase", "file", "stage", "image", "model"]:
+            for (span_category, name), item in summary.items():
+                if span_category != category: continue
+                cpu = f"{item['cpu_seconds']:.2f}" if item["max_rss"] > 0 else "-"
+                peak = f"{item['max_rss'] / 2**20:.0f}" if item["max_rss"] > 0 else "-"
+                self.Print(f"  [green]{f'{category}/{name}':<20}[/green] {item['count']:>6} {item['seconds']:>8.2f} {item['max_seconds']:>7.2f} "\
+                           f"{item['bytes_read'] / 1e6:>7.1f} {item['bytes_written'] / 1e6:>7.1f} {cpu:>7} {peak:>7}")
+        self.Print(f"[bold blue]Trace saved to[/bold blue] [cyan]'{trace_path}'[/cyan]", end="\n\n")
@@ -1,10 +1,25 @@
+import io
+import os
 import abc
+import json
+import time
+import queue
+import threading
+import collections
 import concurrent.futures
 from PIL import Image
 from utility import *
 from Error import *
 from Family import Family
 from Progress import Progress
+from Cache import ResultCache
+from Event import *
+from Pipeline import Pipeline
+from CpuPool import CpuPool
+from Triage import TriageImage, ROUTE_SKIP, ROUTE_MODEL
+from Tiling import ProcessTiled, TiledResult
+from Trace import Span, AddSpan
+from Encoder import GetEncoderArgs, SearchQuality, DEFAULT_ENCODER_PROFILE, BUDGET_FORMATS
 
 
 class Workbench:
@@ -19,6 +34,19 @@ class Workbench:
         else:
             self.workbench_dir = f"{ROOT}/workbench/{self.file_name}" # working directory
         self.progress = Progress()
+        self.progress.Subscribe(self.OnStatusChange) # Task events are emitted from status changes of the progress
+        self.claim_times: dict[str, float] = {} # task -> when it was claimed (time.perf_counter)
+        self.duplicates: dict[str, list[str]] = {} # task -> other images with the same content as the task
+        self.triage: dict[str, list[str]] = {} # task -> [route, reason] of tasks routed around the model
+        if options.get("cache_size", 0) > 0: # Result cache shared by all books, in MB
+            self.cache = ResultCache(options["cache_dir"], options["cache_size"] * 1024 * 1024)
+        else:
+            self.cache = None
+        self.subscribers: list = [] # Callbacks of progress events
+        self.chunks: collections.deque[tuple[list[str], Family]] = collections.deque() # (tasks, family) of chunks not claimed yet
+        self.claim_lock = threading.Lock() # Held while the read stage claims a chunk
+        self.cpu_pool: CpuPool | None = None # Process pool for CPU-bound stages, None to use threads
+        self.encode_pool: concurrent.futures.ThreadPoolExecutor | None = None # Threads encoding the images of a chunk in parallel
 
     def CleanupWorkbench(self):
         """
@@ -53,20 +81,343 @@ class Workbench:
         """
         pass
 
+    def InitPreview(self, image_exts: list[str]):
+        """
+        Initialize the workbench for a preview, only the preview image needs to be available.
+        Workbenches that can find it without initializing the whole workbench should override this
+        Args:
+            image_exts: List of image file extensions to be processed, e.g. ['.jpg', '.png']
+        """
+        self.InitWorkbench(image_exts)
+
+    def LoadTasks(self, images: list[str]):
+        """
+        Load images as tasks, images with the same content share one task,
+        the other images are recorded as duplicates of the task
+        Args:
+            images: List of images, in the form of tasks
+        """
+        # Group images by a cheap fingerprint first, only images sharing a fingerprint are hashed
+        groups: dict[object, list[str]] = {}
+        for image in images:
+            groups.setdefault(self.GetImageFingerprint(image), []).append(image)
+
+        tasks = []
+        self.duplicates = {}
+        for group in groups.values():
+            if len(group) == 1:
+                tasks.append(group[0])
+                continue
+            unique_images: dict[str, str] = {} # content hash -> task
+            for image in group:
+                content_hash = self.HashImage(image)
+                if content_hash in unique_images:
+                    self.duplicates.setdefault(unique_images[content_hash], []).append(image)
+                else:
+                    unique_images[content_hash] = image
+                    tasks.append(image)
+        # Keep the order of images
+        order = {image: i for i, image in enumerate(images)}
+        tasks.sort(key=order.get)
+        self.progress.LoadTasks(tasks)
+
+    def TriageTasks(self):
+        """
+        Decide the route of each task by the triage rules of the options,
+        in target mode images that already fit the target are skipped, instead of by the large_side rule.
+        Only tasks routed around the model are recorded
+        """
+        self.triage = {}
+        rules = self.options.get("triage_rules")
+        target = self.options.get("target")
+        if (rules is None and target is None) or self.options["preview"]: return
+        # In target mode the target decides which images are large enough
+        if target is not None and rules is not None: rules = {**rules, "large_side": 0}
+        for task in self.progress.GetTasksOfStatus("waiting"):
+            with self.OpenOriginalImageFile(task) as f, Image.open(f) as img:
+                if target is not None and self.GetTargetRatio(img.size) <= 1.0:
+                    route, reason = ROUTE_SKIP, "meets target"
+                elif rules is not None:
+                    route, reason = TriageImage(img, rules)
+                else:
+                    continue
+            if route != ROUTE_MODEL: self.triage[task] = [route, reason]
+
+    def GetTargetRatio(self, size: tuple[int, int]) -> float:
+        """
+        Get the ratio that scales an image of the given size to fit the target size
+        """
+        target_width, target_height = self.options["target"]
+        return min(target_width / size[0], target_height / size[1])
+
+    def GetScaleOfSize(self, size: tuple[int, int]) -> float:
+        """
+        Get the scaling factor applied after pre-scaling to an original image of the given size
+        """
+        if self.options.get("target") is None: return self.options["scale"]
+        return self.GetTargetRatio(size) / self.options["pre_scale"]
+
+    def GetTaskScale(self, task: str) -> float:
+        """
+        Get the scaling factor applied after pre-scaling to the image of a task
+        """
+        if self.options.get("target") is None: return self.options["scale"]
+        return self.GetScaleOfSize(self.GetOriginalImageSize(task))
+
+    def GetTaskFamily(self, family: Family, task: str) -> Family:
+        """
+        Get the family processing a task, in target mode it runs the cheapest variant of the model for the task
+        """
+        if self.options.get("target") is None: return family
+        return family.GetScaleVariant(self.GetTaskScale(task))
+
+    def GetRoute(self, task: str) -> str:
+        """
+        Get the route of a task decided by triage
+        """
+        return self.triage.get(task, [ROUTE_MODEL])[0]
+
+    def GetProcessedTasks(self) -> list[str]:
+        """
+        Get the tasks that have a processed image, skipped tasks keep their original image
+        """
+        return [task for task in self.progress.tasks.keys() if self.GetRoute(task) != ROUTE_SKIP]
+
+    def GetTriageStatistics(self) -> dict[str, dict[str, int]]:
+        """
+        Get the number of tasks of each route and reason, tasks not recorded go to the model
+        """
+        if self.progress.GetTaskNum() == 0: self.ReadProgress() # Continuing from a checkpoint
+        statistics: dict[str, dict[str, int]] = {}
+        for route, reason in self.triage.values():
+            reasons = statistics.setdefault(route, {})
+            reasons[reason] = reasons.get(reason, 0) + 1
+        model_count = self.progress.GetTaskNum() - len(self.triage)
+        if model_count > 0: statistics[ROUTE_MODEL] = {"": model_count}
+        return statistics
+
+    def GetImageFingerprint(self, image: str) -> object:
+        """
+        Get a cheap fingerprint of an image, images with different fingerprints have different content
+        """
+        original_path, _ = self.GetImageIOPath(image)
+        return GetFileSize(original_path)
+
+    def HashImage(self, image: str) -> str:
+        """
+        Get the content hash of an image
+        """
+        original_path, _ = self.GetImageIOPath(image)
+        return HashFile(original_path)
+
+    def GetOriginalImageSize(self, task: str) -> tuple[int, int]:
+        """
+        Get the size (width, height) of the original image of a task
+        """
+        original_path, _ = self.GetImageIOPath(task)
+        return GetImageSize(original_path)
+
+    def OpenOriginalImageFile(self, task: str):
+        """
+        Open the original image of a task as a binary file, it is not necessarily extracted
+        """
+        original_path, _ = self.GetImageIOPath(task)
+        return open(original_path, "rb")
+
+    def FetchOriginalImage(self, task: str):
+        """
+        Make the original image of a claimed task available at its input path.
+        Workbenches that do not extract all images beforehand should override this
+        """
+        pass
+
+    def ReleaseOriginalImage(self, task: str):
+        """
+        Release the original image of a finished task fetched by `FetchOriginalImage`
+        """
+        pass
+
+    def Subscribe(self, callback):
+        """
+        Subscribe to progress events (see Event.py) emitted while processing images.
+        Callbacks are called from worker threads, they should return quickly
+        Args:
+            callback: Function called as `callback(event)`
+        """
+        self.subscribers.append(callback)
+
+    def Unsubscribe(self, callback):
+        """
+        Unsubscribe from progress events
+        """
+        self.subscribers.remove(callback)
+
+    def Emit(self, event: ProgressEvent):
+        """
+        Emit a progress event to all subscribers
+        """
+        for callback in list(self.subscribers): callback(event)
+
+    def OnStatusChange(self, task: str, status: str, done_count: int, total_count: int):
+        """
+        Emit the event of a status change of a task, subscribed to the progress.
+        Tasks done without being claimed, e.g. skipped by triage, take no time
+        """
+        if status == "processing":
+            self.claim_times[task] = time.perf_counter()
+            self.Emit(TaskClaimed(task, done_count, total_count))
+        elif status == "done":
+            claim_time = self.claim_times.pop(task, None)
+            seconds = 0.0 if claim_time is None else time.perf_counter() - claim_time
+            self.Emit(TaskDone(task, seconds, done_count, total_count))
+
+    def IterProcessAllImage(self, family: Family):
+        """
+        Process all images like `ProcessAllImage`, returns an iterator of progress events.
+        If processing fails, the error is raised by the iterator after the last event
+        """
+        events = queue.SimpleQueue()
+        end = object() # Marks the end of processing
+        error = None
+
+        def Process():
+            nonlocal error
+            try:
+                self.ProcessAllImage(family)
+            except BaseException as e:
+                error = e
+            finally:
+                events.put(end)
+
+        self.Subscribe(events.put)
+        try:
+            threading.Thread(target=Process, daemon=True).start()
+            while (event := events.get()) is not end:
+                yield event
+        finally:
+            self.Unsubscribe(events.put)
+        if error is not None: raise error
+
     def ProcessAllImage(self, family: Family):
-        """Returns a generator that yields the number of completed images and total image count each time"""
+        """
+        Process all images that are not done, use `Subscribe` or `IterProcessAllImage` to follow the progress
+        """
+        # Pools are set before the jobs are prepared, the model variants of target mode take the pool of the family
+        cpu_pool, encode_pool = self.MakePools(self.options)
+        self.UsePools(family, cpu_pool, encode_pool)
+        try:
+            jobs = self.PrepareJobs(family)
+            # Process chunks through stages joined by bounded queues, so that the model stage
+            # is kept fed while other chunks are being decoded and encoded
+            pipeline = Pipeline(self.GetPipelineStages(self.options), OnError=lambda job, error: job.workbench.FailJob(job, error))
+            pipeline.Run(jobs)
+        finally:
+            self.UsePools(family, None, None)
+            self.ClosePools(cpu_pool, encode_pool)
+
+    def PrepareJobs(self, family: Family) -> list["ChunkJob"]:
+        """
+        Read the progress, mark the tasks skipped by triage done, and split the other waiting tasks into chunk jobs
+        """
         # Read progress
         self.ReadProgress()
         self.progress.RefreshUndoneTask()
 
-        # Process images
-        def Process(t_id):
-            while self.ProcessOneImage(family): pass
+        # Images skipped by triage keep their original image, they are done without processing
+        waiting_tasks = self.progress.GetTasksOfStatus("waiting")
+        skipped_tasks = [task for task in waiting_tasks if self.GetRoute(task) == ROUTE_SKIP]
+        if len(skipped_tasks) > 0:
+            for task in skipped_tasks: self.progress.Update(task, "done")
+            self.WriteProgress()
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.options["jobs"]) as executor:
-            # use list() to force the generator to run to get exceptions,
-            # if a sub-thread raises an exception, it will be re-raised here
-            list(executor.map(Process, range(self.options["jobs"])))
+        # Split waiting images into chunks, each chunk is processed by one model process.
+        # Tasks are queued in chunk order, the read stage claims them chunk by chunk
+        chunks = self.MakeChunks([task for task in waiting_tasks if self.GetRoute(task) != ROUTE_SKIP], family)
+        self.progress.OrderQueue("waiting", [task for chunk in chunks for task in chunk])
+        self.chunks = collections.deque((chunk, self.GetTaskFamily(family, chunk[0])) for chunk in chunks)
+        return [ChunkJob(self, [], family) for _ in chunks]
+
+    def SharesPipeline(self) -> bool:
+        """
+        Check if the chunk jobs of this workbench can go through a pipeline shared with other books (see Batch.py),
+        workbenches that process images in several rounds should return False
+        """
+        return True
+
+    @classmethod
+    def GetPipelineStages(cls, options: dict) -> list[tuple[str, object, int]]:
+        """
+        Get the stages of the pipeline processing chunk jobs, each job is processed by its own workbench,
+        so that jobs of several books can share one pipeline
+        Args:
+            options: Options giving the number of workers of each stage
+        """
+        read_jobs, pre_scale_jobs, post_scale_jobs, write_jobs = options["stage_jobs"]
+        return [
+            ("read", lambda job: job.workbench.ReadStage(job), read_jobs),
+            ("pre-scale", lambda job: job.workbench.PreScaleStage(job), pre_scale_jobs),
+            ("model", lambda job: job.workbench.ModelStage(job), options["jobs"]),
+            ("post-scale", lambda job: job.workbench.PostScaleStage(job), post_scale_jobs),
+            ("write", lambda job: job.workbench.WriteStage(job), write_jobs),
+        ]
+
+    @classmethod
+    def MakePools(cls, options: dict) -> tuple[CpuPool | None, concurrent.futures.ThreadPoolExecutor | None]:
+        """
+        Make the pools of the CPU-bound stages, close them with `ClosePools`
+        Args:
+            return: (process pool, None) if options ask for CPU processes, (None, encoding threads) on a multi-core machine,
+                    (None, None) otherwise
+        """
+        # CPU-bound stages scale with processes rather than threads, pixels are passed through shared memory
+        if options.get("cpu_jobs", 0) > 0:
+            return (CpuPool(options["cpu_jobs"]), None)
+        if (os.cpu_count() or 1) > 1:
+            return (None, concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="encode"))
+        return (None, None)
+
+    def UsePools(self, family: Family, cpu_pool: CpuPool | None, encode_pool: concurrent.futures.ThreadPoolExecutor | None):
+        """
+        Set the pools used by the stages of this workbench and by the family, None to stop using them
+        """
+        self.cpu_pool = cpu_pool
+        self.encode_pool = encode_pool
+        family.cpu_pool = cpu_pool
+
+    @classmethod
+    def ClosePools(cls, cpu_pool: CpuPool | None, encode_pool: concurrent.futures.ThreadPoolExecutor | None):
+        """
+        Close the pools made by `MakePools`
+        """
+        if cpu_pool is not None: cpu_pool.Close()
+        if encode_pool is not None: encode_pool.shutdown()
+
+    def MakeChunks(self, tasks: list[str], family: Family) -> list[list[str]]:
+        """
+        Split tasks into chunks, images of the same route, model, format and similar size are grouped together,
+        so that one model process handles images with similar tile layout and memory use
+        """
+        if len(tasks) == 0: return []
+        # No more chunks than needed to keep all jobs busy
+        chunk_size = min(self.options["chunk"], Ceil(len(tasks) / self.options["jobs"]))
+
+        # Group tasks by route, model and image format
+        groups: dict[tuple, list[tuple[int, str]]] = {}
+        for task in tasks:
+            width, height = self.GetOriginalImageSize(task)
+            route = self.GetRoute(task)
+            task_family = self.GetTaskFamily(family, task) if route == ROUTE_MODEL else None
+            groups.setdefault((route, id(task_family), GetFileExt(task).lower()), []).append((width * height, task))
+
+        # Sort each group by pixel count, then cut it into chunks
+        chunks = []
+        for group in groups.values():
+            group.sort()
+            for i in range(0, len(group), chunk_size):
+                chunks.append([task for _, task in group[i:i+chunk_size]])
+        # Larger chunks first, so that the last chunks to finish are the small ones
+        chunks.sort(key=len, reverse=True)
+        return chunks
 
     @abc.abstractmethod
     def GenerateTarget(self):
@@ -75,6 +426,108 @@ class Workbench:
         """
         pass
 
+    @abc.abstractmethod
+    def WriteTarget(self, target_path: str):
+        """
+        Write the target file with the processed images to a path, the workbench is kept
+        """
+        pass
+
+    def FitSizeBudget(self, rounds: int = 6) -> tuple[int, int, dict[str, int]]:
+        """
+        Lower the quality level of JPEG and WebP processed images until the target file fits the size budget of the options.
+        Images are re-encoded from the lossless copies kept by the post-scale stage, the model never runs again.
+        The budget left after the other content of the file is shared by images in proportion to their pixel area
+        (counting duplicates), each image gets the highest quality level fitting its share by a binary search,
+        then the share per pixel is corrected by the size actually reached, for a few rounds
+        Args:
+            rounds: Maximum number of rounds
+            return: (size of the target before, predicted size after, quality level of each re-encoded processed image)
+        """
+        budget = self.options["size_budget"] * 1000000
+        probe_path = f"{self.workbench_dir}/budget-probe{GetFileExt(self.options["output_path"])}"
+        self.WriteTarget(probe_path)
+        size_before = GetFileSize(probe_path)
+        DeleteFile(probe_path)
+        if size_before <= budget: return (size_before, size_before, {})
+
+        # Images that can be re-encoded: (processed path, source path, format, weight, number of copies in the file),
+        # sources are decoded one image at a time by the search, a book of decoded images may not fit in memory
+        images = []
+        for task in self.GetProcessedTasks():
+            _, processed_path = self.GetImageIOPath(task)
+            format = self.GetImageFormat(processed_path)
+            if format not in BUDGET_FORMATS: continue
+            # Images processed before the size budget was set have no lossless copy, their processed image is kept
+            # as the source instead, so that fitting again never re-encodes an image already re-encoded by a fit
+            source_path = self.GetLosslessPath(processed_path)
+            if not FileExist(source_path):
+                source_path = self.GetLosslessPath(processed_path, GetFileExt(processed_path))
+                if not FileExist(source_path):
+                    MakeDir(GetFileDir(source_path))
+                    CopyFile(processed_path, source_path)
+            width, height = GetImageSize(source_path)
+            copies = 1 + len(self.duplicates.get(task, []))
+            images.append((processed_path, source_path, format, width * height * copies, copies))
+        fixed = size_before - sum(GetFileSize(processed_path) * copies for processed_path, _, _, _, copies in images)
+        image_budget = max(budget - fixed, 0)
+        total_weight = sum(weight for _, _, _, weight, _ in images)
+        if total_weight == 0: return (size_before, size_before, {})
+
+        max_quality = self.options["quality"]
+        profile = self.options.get("encoder", DEFAULT_ENCODER_PROFILE)
+        sizes: list[dict[int, int]] = [{} for _ in images] # Encoded sizes by quality level of each image, shared by rounds
+        rate = image_budget / total_weight # Bytes per weighted pixel
+        best = None
+        def Search(i: int) -> int:
+            _, source_path, format, weight, copies = images[i]
+            img = self.LoadBudgetSource(source_path, format)
+            with Span("quality search", "image", image=source_path, budget=rate * weight / copies):
+                return SearchQuality(img, format, max_quality, rate * weight / copies, profile, sizes[i])
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for _ in range(rounds):
+                qualities = list(executor.map(Search, range(len(images))))
+                used = sum(sizes[i][quality] * images[i][4] for i, quality in enumerate(qualities))
+                if used <= image_budget:
+                    best = (qualities, used)
+                    # Budget left by images already at the highest quality level goes to the others
+                    open_weight = sum(images[i][3] for i, quality in enumerate(qualities) if quality < max_quality)
+                    if open_weight == 0 or image_budget - used < image_budget * 0.01: break
+                    rate += (image_budget - used) / open_weight
+                else:
+                    rate *= image_budget / used
+            # Nothing fits even at the lowest quality level, the smallest result is kept
+            if best is None: best = (qualities, used)
+
+            qualities, used = best
+            def Write(i: int):
+                processed_path, source_path, format, _, _ = images[i]
+                img = self.LoadBudgetSource(source_path, format)
+                with open(processed_path, "wb") as f:
+                    img.save(f, format, **GetEncoderArgs(format, qualities[i], profile))
+            list(executor.map(Write, range(len(images))))
+        return (size_before, fixed + used, {images[i][0]: quality for i, quality in enumerate(qualities)})
+
+    @classmethod
+    def LoadBudgetSource(cls, source_path: str, format: str) -> Image.Image:
+        """
+        Decode the source of an image re-encoded to fit the size budget, in a mode the format can encode
+        """
+        img = LoadImage(source_path)
+        if format == "JPEG" and img.mode not in ("RGB", "L", "CMYK"): img = img.convert("RGB")
+        return img
+
+    def GetLosslessPath(self, processed_path: str, ext: str = ".png") -> str:
+        """
+        Get the path of the copy of a processed image kept as the source of the size budget mode
+        Args:
+            processed_path: Path of the processed image
+            ext: Extension of the copy, ".png" for the lossless copy, the extension of the processed image for
+                 the processed image kept as it was before fitting
+        """
+        return f"{self.workbench_dir}/lossless/{os.path.relpath(processed_path, self.workbench_dir)}{ext}"
+
     def GeneratePreviewImage(self, family: Family):
         """
         Generate preview image
@@ -83,9 +536,7 @@ class Workbench:
         original_path, processed_path = self.GetPreviewImageIOPath()
         preview_image_ext = GetFileExt(processed_path)
 
-        self.ScaleAndCompress(original_path, processed_path, self.options["pre_scale"], 100)
-        family.ProcessImage(processed_path, processed_path)
-        self.ScaleAndCompress(processed_path, processed_path, self.options["scale"] / family.model_scale, self.options["quality"])        
+        self.ProcessImageFiles(family, [(original_path, processed_path)])
         # Copy original and processed preview image to output directory
         target_dir = f"{GetFileDir(self.options["output_path"])}"
         MakeDir(target_dir)
@@ -100,25 +551,266 @@ class Workbench:
         # Delete working directory
         self.CleanupWorkbench()
 
-    def ProcessOneImage(self, family: Family) -> bool:
+    def ReadStage(self, job: "ChunkJob") -> "ChunkJob":
         """
-        Process one image, returns whether there is another image to process
+        Claim the tasks of a chunk, serve cached images, and read (decode if needed) the others
         """
-        task = self.progress.GetOneTaskOfStatusAndUpdate("waiting", "processing")
-        if task is None: return False # No more images to process
-        original_path, processed_path = self.GetImageIOPath(task)
-
+        start = time.perf_counter()
+        job.total = self.progress.GetTaskNum()
+        # The job takes the next chunk, whichever job reaches the read stage first
+        with self.claim_lock:
+            chunk, job.family = self.chunks.popleft()
+            job.tasks = [self.progress.GetOneTaskOfStatusAndUpdate("waiting", "processing") for _ in chunk]
         self.WriteProgress()
-        # Pre-scale image
-        self.ScaleAndCompress(original_path, processed_path, self.options["pre_scale"], 100)
-        # Process image with super-resolution model
-        family.ProcessImage(processed_path, processed_path)
-        # Scale and compress image
-        self.ScaleAndCompress(processed_path, processed_path, self.options["scale"] / family.model_scale, self.options["quality"])
-
-        self.progress.Update(task, "done")
+
+        for task in job.tasks:
+            with Span("fetch", "image", task=task) as span:
+                self.FetchOriginalImage(task)
+                original_path, processed_path = self.GetImageIOPath(task)
+                route = self.GetRoute(task)
+                if span.enabled: span.Set(route=route, bytes_read=GetFileSize(original_path))
+                # Images processed with the same options before are copied from the result cache,
+                # in target mode the result depends on the target and the model variant instead of the scaling factor
+                if self.cache is not None and route == ROUTE_MODEL:
+                    cache_options = self.options
+                    if self.options.get("target") is not None:
+                        cache_options = {**self.options, "model": job.family.options["model"], "scale": self.options["target"]}
+                    job.cache_keys[processed_path] = self.cache.MakeKey(original_path, cache_options)
+                    # The size budget mode re-encodes lossy images from the lossless copy kept by the post-scale stage,
+                    # the cache has none, so they are processed again (and still cached)
+                    keep_lossless = self.options.get("size_budget") is not None and self.GetImageFormat(processed_path) in BUDGET_FORMATS
+                    if not keep_lossless and self.cache.Get(job.cache_keys[processed_path], processed_path):
+                        span.Set(cached=True)
+                        continue
+            job.io_paths.append((original_path, processed_path))
+            job.routes.append(route)
+            # Images routed around the model are scaled by the whole scaling factor after the model stage
+            job.scales.append(self.GetTaskScale(task) / (job.family.model_scale if route == ROUTE_MODEL else 1))
+        # Images routed around the model are always decoded, they are scaled in memory
+        job.sources = []
+        for (original_path, _), route in zip(job.io_paths, job.routes):
+            with Span("load", "image", image=original_path) as span:
+                source = self.LoadSource(original_path) if route == ROUTE_MODEL else LoadImage(original_path)
+                if span.enabled: span.Set(size=GetImageSize(source) if isinstance(source, str) else source.size)
+            job.sources.append(source)
+        self.EmitStage(job, "read", start)
+        return job
+
+    def PreScaleStage(self, job: "ChunkJob") -> "ChunkJob":
+        """
+        Pre-scale the decoded images of a chunk
+        """
+        start = time.perf_counter()
+        if self.cpu_pool is not None and self.options["pre_scale"] != 1.0:
+            # Only decoded images are pre-scaled, sources given as paths are kept
+            indices = [i for i, source in enumerate(job.sources) if not isinstance(source, str)]
+            scaled = self.cpu_pool.Map(self.Scale, [job.sources[i] for i in indices], [(self.options["pre_scale"],)] * len(indices))
+            for i, img in zip(indices, scaled): job.sources[i] = img
+        else:
+            job.sources = [self.PreScale(source) for source in job.sources]
+        self.EmitStage(job, "pre-scale", start)
+        return job
+
+    def ModelStage(self, job: "ChunkJob") -> "ChunkJob":
+        """
+        Process the images of a chunk with the super-resolution model
+        """
+        if len(job.sources) == 0: return job
+        start = time.perf_counter()
+        # Images routed around the model pass through
+        indices = [i for i, route in enumerate(job.routes) if route == ROUTE_MODEL]
+        job.outputs = list(job.sources)
+        if len(indices) > 0:
+            with Span("model chunk", "model", model=job.family.options["model"], images=len(indices)) as span:
+                outputs = self.ProcessModelSources(job.family, [job.sources[i] for i in indices], [job.scales[i] for i in indices])
+                if span.enabled: span.Set(sizes=[img.size for img, _ in outputs])
+            for i, (img, scale) in zip(indices, outputs): job.outputs[i], job.scales[i] = img, scale
+        job.sources = []
+        self.EmitStage(job, "model", start)
+        return job
+
+    def ProcessModelSources(self, family: Family, sources: list[Image.Image | str], scales: list[float]) -> list[tuple[Image.Image, float]]:
+        """
+        Process model sources with a family, oversized images are processed in tiles,
+        so that memory of the model output of one image is bounded whatever its size
+        Args:
+            family: Family to process images with
+            sources: List of model sources, see `LoadSource`
+            scales: List of post-scaling factors of the sources
+            return: List of (processed image, remaining post-scaling factor),
+                    tiled images are `TiledResult` already scaled by their post-scaling factor, see `CloseOutput`
+        """
+        results: list = [None] * len(sources)
+        stage_dir = f"{self.workbench_dir}/stage"
+        tile_pixels = self.options.get("tile_threshold", 0) * 1000000
+        indices = []
+        for i, source in enumerate(sources):
+            width, height = GetImageSize(source) if isinstance(source, str) else source.size
+            if tile_pixels > 0 and width * height > tile_pixels:
+                img = LoadImage(source) if isinstance(source, str) else source
+                ratio = family.model_scale * scales[i]
+                with Span("tiled", "model", size=(width, height)):
+                    results[i] = (ProcessTiled(img, lambda tiles: family.ProcessImageObjects(tiles, stage_dir), ratio, stage_dir), 1.0)
+            else:
+                indices.append(i)
+        if len(indices) > 0:
+            outputs = family.ProcessImageObjects([sources[i] for i in indices], stage_dir)
+            for i, img in zip(indices, outputs): results[i] = (img, scales[i])
+        return results
+
+    def PostScaleStage(self, job: "ChunkJob") -> "ChunkJob":
+        """
+        Scale and compress the processed images of a chunk into encoded bytes
+        """
+        start = time.perf_counter()
+        args_list = [
+            (scale, self.options["quality"], self.GetImageFormat(processed_path), self.options.get("encoder", DEFAULT_ENCODER_PROFILE))
+            for (_, processed_path), scale in zip(job.io_paths, job.scales)
+        ]
+        if self.options.get("size_budget") is not None:
+            # Lossy images are kept losslessly too, so that they can be encoded again to fit the size budget
+            args_list = [
+                (*args, self.GetLosslessPath(processed_path) if args[2] in BUDGET_FORMATS else None)
+                for args, (_, processed_path) in zip(args_list, job.io_paths)
+            ]
+            Encode = self.EncodeKeepingLossless
+        else:
+            Encode = self.Encode
+        if self.cpu_pool is not None:
+            # Tiled results stay in their memory-mapped file, they are encoded here instead of copied to the workers
+            indices = [i for i, img in enumerate(job.outputs) if not isinstance(img, TiledResult)]
+            encoded = self.cpu_pool.Map(Encode, [job.outputs[i] for i in indices], [args_list[i] for i in indices])
+            job.encoded = [None] * len(job.outputs)
+            for i, data in zip(indices, encoded): job.encoded[i] = data
+            for i, img in enumerate(job.outputs):
+                if isinstance(img, TiledResult): job.encoded[i] = Encode(img, *args_list[i])
+        elif self.encode_pool is not None and len(job.outputs) > 1:
+            # Pillow releases the GIL while resizing and encoding, so threads encode the images of a chunk in parallel,
+            # the largest ones are started first so that they do not finish last
+            order = sorted(range(len(job.outputs)), key=lambda i: job.outputs[i].width * job.outputs[i].height, reverse=True)
+            futures = {i: self.encode_pool.submit(Encode, job.outputs[i], *args_list[i]) for i in order}
+            job.encoded = [futures[i].result() for i in range(len(job.outputs))]
+        else:
+            job.encoded = [Encode(img, *args) for img, args in zip(job.outputs, args_list)]
+        for img in job.outputs: self.CloseOutput(img)
+        job.outputs = []
+        self.EmitStage(job, "post-scale", start)
+        return job
+
+    def WriteStage(self, job: "ChunkJob") -> "ChunkJob":
+        """
+        Write the encoded images of a chunk, then mark its tasks done
+        """
+        start = time.perf_counter()
+        for (_, processed_path), data in zip(job.io_paths, job.encoded):
+            with Span("write", "image", image=processed_path, bytes_written=len(data)), open(processed_path, "wb") as f:
+                f.write(data)
+            if processed_path in job.cache_keys: self.cache.Put(job.cache_keys[processed_path], processed_path)
+        job.encoded = []
+        self.EmitStage(job, "write", start)
+
+        for task in job.tasks:
+            self.ReleaseOriginalImage(task)
+            self.progress.Update(task, "done")
         self.WriteProgress()
-        return True
+        return job
+
+    def FailJob(self, job: "ChunkJob", error: BaseException):
+        """
+        Report the tasks of a failed chunk
+        """
+        for task in job.tasks:
+            self.Emit(TaskFailed(task, error, self.progress.GetTaskNumOfStatus("done"), job.total))
+
+    def EmitStage(self, job: "ChunkJob", stage: str, start: float):
+        """
+        Emit the event of a finished stage of a chunk, and record the stage in the trace if tracing
+        """
+        end = time.perf_counter()
+        AddSpan(stage, "stage", start, end, book=self.file_name, tasks=len(job.tasks), images=len(job.io_paths))
+        self.Emit(StageFinished(job.tasks, stage, end - start, self.progress.GetTaskNumOfStatus("done"), job.total))
+
+    def LoadSource(self, original_path: str) -> Image.Image | str:
+        """
+        Get the model source of an original image, it is decoded only if pre-scaling needs it,
+        otherwise the model gets the original file
+        """
+        if self.options["pre_scale"] == 1.0: return original_path
+        return LoadImage(original_path)
+
+    def PreScale(self, source: Image.Image | str) -> Image.Image | str:
+        """
+        Pre-scale a model source
+        """
+        if isinstance(source, str) or self.options["pre_scale"] == 1.0: return source
+        with Span("pre-scale", "image", size=source.size):
+            return self.Scale(source, self.options["pre_scale"])
+
+    def ProcessImageFiles(self, family: Family, io_paths: list[tuple[str, str]]):
+        """
+        Pre-scale, process and post-scale images one stage after another, decoded images are passed
+        between stages in memory. Used for single images, while books go through the stage pipeline
+        Args:
+            family: Family to process images with
+            io_paths: List of (original image path, processed image path)
+        """
+        if self.options.get("target") is not None:
+            # Each image runs the variant of the model for its own scaling factor
+            for original_path, processed_path in io_paths:
+                with Image.open(original_path) as img:
+                    fits_target = self.GetTargetRatio(img.size) <= 1.0
+                if fits_target: CopyFile(original_path, processed_path)
+                else: self.ProcessImageFilesAtScale(family, [(original_path, processed_path)])
+            return
+        self.ProcessImageFilesAtScale(family, io_paths)
+
+    def ProcessImageFilesAtScale(self, family: Family, io_paths: list[tuple[str, str]]):
+        """
+        Process images of the same scaling factor one stage after another, see `ProcessImageFiles`
+        """
+        scale = self.GetScaleOfSize(GetImageSize(io_paths[0][0]))
+        family = family.GetScaleVariant(scale) if self.options.get("target") is not None else family
+        sources = [self.PreScale(self.LoadSource(original_path)) for original_path, _ in io_paths]
+        outputs = self.ProcessModelSources(family, sources, [scale / family.model_scale] * len(sources))
+        for (_, processed_path), (img, post_scale) in zip(io_paths, outputs):
+            self.ScaleAndCompress(img, processed_path, post_scale, self.options["quality"],
+                                  profile=self.options.get("encoder", DEFAULT_ENCODER_PROFILE))
+            self.CloseOutput(img)
+
+    @classmethod
+    def CloseOutput(cls, img: Image.Image | TiledResult):
+        """
+        Release a processed image after it is encoded, the file of a tiled result is deleted
+        """
+        if isinstance(img, TiledResult): img.Close()
+
+    @abc.abstractmethod
+    def ExtractSampleImages(self, image_exts: list[str], sample_num: int, output_dir: str) -> list[str]:
+        """
+        Extract a few images representative of the source file for benchmarking, see `SampleBySize`
+        Args:
+            image_exts: List of image file extensions to be processed, e.g. ['.jpg', '.png']
+            sample_num: Number of images to extract
+            output_dir: Directory where the images are extracted
+            return: Paths of the extracted images
+        """
+        pass
+
+    @classmethod
+    def SampleBySize(cls, images: list, sizes: list[tuple[int, int]], sample_num: int) -> list:
+        """
+        Pick images spread evenly over the distribution of pixel counts, so that small ornaments
+        and full-page illustrations are sampled in proportion to how common they are
+        Args:
+            images: List of images
+            sizes: Size (width, height) of each image
+            sample_num: Number of images to pick
+            return: Picked images in their original order
+        """
+        order = sorted(range(len(images)), key=lambda i: sizes[i][0] * sizes[i][1])
+        sample_num = min(sample_num, len(images))
+        picked = sorted({order[(2 * k + 1) * len(order) // (2 * sample_num)] for k in range(sample_num)})
+        return [images[i] for i in picked]
 
     @abc.abstractmethod
     def GetPreviewImageIOPath(self) -> tuple[str, str]:
@@ -136,9 +828,29 @@ class Workbench:
 
     def ReadProgress(self):
         self.progress.Load(f"{self.workbench_dir}/progress.json")
+        # Workbenches made by older versions have no duplicates record
+        if FileExist(f"{self.workbench_dir}/duplicates.json"):
+            with open(f"{self.workbench_dir}/duplicates.json", "r") as f:
+                self.duplicates = json.load(f)
+        # Triage decisions are reused, workbenches without a record process all images with the model
+        self.ReadTriage()
+
+    def ReadTriage(self):
+        self.triage = {}
+        if FileExist(f"{self.workbench_dir}/triage.json"):
+            with open(f"{self.workbench_dir}/triage.json", "r") as f:
+                self.triage = json.load(f)
 
     def WriteProgress(self):
-        self.progress.Dump(f"{self.workbench_dir}/progress.json")
+        self.progress.Save(f"{self.workbench_dir}/progress.json")
+
+    def WriteDuplicates(self):
+        with open(f"{self.workbench_dir}/duplicates.json", "w") as f:
+            json.dump(self.duplicates, f, indent=4)
+
+    def WriteTriage(self):
+        with open(f"{self.workbench_dir}/triage.json", "w") as f:
+            json.dump(self.triage, f, indent=4)
 
     def GetProgressStatistics(self):
         """
@@ -149,31 +861,90 @@ class Workbench:
         return (done_count, total_count)
 
     @classmethod
-    def ScaleAndCompress(cls, input_file: str, output_file: str, scale_ratio: float, quality_level: int):
+    def Scale(cls, img: Image.Image, scale_ratio: float) -> Image.Image:
+        """
+        Scale image with high-quality LANCZOS resampling
+        Args:
+            img: Image
+            scale_ratio: Scale ratio
+        """
+        if scale_ratio == 1.0: return img
+        # Calculate new dimensions
+        new_width = int(img.width * scale_ratio)
+        new_height = int(img.height * scale_ratio)
+        return img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+
+    @classmethod
+    def GetImageFormat(cls, image_path: str) -> str | None:
+        """
+        Get the Pillow format name of an image file from its extension, e.g. "JPEG"
+        """
+        return Image.registered_extensions().get(GetFileExt(image_path).lower())
+
+    @classmethod
+    def Encode(cls, img: Image.Image, scale_ratio: float, quality_level: int, format: str,
+               profile: str = DEFAULT_ENCODER_PROFILE) -> bytes:
+        """
+        Scale and compress image into encoded bytes
+        Args:
+            img: Image
+            scale_ratio: Scale ratio
+            quality_level: Quality level (0-100), higher value means less compression
+            format: Pillow format name
+            profile: Encoder profile name, see Encoder.py
+        """
+        buffer = io.BytesIO()
+        cls.ScaleAndCompress(img, buffer, scale_ratio, quality_level, format, profile)
+        return buffer.getvalue()
+
+    @classmethod
+    def EncodeKeepingLossless(cls, img: Image.Image, scale_ratio: float, quality_level: int, format: str, profile: str,
+                              lossless_path: str | None) -> bytes:
+        """
+        Scale and compress image into encoded bytes like `Encode`, and save the scaled image losslessly
+        Args:
+            lossless_path: PNG file path of the lossless copy, None to keep no copy
+        """
+        img = cls.Scale(img, scale_ratio)
+        if lossless_path is not None:
+            MakeDir(GetFileDir(lossless_path))
+            with Span("keep lossless", "image", size=img.size):
+                img.save(lossless_path, "PNG", compress_level=1)
+        return cls.Encode(img, 1.0, quality_level, format, profile)
+
+    @classmethod
+    def ScaleAndCompress(cls, img: Image.Image, output_file, scale_ratio: float, quality_level: int, format: str = None,
+                         profile: str = DEFAULT_ENCODER_PROFILE):
         """
         Scale and compress image
         Args:
-            input_file: Input image file path
-            output_file: Output image file path
+            img: Image
+            output_file: Output image file path or binary file object
             scale_ratio: Scale ratio
             quality_level: Quality level (0-100), higher value means less compression
+            format: Pillow format name, default is decided by the extension of the output file path
+            profile: Encoder profile name, see Encoder.py
         """
-        if scale_ratio == 1.0 and quality_level == 100:
-            CopyFile(input_file, output_file)
-            return
+        with Span("downscale", "image", size=img.size, ratio=scale_ratio):
+            img = cls.Scale(img, scale_ratio)
+        if format is None: format = cls.GetImageFormat(output_file)
+        with Span("encode", "image", size=img.size, format=format, profile=profile):
+            if format == "JPEG" and img.mode not in ("RGB", "L", "CMYK"): img = img.convert("RGB")
+            img.save(output_file, format, **GetEncoderArgs(format, quality_level, profile))
+
 
-        # Open image
-        img = Image.open(input_file)
-        
-        if scale_ratio != 1.0:
-            # Calculate new dimensions
-            new_width = int(img.width * scale_ratio)
-            new_height = int(img.height * scale_ratio)
-            # Scale image (using high-quality LANCZOS resampling)
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        
-        match img.format:
-            case "JPEG": img.save(output_file, quality=quality_level, optimize=True)
-            case "PNG": img.save(output_file, compress_level=7, optimize=True)
-            case _: img.save(output_file, quality=quality_level, optimize=True)
+class ChunkJob:
+    """A chunk of tasks passing through the stages of the workbench pipeline"""
 
+    def __init__(self, workbench: Workbench, tasks: list[str], family: Family):
+        self.workbench = workbench # Workbench of the book the tasks belong to
+        self.tasks = tasks # Tasks of the chunk, claimed by the read stage
+        self.family = family # Family processing the model route, a variant of the model in target mode, set with the tasks
+        self.total = 0 # Number of all tasks
+        self.io_paths: list[tuple[str, str]] = [] # (original, processed) paths of images not served by the cache
+        self.routes: list[str] = [] # Triage route of each image in io_paths
+        self.scales: list[float] = [] # Post-scaling factor of each image in io_paths
+        self.cache_keys: dict[str, str] = {} # processed image path -> cache key
+        self.sources: list[Image.Image | str] = [] # Model sources, see Workbench.LoadSource
+        self.outputs: list[Image.Image] = [] # Model outputs
+        self.encoded: list[bytes] = [] # Encoded processed images
@@ -1,30 +1,73 @@
 import sys
 import re
+import multiprocessing
 from Option import ParseOptions
 from Error import *
 from Family import *
 import FamilyList
 import WorkbenchList
 from UserInterface import CmdUserInterface
+from Trace import Span, StartTrace, StopTrace
+from Batch import BatchBook
 
 
 def Work(ui, options: dict):
-    # preview a image
-    if options["preview"]:
-        ui.InitWorkbench()
-        ui.GeneratePreviewImage()
-    # process images
-    else:
-        if options["restart"]:
-            ui.Print("[bold blue][Info][/bold blue] Restart progress", end="\n\n")
-            ui.InitWorkbench()
-        elif not ui.workbench.WorkbenchInitialized():
-            ui.Print("[bold blue][Info][/bold blue] Checkpoint not found, start progress from scratch", end="\n\n")
-            ui.InitWorkbench()
+    if options.get("trace") is not None: StartTrace()
+    try:
+        # preview a image
+        if options["preview"]:
+            with Span("InitPreview", "phase"): ui.InitPreview()
+            with Span("GeneratePreviewImage", "phase"): ui.GeneratePreviewImage()
+        # process images
         else:
-            ui.Print("[bold blue][Info][/bold blue] Checkpoint found, continue progress from last time (if you want to restart, use -r option)", end="\n\n")
-        ui.ProcessAllImage()
-        ui.GenerateTarget()
+            if options["restart"]:
+                ui.Print("[bold blue][Info][/bold blue] Restart progress", end="\n\n")
+                with Span("InitWorkbench", "phase"): ui.InitWorkbench()
+            elif not ui.workbench.WorkbenchInitialized():
+                ui.Print("[bold blue][Info][/bold blue] Checkpoint not found, start progress from scratch", end="\n\n")
+                with Span("InitWorkbench", "phase"): ui.InitWorkbench()
+            else:
+                ui.Print("[bold blue][Info][/bold blue] Checkpoint found, continue progress from last time (if you want to restart, use -r option)", end="\n\n")
+            ui.ReportTriage()
+            with Span("ProcessAllImage", "phase"): ui.ProcessAllImage()
+            if options.get("size_budget") is not None:
+                with Span("FitSizeBudget", "phase"): ui.FitSizeBudget()
+            with Span("GenerateTarget", "phase"): ui.GenerateTarget()
+    finally:
+        # The trace of a failed run is saved too, it shows where the run stopped
+        tracer = StopTrace()
+        if tracer is not None:
+            tracer.Save(options["trace"])
+            ui.ReportTrace(tracer, options["trace"])
+
+def WorkBatch(ui, options: dict, books: list[BatchBook]):
+    # All books of the batch are recorded in one trace
+    if options.get("trace") is not None: StartTrace()
+    try:
+        with Span("ProcessBatch", "phase", books=len(books)): ui.ProcessBatch(books, options)
+    finally:
+        tracer = StopTrace()
+        if tracer is not None:
+            tracer.Save(options["trace"])
+            ui.ReportTrace(tracer, options["trace"])
+
+def GetBenchmarkOptions(options: dict) -> list[dict]:
+    # Each family runs the listed models it has, or its default model if it has none of them
+    families = options["family"].split(",")
+    models = options["model"].split(",") if options["model"] else []
+    options_list = []
+    for family_name in families:
+        FamilyType = FamilyList.GetFamilyClass(family_name)
+        all_models = FamilyType.GetAllModels()
+        for model in [model for model in models if model in all_models] or [None]:
+            family_options = {**options, "family": family_name, "model": model}
+            FamilyType(family_options).CheckOptions() # Fill in the default model and scale, throw if invalid
+            options_list.append(family_options)
+    benchmarked_models = {family_options["model"] for family_options in options_list}
+    for model in models:
+        if model not in benchmarked_models:
+            raise ModelNotFoundError(f"'{model}' is not an available model of families {families}.")
+    return options_list
 
 def GetOutputPath(input_path: str, output_format: str):
     # replace "?" with input filename without extension
@@ -36,6 +79,8 @@ def GetOutputPath(input_path: str, output_format: str):
 def CmdMain(args: list[str] = sys.argv[1:]):
     # Create rich console object
     ui = CmdUserInterface()
+    workbench = None # Workbench of the file being processed, None before any file is processed
+    books: list[BatchBook] = [] # Books of a batch sharing one pipeline
     
     try:
         options = ParseOptions(args)
@@ -56,6 +101,25 @@ def CmdMain(args: list[str] = sys.argv[1:]):
                     ui.Print(f"  - [green]{model}[/green] [bold yellow](default)[/bold yellow]")
                 else:
                     ui.Print(f"  - [green]{model}[/green]")
+        # Calibrate tile size and threads of specified family and model
+        elif options["calibrate"]:
+            FamilyType = FamilyList.GetFamilyClass(options["family"])
+            if not FamilyType.tunable:
+                raise FamilyNotTunableError(f"Family '{options['family']}' does not support calibration.")
+            ui.Bound(FamilyType(options), None)
+            ui.Calibrate()
+        # Compare families and models on sample images of a file
+        elif options["benchmark"]:
+            options_list = GetBenchmarkOptions(options)
+            output_dir = options["output_path"]
+            if output_dir is None:
+                output_dir = f"{GetFileDir(options["input_path"])}/{GetFileNameWithoutExt(options["input_path"])} {APP_NAME} benchmark"
+            # Only exts every family supports are sampled, the workbench is used to read the file only
+            image_exts = set.intersection(*(set(FamilyList.GetFamilyClass(o["family"]).supported_image_exts) for o in options_list))
+            WorkbenchType = WorkbenchList.GetWorkbenchClass(options["input_path"])
+            workbench = WorkbenchType({**options, "preview": True, "output_path": f"{output_dir}/results.json"})
+            ui.Bound(None, workbench)
+            ui.Benchmark(options_list, sorted(image_exts), options["samples"], output_dir)
         # Process
         else:
             # get Family class from family name
@@ -89,30 +153,43 @@ def CmdMain(args: list[str] = sys.argv[1:]):
                 io_paths = {input_format: GetOutputPath(input_format, output_format)}
 
             records = {input_path: False for input_path in input_paths}
-            for i, input_path in enumerate(input_paths):
-                try:
-                    ui.Print(f"[bold magenta]Processing file:[/bold magenta] [magenta]'{input_path}'[/magenta] [yellow]({i+1}/{len(input_paths)})[/yellow]")
+            # Books of a batch share one pipeline, see Batch.py, previews are generated one file after another
+            if options["batch"] and not options["preview"]:
+                for input_path in input_paths:
                     options_i = options.copy()
                     options_i["input_path"] = input_path
                     options_i["output_path"] = io_paths[input_path]
-
                     WorkbenchType = WorkbenchList.GetWorkbenchClass(options_i["input_path"])
-                    family = FamilyType(options_i)
-                    workbench = WorkbenchType(options_i)
-                    ui.Bound(family, workbench)
-
-                    Work(ui, options_i)
-                    records[input_path] = True
-
-                # Runtime errors (after workbench initialization)
-                except FileCorruptedError as e:
-                    workbench.CleanupWorkbench() # Clean up workbench
-                    ui.Print(f"[bold red]Runtime error:[/bold red] {e}")
-                    # exit_code = 51
-                except ModelRuntimeError as e:
-                    workbench.CleanupWorkbench() # Clean up workbench
-                    ui.Print(f"[bold red]Runtime error:[/bold red] {e}")
-                    # exit_code = 52
+                    books.append(BatchBook(FamilyType(options_i), WorkbenchType(options_i)))
+                WorkBatch(ui, options, books)
+                for book in books: records[book.workbench.options["input_path"]] = book.status == "done"
+            else:
+                for i, input_path in enumerate(input_paths):
+                    try:
+                        ui.Print(f"[bold magenta]Processing file:[/bold magenta] [magenta]'{input_path}'[/magenta] [yellow]({i+1}/{len(input_paths)})[/yellow]")
+                        options_i = options.copy()
+                        options_i["input_path"] = input_path
+                        options_i["output_path"] = io_paths[input_path]
+                        if options["batch"] and options["trace"] is not None:
+                            options_i["trace"] = GetOutputPath(input_path, options["trace"])
+
+                        WorkbenchType = WorkbenchList.GetWorkbenchClass(options_i["input_path"])
+                        family = FamilyType(options_i)
+                        workbench = WorkbenchType(options_i)
+                        ui.Bound(family, workbench)
+
+                        Work(ui, options_i)
+                        records[input_path] = True
+
+                    # Runtime errors (after workbench initialization)
+                    except FileCorruptedError as e:
+                        workbench.CleanupWorkbench() # Clean up workbench
+                        ui.Print(f"[bold red]Runtime error:[/bold red] {e}")
+                        # exit_code = 51
+                    except ModelRuntimeError as e:
+                        workbench.CleanupWorkbench() # Clean up workbench
+                        ui.Print(f"[bold red]Runtime error:[/bold red] {e}")
+                        # exit_code = 52
 
             if options["batch"]:
                 ui.Print("[bold magenta]All matched files processed.[/bold magenta]")
@@ -157,6 +234,33 @@ def CmdMain(args: list[str] = sys.argv[1:]):
     except JobsValueInvalidError as e:
         ui.Print(f"[bold red]Options error:[/bold red] {e}")
         exit_code = 19
+    except ChunkValueInvalidError as e:
+        ui.Print(f"[bold red]Options error:[/bold red] {e}")
+        exit_code = 20
+    except FamilyNotTunableError as e:
+        ui.Print(f"[bold red]Options error:[/bold red] {e}")
+        exit_code = 21
+    except CacheSizeValueInvalidError as e:
+        ui.Print(f"[bold red]Options error:[/bold red] {e}")
+        exit_code = 22
+    except TriageRulesInvalidError as e:
+        ui.Print(f"[bold red]Options error:[/bold red] {e}")
+        exit_code = 23
+    except TargetValueInvalidError as e:
+        ui.Print(f"[bold red]Options error:[/bold red] {e}")
+        exit_code = 24
+    except TileThresholdValueInvalidError as e:
+        ui.Print(f"[bold red]Options error:[/bold red] {e}")
+        exit_code = 25
+    except StreamWindowValueInvalidError as e:
+        ui.Print(f"[bold red]Options error:[/bold red] {e}")
+        exit_code = 26
+    except SamplesValueInvalidError as e:
+        ui.Print(f"[bold red]Options error:[/bold red] {e}")
+        exit_code = 27
+    except SizeBudgetValueInvalidError as e:
+        ui.Print(f"[bold red]Options error:[/bold red] {e}")
+        exit_code = 28
 
     # # Runtime errors (after workbench initialization)
     # except FileCorruptedError as e:
@@ -173,8 +277,12 @@ def CmdMain(args: list[str] = sys.argv[1:]):
         ui.Print("\n[bold red]Process interrupted by user.[/bold red]")
         exit_code = 2
     except Exception as e:
-        if workbench.progress.GetTaskNumOfStatus("done") == 0:
+        if workbench is not None and workbench.progress.GetTaskNumOfStatus("done") == 0:
             workbench.CleanupWorkbench() # Clean up workbench
+        # Books of a batch are cleaned up like a single workbench, books not started keep their checkpoints
+        for book in books:
+            if book.status in ("preparing", "processing", "packing") and book.workbench.progress.GetTaskNumOfStatus("done") == 0:
+                book.workbench.CleanupWorkbench()
         ui.Print(f"[bold red]Error:[/bold red] {e}")
         exit_code = 1
     
@@ -221,4 +329,5 @@ if __name__ == "__main__":
     # ]
     # CmdMain(args)
 
+    multiprocessing.freeze_support() # Worker processes of the packed executable start here
     CmdMain()
@@ -50,6 +50,165 @@ def PackZip(src_folder: str, zip_path: str):
                 # Add to ZIP file
                 zip_ref.write(file_path, os.path.relpath(file_path, src_folder))
 
+ZIP_MEDIA_EXTS = [".jpg", ".jpeg", ".png", ".webp", ".gif", ".mp3", ".mp4", ".m4a", ".woff", ".woff2"] # Already compressed formats, stored without compression
+
+def RepackZip(src_zip_path: str, replaced: dict[str, str], zip_path: str, jobs: int = None):
+    """
+    Make a new ZIP file from a source ZIP file, with some entries replaced by files.
+    Entries keep their order. Unchanged compressed entries are copied as raw compressed bytes,
+    media files are stored without compression, the other entries are deflated in parallel
+    Args:
+        src_zip_path: Path of the source ZIP file
+        replaced: dict{entry name: path of the file to replace the entry}
+        zip_path: Path of the new ZIP file
+        jobs: Number of parallel compression jobs, default is the number of CPUs
+    """
+    import zipfile
+    import concurrent.futures
+
+    def NeedDeflate(info: zipfile.ZipInfo) -> bool:
+        if GetFileExt(info.filename).lower() in ZIP_MEDIA_EXTS: return False
+        if info.filename == "mimetype": return False # must be stored, as required by EPUB
+        return info.filename in replaced or info.compress_type == zipfile.ZIP_STORED
+
+    def ReadEntry(info: zipfile.ZipInfo) -> bytes:
+        return ReadFileBytes(replaced[info.filename]) if info.filename in replaced else src_zip.read(info)
+
+    def Deflate(info: zipfile.ZipInfo) -> tuple[bytes, int, int]:
+        data = ReadEntry(info)
+        return ZipDeflate(data), zipfile.crc32(data), len(data)
+
+    jobs = jobs if jobs is not None else os.cpu_count() or 1
+    window = 2 * jobs # Number of entries deflated ahead of writing, bounding the memory of deflated data
+    with zipfile.ZipFile(src_zip_path, 'r') as src_zip, \
+         open(src_zip_path, 'rb') as src_file, \
+         zipfile.ZipFile(zip_path, 'w') as zip_ref, \
+         concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        infos = src_zip.infolist()
+        if not ZipCanWriteRaw(zip_ref):
+            # Raw writing relies on ZipFile internals, without them every entry is written through the public API
+            for info in infos:
+                compress_type = zipfile.ZIP_DEFLATED if NeedDeflate(info) else \
+                                zipfile.ZIP_STORED if info.filename in replaced else info.compress_type
+                zip_ref.writestr(ZipCopyInfo(info, compress_type), ReadEntry(info))
+            return
+        # zlib releases the GIL, so entries are deflated in parallel ahead of writing, in order
+        to_deflate = iter([info for info in infos if NeedDeflate(info)])
+        deflated: dict[int, concurrent.futures.Future] = {} # id(info) -> future of Deflate
+        for info in infos:
+            while len(deflated) < window:
+                next_info = next(to_deflate, None)
+                if next_info is None: break
+                deflated[id(next_info)] = executor.submit(Deflate, next_info)
+            if id(info) in deflated:
+                data, crc, file_size = deflated.pop(id(info)).result()
+                ZipWriteRaw(zip_ref, info, data, zipfile.ZIP_DEFLATED, crc, file_size)
+            elif info.filename in replaced:
+                data = ReadFileBytes(replaced[info.filename])
+                ZipWriteRaw(zip_ref, info, data, zipfile.ZIP_STORED, zipfile.crc32(data), len(data))
+            else:
+                data = ZipReadRaw(src_file, info)
+                ZipWriteRaw(zip_ref, info, data, info.compress_type, info.CRC, info.file_size)
+
+def IsSafeArchivePath(name: str) -> bool:
+    """
+    Check if a path of an archive entry stays inside the directory it is extracted to
+    Args:
+        name: Entry name in the archive
+        return: False if the name is absolute, has a drive or has a '..' component
+    """
+    parts = name.replace("\\", "/").split("/")
+    if name.startswith(("/", "\\")) or ":" in parts[0]: return False
+    return ".." not in parts
+
+def ZipReadRaw(src_file, info) -> bytes:
+    """
+    Read the raw (still compressed) data of an entry in a ZIP file
+    Args:
+        src_file: Binary file object of the ZIP file
+        info: ZipInfo of the entry
+        return: Raw data of the entry
+    """
+    import struct
+    import zipfile
+    src_file.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, src_file.read(zipfile.sizeFileHeader))
+    # skip file name and extra field of the local header, their lengths are the last two header fields
+    src_file.seek(header[10] + header[11], os.SEEK_CUR)
+    return src_file.read(info.compress_size)
+
+def ZipCopyInfo(src_info, compress_type: int):
+    """
+    Make a ZipInfo for a new entry with the name, date and attributes of a source entry
+    Args:
+        src_info: ZipInfo of the source entry
+        compress_type: Compression method of the new entry
+    """
+    import zipfile
+    info = zipfile.ZipInfo(src_info.filename, src_info.date_time)
+    info.create_system = src_info.create_system
+    info.external_attr = src_info.external_attr
+    info.compress_type = compress_type
+    return info
+
+ZIP_RAW_WRITE_ATTRS = ("fp", "filelist", "NameToInfo", "start_dir") # ZipFile internals used by ZipWriteRaw
+
+def ZipCanWriteRaw(zip_ref) -> bool:
+    """
+    Check if `ZipWriteRaw` can append entries to a ZIP file, it relies on internals of zipfile.ZipFile
+    that are not part of its API, so it is only used when they are the ones it was written against
+    Args:
+        zip_ref: ZipFile opened in 'w' mode
+    """
+    import zipfile
+    if not all(hasattr(zip_ref, attr) for attr in ZIP_RAW_WRITE_ATTRS): return False
+    if not hasattr(zipfile.ZipInfo, "FileHeader"): return False
+    return isinstance(zip_ref.filelist, list) and isinstance(zip_ref.NameToInfo, dict) \
+        and zip_ref.start_dir == zip_ref.fp.tell()
+
+def ZipWriteRaw(zip_ref, src_info, data: bytes, compress_type: int, crc: int, file_size: int):
+    """
+    Append an entry with raw (already compressed) data to a ZIP file opened for writing,
+    the central directory is written by the ZipFile when it is closed.
+    Check `ZipCanWriteRaw` first, this is the only function touching ZipFile internals
+    Args:
+        zip_ref: ZipFile opened in 'w' mode
+        src_info: ZipInfo of the source entry, name, date and attributes are kept
+        data: Raw data of the entry
+        compress_type: Compression method of `data`
+        crc: CRC-32 of the uncompressed data
+        file_size: Size of the uncompressed data
+    """
+    info = ZipCopyInfo(src_info, compress_type)
+    info.flag_bits = src_info.flag_bits & 0x0801 # keep only encryption and UTF-8 flags, sizes are in the local header
+    info.CRC = crc
+    info.compress_size = len(data)
+    info.file_size = file_size
+    info.header_offset = zip_ref.fp.tell()
+    zip_ref.fp.write(info.FileHeader())
+    zip_ref.fp.write(data)
+    zip_ref.filelist.append(info)
+    zip_ref.NameToInfo[info.filename] = info
+    zip_ref.start_dir = zip_ref.fp.tell()
+
+def ZipDeflate(data: bytes) -> bytes:
+    """
+    Compress data as a raw deflate stream, the format of ZIP_DEFLATED entries
+    """
+    import zlib
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+def ReadFileBytes(file_path: str) -> bytes:
+    """
+    Read all bytes of a file
+    Args:
+        file_path: File path
+        return: File content
+    """
+    with open(file_path, 'rb') as f:
+        return f.read()
+
 def GetDirList(dir_path: str, type = "both") -> list[str]:
     """
     List all files and subdirectories in a directory
@@ -125,6 +284,15 @@ def GetFileExt(file_path: str) -> str:
     """
     return os.path.splitext(file_path)[1]
 
+def GetFileSize(file_path: str) -> int:
+    """
+    Get file size
+    Args:
+        file_path: File path
+        return: File size in bytes
+    """
+    return os.path.getsize(file_path)
+
 def GetFileDir(file_path: str) -> str:
     """
     Get directory containing the file
@@ -153,6 +321,18 @@ def CopyFile(src_path: str, dst_path: str):
         with open(dst_path, 'wb') as dest_file:
             dest_file.write(src_file.read())
 
+def LinkOrCopyFile(src_path: str, dst_path: str):
+    """
+    Make a hard link of a file, or copy it if hard link is not possible
+    Args:
+        src_path: Source file path
+        dst_path: Destination file path
+    """
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        CopyFile(src_path, dst_path)
+
 def CopyDir(src_path: str, dst_path: str):
     """
     Copy a directory
@@ -231,6 +411,20 @@ def MoveFile(src_path: str, dst_path: str, exist_ok: bool = False):
             raise FileExistsError(f"Destination file or directory '{dst_path}' already exists.")
         os.rename(src_path, dst_path)
 
+def HashFile(file_path: str) -> str:
+    """
+    Get the SHA-256 hash of a file's content
+    Args:
+        file_path: File path
+        return: Hex digest of the hash
+    """
+    import hashlib
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
 def SearchFiles(dir_path: str, exts: list[str], relative: bool = False) -> list[str]:
     """
     Search for files with specified extensions in a directory
@@ -283,90 +477,233 @@ def SearchFilesRegex(dir_path: str, regex: str, relative: bool = False) -> list[
 ##                 Functions for PDF Operations                 ##
 ##################################################################
 
-def PdfExtractImages(pdf_path: str, output_dir: str, jpg_quality: int = 95):
+PDF_RAW_IMAGE_EXTS = ["png", "jpeg"] # Extensions of extracted images written as raw bytes, others are converted to PNG
+
+def PdfExtractImages(pdf_path: str, output_dir: str, jobs: int = 0, page_range: range | None = None, xrefs: list[int] | None = None):
     """
-    Extract images from PDF file and save them to specified directory
+    Extract images from PDF file and save them to specified directory,
+    each image is named by its xref, and an image shared by several pages is extracted only once
     
     Args:
         pdf_path: PDF file path
         output_dir: Output directory path
+        jobs: Number of worker processes, the pages are split into one consecutive range per worker,
+              each worker opens its own document once and extracts the images of its pages, 0 to extract in this process
+        page_range: range of page numbers to extract images of, default is all pages
+        xrefs: xrefs of images to extract, default is all images of the pages
     """
-    from pymupdf import Document as PdfDoc
-    from pymupdf import Page as PdfPage
-    from pymupdf import Pixmap as PdfPixmap
-
     # make sure the output directory exists
     os.makedirs(output_dir, exist_ok=True)
-    # open the PDF file
+
+    page_num = PdfGetPageNum(pdf_path)
+    page_range = range(page_num) if page_range is None else range(page_range.start, min(page_range.stop, page_num))
+    if jobs <= 0 or len(page_range) <= 1:
+        PdfExtractPages(pdf_path, output_dir, page_range, page_range.start, xrefs)
+        return
+    # An image shared by pages of several ranges is extracted by the worker of the first page it is on
+    import concurrent.futures
+    import multiprocessing
+    part_num = min(len(page_range), jobs)
+    parts = [page_range[len(page_range) * i // part_num : len(page_range) * (i + 1) // part_num] for i in range(part_num)]
+    # Spawned like the workers of CpuPool, threads of other books may be running
+    with concurrent.futures.ProcessPoolExecutor(max_workers=part_num, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(PdfExtractPages, pdf_path, output_dir, part, page_range.start, xrefs) for part in parts]
+        for future in futures: future.result()
+
+def PdfExtractPages(pdf_path: str, output_dir: str, page_range: range, first_page: int, xrefs: list[int] | None = None) -> list[str]:
+    """
+    Extract the images of a range of pages from PDF file, see `PdfExtractImages`,
+    images already on pages from `first_page` to the start of the range are left to the worker of those pages
+
+    Args:
+        pdf_path: PDF file path
+        output_dir: Output directory path
+        page_range: range of page numbers to extract images of
+        first_page: first page number of all the ranges being extracted
+        xrefs: xrefs of images to extract, default is all images of the pages
+        return: paths of the extracted images
+    """
+    from pymupdf import Document as PdfDoc
+
+    with PdfDoc(pdf_path) as doc:
+        seen = set(img_info[0] for page_num in range(first_page, page_range.start) for img_info in doc.get_page_images(page_num))
+        wanted = None if xrefs is None else set(xrefs)
+        page_xrefs = dict.fromkeys(img_info[0] for page_num in page_range for img_info in doc.get_page_images(page_num))
+        return PdfSaveImages(doc, output_dir, [xref for xref in page_xrefs if xref not in seen and (wanted is None or xref in wanted)])
+
+def PdfListImages(pdf_path: str, page_range: range | None = None) -> list[int]:
+    """
+    Get the unique xrefs of images in PDF file in page order,
+    image lists are read without loading pages or decoding images
+
+    Args:
+        pdf_path: PDF file path
+        page_range: range of page numbers to look at, default is all pages
+    """
+    from pymupdf import Document as PdfDoc
+
     doc = PdfDoc(pdf_path)
-    
-    # traverse each page
-    for page in doc:
-        # get image list
-        image_list = page.get_images(full=True)
-        
-        # traverse each image in the page
-        for img_info in image_list:
-            # get image xref
-            xref = img_info[0]
-            
-            # extract image bytes and smask
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-            image_smask = base_image["smask"]
-            image_ext = base_image["ext"]
-            # print(f"xref={xref}, ext={image_ext}, smask={image_smask}")
-
-            # without mask, save directly
-            if image_smask == 0:
-                image_path = f"{output_dir}/{xref}.{image_ext}"
-                pix = PdfPixmap(image_bytes)
-                pix.save(image_path, jpg_quality=jpg_quality)
-            # with mask, save with alpha channel
-            else:
-                image_path = f"{output_dir}/{xref}.png"
-                pix = PdfPixmap(image_bytes)
-                mask = PdfPixmap(doc.extract_image(image_smask)["image"])
-                pix_a = PdfPixmap(pix, mask)
-                pix_a.save(image_path)
-    
+    if page_range is None: page_range = range(len(doc))
+    xrefs = list(dict.fromkeys(img_info[0] for page_num in page_range for img_info in doc.get_page_images(page_num)))
     doc.close()
+    return xrefs
 
-def PdfReplaceOneImage(page, xref: int, filename=None, pixmap=None, stream=None):
+def PdfGetImageSizes(pdf_path: str, xrefs: list[int]) -> list[tuple[int, int]]:
     """
-    Replace the image referred to by xref.
+    Get the size (width, height) of images in PDF file from their dictionaries, no image is decoded
 
     Args:
-        xref: the xref of the image to replace.
-        filename, pixmap, stream: exactly one of these must be provided. The
-            meaning being the same as in Page.insert_image.
+        pdf_path: PDF file path
+        xrefs: xrefs of images
+    """
+    from pymupdf import Document as PdfDoc
+
+    def GetInt(doc, xref: int, key: str) -> int:
+        value_type, value = doc.xref_get_key(xref, key)
+        if value_type == "xref": value = doc.xref_object(int(value.split()[0])) # indirect number
+        return int(value.strip())
+
+    with PdfDoc(pdf_path) as doc:
+        return [(GetInt(doc, xref, "Width"), GetInt(doc, xref, "Height")) for xref in xrefs]
+
+def PdfGetPageNum(pdf_path: str) -> int:
+    """
+    Get the number of pages of PDF file
     """
     from pymupdf import Document as PdfDoc
-    from pymupdf import Page as PdfPage
+
+    with PdfDoc(pdf_path) as doc:
+        return len(doc)
+
+def PdfExtractXrefs(pdf_path: str, output_dir: str, xrefs: list[int]) -> list[str]:
+    """
+    Extract the images of the given xrefs from PDF file, see `PdfExtractImages`
+
+    Args:
+        pdf_path: PDF file path
+        output_dir: Output directory path
+        xrefs: xrefs of images to extract
+        return: paths of the extracted images
+    """
+    from pymupdf import Document as PdfDoc
+
+    with PdfDoc(pdf_path) as doc:
+        return PdfSaveImages(doc, output_dir, xrefs)
+
+def PdfSaveImages(doc, output_dir: str, xrefs: list[int]) -> list[str]:
+    """
+    Save the images of the given xrefs of an open PDF document, see `PdfExtractImages`
+
+    Args:
+        doc: Open pymupdf document
+        output_dir: Output directory path
+        xrefs: xrefs of images to extract
+        return: paths of the extracted images
+    """
     from pymupdf import Pixmap as PdfPixmap
+    from pymupdf import csRGB
+
+    image_paths = []
+    for xref in xrefs:
+        # extract image bytes and smask
+        base_image = doc.extract_image(xref)
+        image_bytes = base_image["image"]
+        image_smask = base_image["smask"]
+        image_ext = base_image["ext"]
+
+        # without mask, images in a storable format are written as is, others are converted
+        if image_smask == 0:
+            if image_ext in PDF_RAW_IMAGE_EXTS:
+                image_path = f"{output_dir}/{xref}.{image_ext}"
+                with open(image_path, "wb") as f:
+                    f.write(image_bytes)
+            else:
+                image_path = f"{output_dir}/{xref}.png"
+                pix = PdfPixmap(image_bytes)
+                if pix.colorspace is not None and pix.colorspace.n == 4: pix = PdfPixmap(csRGB, pix) # PNG has no CMYK
+                pix.save(image_path)
+        # with mask, save with alpha channel
+        else:
+            image_path = f"{output_dir}/{xref}.png"
+            pix = PdfPixmap(image_bytes)
+            mask = PdfPixmap(doc.extract_image(image_smask)["image"])
+            pix_a = PdfPixmap(pix, mask)
+            pix_a.save(image_path)
+        image_paths.append(image_path)
+    return image_paths
 
-    doc = page.parent  # the owning document
-    if not doc.xref_is_image(xref):
-        raise ValueError("xref not an image")  # insert new image anywhere in page
-    if bool(filename) + bool(stream) + bool(pixmap) != 1:
-        raise ValueError("Exactly one of filename/stream/pixmap must be given")
-    new_xref = page.insert_image(
-        page.rect, filename=filename, stream=stream, pixmap=pixmap
-    )
-    doc.xref_copy(new_xref, xref)  # copy over new to old
-    page.delete_image(new_xref) # delete the new image reference
-    last_contents_xref = page.get_contents()[-1]
-
-    # new image insertion has created a new /Contents source,
-    # which we will set to spaces now
-    doc.update_stream(last_contents_xref, b" ")
-    page._image_info = None  # clear cache of extracted image information
+PDF_COLOR_SPACES = {"L": "/DeviceGray", "RGB": "/DeviceRGB", "CMYK": "/DeviceCMYK"} # Pillow mode -> PDF color space
 
-    
+def PdfMakeImageStreams(image_path: str) -> tuple[dict[str, str], bytes, bytes | None]:
+    """
+    Make the stream of a PDF image XObject from an image file.
+    JPEG data is used as is (DCTDecode), other images are decoded and deflated (FlateDecode),
+    their alpha channel goes into a separate soft mask stream
+
+    Args:
+        image_path: image file path
+        return: (image dictionary entries, image stream, deflated 8-bit soft mask stream or None)
+    """
+    import zlib
+    from PIL import Image
+
+    with Image.open(image_path) as img:
+        keys = {"Width": str(img.width), "Height": str(img.height), "BitsPerComponent": "8"}
+        # JPEG data passes through without being decoded again
+        if img.format == "JPEG" and img.mode in PDF_COLOR_SPACES:
+            keys["Filter"] = "/DCTDecode"
+            keys["ColorSpace"] = PDF_COLOR_SPACES[img.mode]
+            # CMYK JPEG files with the Adobe marker store inverted values
+            if img.mode == "CMYK" and "adobe" in img.info: keys["Decode"] = "[1 0 1 0 1 0 1 0]"
+            return keys, ReadFileBytes(image_path), None
+
+        img.load()
+        alpha = None
+        if "A" in img.mode or "transparency" in img.info:
+            img = img.convert("LA" if img.mode in ("L", "LA", "1") else "RGBA")
+            alpha = zlib.compress(img.getchannel("A").tobytes())
+            img = img.convert(img.mode[:-1])
+        elif img.mode not in PDF_COLOR_SPACES:
+            img = img.convert("L" if img.mode in ("1", "I", "I;16", "F") else "RGB")
+        keys["Filter"] = "/FlateDecode"
+        keys["ColorSpace"] = PDF_COLOR_SPACES[img.mode]
+        return keys, zlib.compress(img.tobytes()), alpha
+
+def PdfReplaceImageStream(doc, xref: int, image_path: str):
+    """
+    Replace the image XObject referred to by xref in place, by updating its stream and dictionary.
+    Every page referring to the xref shows the new image, no page content is touched
+
+    Args:
+        doc: pymupdf document
+        xref: the xref of the image to replace
+        image_path: new image file path
+    """
+    keys, stream, alpha = PdfMakeImageStreams(image_path)
+    # Updating the stream without compression drops the old filter
+    doc.update_stream(xref, stream, compress=0)
+    for key in ("DecodeParms", "Decode", "SMask"):
+        if doc.xref_get_key(xref, key)[0] != "null": doc.xref_set_key(xref, key, "null")
+    # A color key mask no longer matches the colors of the new image, an explicit mask scales with it
+    if doc.xref_get_key(xref, "Mask")[0] == "array": doc.xref_set_key(xref, "Mask", "null")
+    for key, value in keys.items():
+        doc.xref_set_key(xref, key, value)
+
+    # The alpha channel is written as a new soft mask, the old one is removed when saving with garbage collection
+    if alpha is not None:
+        smask_xref = doc.get_new_xref()
+        doc.update_object(smask_xref, "<< /Type /XObject /Subtype /Image >>")
+        doc.update_stream(smask_xref, alpha, compress=0)
+        smask_keys = {"Width": keys["Width"], "Height": keys["Height"], "BitsPerComponent": "8",
+                      "ColorSpace": "/DeviceGray", "Filter": "/FlateDecode"}
+        for key, value in smask_keys.items():
+            doc.xref_set_key(smask_xref, key, value)
+        doc.xref_set_key(xref, "SMask", f"{smask_xref} 0 R")
 
 def PdfReplaceImages(pdf_path: str, images: dict[int, str], output_pdf_path: str):
     """
-    Replace images in PDF file with specified images
+    Replace images in PDF file with specified images.
+    Each xref is replaced once however many pages refer to it, so time grows linearly with the number of images
     
     Args:
         pdf_path: original PDF path
@@ -374,48 +711,109 @@ def PdfReplaceImages(pdf_path: str, images: dict[int, str], output_pdf_path: str
         output_pdf_path: output PDF path
     """
     from pymupdf import Document as PdfDoc
-    from pymupdf import Page as PdfPage
-    from pymupdf import Pixmap as PdfPixmap
 
     # open the PDF file
     doc = PdfDoc(pdf_path)
 
-    # traverse each page, collect all images in the PDF
-    all_images: list[tuple[PdfPage, int]] = []
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        image_list = page.get_images(full=True)
-        for img_info in image_list:
-            xref = img_info[0]
-            all_images.append((page, xref))
-        
-    # traverse each image in the PDF, replace it with the corresponding image
-    for page, xref in all_images:
-        image_path = images.get(xref)
-        if image_path is None: continue
-        PdfReplaceOneImage(page, xref, filename=image_path)
+    # replace each image in place
+    for xref, image_path in images.items():
+        if not doc.xref_is_image(xref): continue
+        PdfReplaceImageStream(doc, xref, image_path)
     
     # save the modified PDF
     doc.ez_save(output_pdf_path, deflate_images=False, garbage=4)
     doc.close()
 
-def PdfGetFirstImage(pdf_path: str) -> tuple[int, dict] | tuple[None, None]:
+def PdfUpdateImages(pdf_path: str, images: dict[int, str], catalog_keys: dict[str, str] = {}):
+    """
+    Replace images in PDF file in place with an incremental save, which appends only the changed objects.
+    The catalog keys are set in the same save, so that they are written together with the images
+
+    Args:
+        pdf_path: PDF file path, it must not need repairing
+        images: dict{xref: image path}
+        catalog_keys: dict{key: value in PDF syntax} set in the document catalog, "null" to remove a key
+    """
+    from pymupdf import Document as PdfDoc
+
+    doc = PdfDoc(pdf_path)
+    for xref, image_path in images.items():
+        if not doc.xref_is_image(xref): continue
+        PdfReplaceImageStream(doc, xref, image_path)
+    for key, value in catalog_keys.items():
+        doc.xref_set_key(doc.pdf_catalog(), key, value)
+    doc.saveIncr()
+    doc.close()
+    # The save is the checkpoint, force it to disk
+    with open(pdf_path, "rb+") as f:
+        os.fsync(f.fileno())
+
+def PdfGetCatalogKey(pdf_path: str, key: str) -> str | None:
     """
-    Get the xref and information of the first image in the PDF file.
+    Get the value (in PDF syntax) of a key in the document catalog of PDF file, None if the key is not set
+    """
+    from pymupdf import Document as PdfDoc
+
+    with PdfDoc(pdf_path) as doc:
+        value_type, value = doc.xref_get_key(doc.pdf_catalog(), key)
+    return None if value_type == "null" else value
+
+def PdfCompact(pdf_path: str, output_pdf_path: str, catalog_keys: dict[str, str] = {}):
+    """
+    Save PDF file to a new file without unused objects, e.g. image streams replaced by incremental saves
+
+    Args:
+        pdf_path: PDF file path
+        output_pdf_path: output PDF path
+        catalog_keys: dict{key: value in PDF syntax} set in the document catalog, "null" to remove a key
     """
     from pymupdf import Document as PdfDoc
-    from pymupdf import Page as PdfPage
-    from pymupdf import Pixmap as PdfPixmap
 
-    # open the PDF file
     doc = PdfDoc(pdf_path)
-    # traverse each page
-    for page in doc:
-        image_list = page.get_images(full=True) # get image list
-        if len(image_list) > 0:
-            xref = image_list[0][0]
-            return xref, doc.extract_image(xref)
-    return None, None
+    for key, value in catalog_keys.items():
+        doc.xref_set_key(doc.pdf_catalog(), key, value)
+    doc.ez_save(output_pdf_path, deflate_images=False, garbage=4)
+    doc.close()
+
+def PdfGetFirstImage(pdf_path: str) -> int | None:
+    """
+    Get the xref of the first image in the PDF file, pages after it are not looked at.
+    """
+    from pymupdf import Document as PdfDoc
+
+    with PdfDoc(pdf_path) as doc:
+        for page_num in range(len(doc)):
+            image_list = doc.get_page_images(page_num) # get image list without loading the page
+            if len(image_list) > 0: return image_list[0][0]
+    return None
+
+
+##################################################################
+##                Functions for Image Operations                ##
+##################################################################
+
+def LoadImage(image_path: str):
+    """
+    Load and decode an image, the file is closed after loading
+    Args:
+        image_path: Image file path
+        return: Decoded PIL image
+    """
+    from PIL import Image
+    with Image.open(image_path) as img:
+        img.load()
+        return img
+
+def GetImageSize(image_path: str) -> tuple[int, int]:
+    """
+    Get the size of an image, only the image header is read
+    Args:
+        image_path: Image file path
+        return: (width, height)
+    """
+    from PIL import Image
+    with Image.open(image_path) as img:
+        return img.size
 
 
 ##############################################################